@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+הרצת התאמות בנק באצווה – תיקייה של קבצי DataSheet (+ קובצי עזר לכלל 3).
+
+    python recon_batch.py INPUT_DIR [-o OUT_DIR] [-j JOBS] [--summary-csv PATH] [--carry-forward --account NAME]
+                          [--format xlsx|parquet] [--partitioned [--memory-mb MB]] [--pairs]
+
+זיהוי זוגות: לכל NAME.xlsx (או ‎.csv / ‎.parquet), קובץ העזר הוא NAME_aux או NAME_עזר
+(אם קיים, בכל אחת מהסיומות). כל זוג מעובד בתהליך נפרד (ProcessPoolExecutor); לכל
+קובץ נכתב NAME_התאמות.xlsx (או ‎.parquet עם --format parquet), ובסוף מודפס סיכום משותף.
+עם --partitioned קבצים גדולים מהזיכרון מעובדים במצב מחולק (process_workbook_partitioned):
+קריאה בחתיכות, מחיצות לפי מפתחות הכללים בתקציב --memory-mb, וכתיבה זורמת לקובץ.
+עם --carry-forward הקבצים רצים ברצף לפי סדר השמות (חודש אחרי חודש), וכל קובץ
+מותאם גם מול הפריטים הפתוחים של הקודמים לו (open_items.db) – רק בתוך החשבון
+--account (תיקייה אחת = חשבון אחד).
+עם --pairs נכתב גם NAME_התאמות_זוגות.parquet (‎.csv בלי pyarrow) – יומן הזוגות:
+איזו שורת בנק הותאמה לאילו שורות ספרים, באיזה כלל ובאיזה פער.
+"""
+
+import argparse, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from recon_engine import process_workbook_cached, process_workbook_partitioned, PAIRS_FILE_EXT
+
+AUX_SUFFIXES  = ("_aux", "_עזר")
+OUTPUT_SUFFIX = "_התאמות"
+PAIRS_SUFFIX  = "_זוגות"
+INPUT_EXTS    = (".xlsx", ".csv", ".parquet")
+
+def find_pairs(input_dir):
+    """[(main_path, aux_path|None)] לפי שם הקובץ, ממוין."""
+    stems = {}
+    for name in os.listdir(input_dir):
+        stem, ext = os.path.splitext(name)
+        if (ext.lower() not in INPUT_EXTS or name.startswith("~$")
+                or stem.endswith((OUTPUT_SUFFIX, OUTPUT_SUFFIX + PAIRS_SUFFIX))):
+            continue
+        stems[stem] = os.path.join(input_dir, name)
+
+    aux_of = {}
+    for stem, path in stems.items():
+        for suf in AUX_SUFFIXES:
+            if stem.endswith(suf) and stem[:-len(suf)] in stems:
+                aux_of[stem[:-len(suf)]] = path
+    aux_paths = set(aux_of.values())
+    return [(path, aux_of.get(stem)) for stem, path in sorted(stems.items()) if path not in aux_paths]
+
+def run_pair(main_path, aux_path, out_dir, carry_forward=False, output_format="xlsx", memory_budget=None,
+             pairs=False, account=""):
+    """
+    עיבוד זוג אחד (רץ בתהליך עובד); memory_budget – מצב מחולק; pairs – גם קובץ
+    יומן זוגות. מחזיר שורת סיכום.
+    """
+    t0 = time.perf_counter()
+    row = {"קובץ": os.path.basename(main_path),
+           "עזר": os.path.basename(aux_path) if aux_path else ""}
+    try:
+        aux_bytes = None
+        if aux_path:
+            with open(aux_path, "rb") as f:
+                aux_bytes = f.read()
+        stem = os.path.splitext(os.path.basename(main_path))[0]
+        out_path = os.path.join(out_dir, stem + OUTPUT_SUFFIX + "." + output_format)
+        pairs_out = os.path.join(out_dir, stem + OUTPUT_SUFFIX + PAIRS_SUFFIX + PAIRS_FILE_EXT) if pairs else None
+
+        if memory_budget is not None:
+            counts = process_workbook_partitioned(main_path, aux_bytes, out_path, memory_budget=memory_budget,
+                                                  pairs_out=pairs_out)
+        else:
+            with open(main_path, "rb") as f:
+                main_bytes = f.read()
+            counts, out_bytes = process_workbook_cached(main_bytes, aux_bytes, carry_forward=carry_forward,
+                                                        account=account,
+                                                        source_name=os.path.basename(main_path),
+                                                        output_format=output_format, pairs_out=pairs_out)
+            if counts is not None:
+                with open(out_path, "wb") as f:
+                    f.write(out_bytes)
+        if counts is None:
+            row["שגיאה"] = "לא נמצאו נתונים"
+        else:
+            row["שורות"] = sum(counts.values())
+            row["פתוחות (0)"] = counts.get(0, 0)
+            row.update({f"כלל {k}": v for k, v in counts.items() if k})
+    except Exception as e:
+        row["שגיאה"] = f"{type(e).__name__}: {e}"
+    row["שניות"] = round(time.perf_counter() - t0, 2)
+    return row
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="התאמות בנק 1–12 לתיקייה של קבצים, במקביל.")
+    ap.add_argument("input_dir", help="תיקייה עם קבצי DataSheet (+ NAME_aux.xlsx לכלל 3)")
+    ap.add_argument("-o", "--out-dir", help="תיקיית פלט (ברירת מחדל: INPUT_DIR/התאמות)")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="מס' תהליכים")
+    ap.add_argument("--summary-csv", help="שמירת הסיכום המשותף כ-CSV")
+    ap.add_argument("--carry-forward", action="store_true",
+                    help="התאמה מול פריטים פתוחים של קבצים קודמים (ברצף, לפי סדר השמות)")
+    ap.add_argument("--account", default="", help="חשבון/ישות לפריטים הפתוחים (חובה עם --carry-forward)")
+    ap.add_argument("--format", choices=("xlsx", "parquet"), default="xlsx",
+                    help="פורמט פלט (parquet – DataSheet + מס' התאמה בלבד)")
+    ap.add_argument("--partitioned", action="store_true",
+                    help="מצב מחולק לקבצים גדולים מהזיכרון (פלט xlsx, בלי --carry-forward)")
+    ap.add_argument("--memory-mb", type=int, default=512, help="תקציב זיכרון לקובץ במצב מחולק (MB)")
+    ap.add_argument("--pairs", action="store_true",
+                    help=f"גם יומן זוגות לכל קובץ (NAME{OUTPUT_SUFFIX}{PAIRS_SUFFIX}{PAIRS_FILE_EXT})")
+    args = ap.parse_args(argv)
+    if args.partitioned and (args.carry_forward or args.format != "xlsx"):
+        ap.error("--partitioned תומך רק בפלט xlsx ובלי --carry-forward.")
+    if args.carry_forward and not args.account.strip():
+        ap.error("--carry-forward דורש --account (פריטים פתוחים מותאמים רק בתוך אותו חשבון).")
+    budget = args.memory_mb * 2**20 if args.partitioned else None
+
+    out_dir = args.out_dir or os.path.join(args.input_dir, "התאמות")
+    os.makedirs(out_dir, exist_ok=True)
+    pairs = find_pairs(args.input_dir)
+    if not pairs:
+        print("לא נמצאו קבצי קלט (xlsx/csv/parquet).", file=sys.stderr)
+        return 1
+
+    rows = []
+
+    def done(n, row):
+        rows.append(row)
+        status = row.get("שגיאה") or f"{row['שורות']} שורות"
+        print(f"[{n}/{len(pairs)}] {row['קובץ']}: {status} ({row['שניות']}s)", flush=True)
+
+    if args.carry_forward:
+        # כל קובץ תלוי בפריטים הפתוחים של הקודמים לו – ברצף
+        for n, (m, a) in enumerate(pairs, start=1):
+            done(n, run_pair(m, a, out_dir, carry_forward=True, output_format=args.format, pairs=args.pairs,
+                             account=args.account.strip()))
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(pairs)))) as ex:
+            futures = [ex.submit(run_pair, m, a, out_dir, output_format=args.format, memory_budget=budget,
+                                 pairs=args.pairs) for m, a in pairs]
+            for n, fut in enumerate(as_completed(futures), start=1):
+                done(n, fut.result())
+
+    summary = pd.DataFrame(rows).sort_values("קובץ").reset_index(drop=True)
+    rule_cols = sorted((c for c in summary.columns if c.startswith("כלל ")), key=lambda c: int(c.split()[1]))
+    head = [c for c in ["קובץ", "עזר", "שורות", "פתוחות (0)"] if c in summary.columns]
+    tail = [c for c in ["שניות", "שגיאה"] if c in summary.columns]
+    summary = summary[head + rule_cols + tail]
+    summary[rule_cols] = summary[rule_cols].fillna(0).astype(int)
+    for c in ("שורות", "פתוחות (0)"):
+        if c in summary.columns:
+            summary[c] = summary[c].astype("Int64")
+    if "שגיאה" in summary.columns:
+        summary["שגיאה"] = summary["שגיאה"].fillna("")
+
+    print()
+    print(summary.to_string(index=False))
+    if "שורות" in summary.columns:
+        total, open_ = summary["שורות"].sum(), summary["פתוחות (0)"].sum()
+        if total:
+            print(f"\nסה\"כ: {int(total)} שורות, {int(total - open_)} הותאמו ({(total - open_) / total:.1%})")
+    if args.summary_csv:
+        summary.to_csv(args.summary_csv, index=False, encoding="utf-8-sig")
+
+    return 1 if "שגיאה" in summary.columns and (summary["שגיאה"] != "").any() else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+מחולל נתונים סינתטיים + מדידת ביצועים להתאמות בנק.
+
+    python recon_bench.py generate ROWS [-o OUT_DIR] [--seed N]
+    python recon_bench.py run [--sizes 1000,10000,100000] [--repeat 3]
+                              [--baseline bench_baseline.json] [--save] [--threshold 0.25]
+
+generate – DataSheet + קובץ עזר דטרמיניסטיים (אותו seed → אותם קבצים), בשמות
+העמודות האמיתיים ובתמהיל קודים/אסמכתאות שמפעיל את כל הכללים.
+run – זמן לכל שלב (RunReport) ולהרצה המלאה, לכל גודל; עם --save נשמר baseline
+ל-JSON, ובלי – משווים מולו ונכשלים (exit 1) אם התפוקה ירדה מעבר לסף.
+"""
+
+import argparse, json, os, platform, sys, time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from recon_engine import (RunReport, process_workbook, export_workbook, DEFAULT_NAME_MAP,
+                          MATCH_COLS, BANK_CODES, BANK_AMTS, BOOKS_AMTS, REF1S, REF2S, DATES, DETAILS,
+                          AUX_DATE_KEYS, AUX_AMT_KEYS, AUX_PAYNO_KEYS, OVRC_CODES, STANDING_CODES,
+                          TRANSFER_CODE, TRANSFER_PHRASE, RULE4_CODE, RULE5_CODES, RULE6_COMPANY,
+                          RULE7_CODE, RULE7_PHRASE, RULE8_CODE, RULE8_PHRASE, RULE9_CODE, RULE9_PHRASE,
+                          RULE10_CODES)
+
+DEFAULT_SIZES     = (1_000, 10_000, 100_000)
+DEFAULT_BASELINE  = "bench_baseline.json"
+DEFAULT_THRESHOLD = 0.25            # ירידה מותרת בתפוקה (25%)
+MIN_STAGE_SECONDS = 0.05            # שלבים קצרים מזה – רעש, לא נבדקים
+
+BASE_DATE = datetime(2025, 1, 1)
+DAYS      = 60
+
+# תמהיל תנועות (חלק מהתנועות; כל תנועה = שורת בנק + 0..n שורות ספרים)
+MIX = {"ovrc": 0.15, "standing": 0.10, "cheque": 0.15, "bt": 0.15, "aux": 0.15, "misc": 0.30}
+ROWS_PER_TX = 1.7                   # ממוצע שורות לתנועה בתמהיל הנ"ל
+
+# ---------------- Generator ----------------
+def _dates(rng, n):
+    return pd.Timestamp(BASE_DATE) + pd.to_timedelta(rng.integers(0, DAYS, n), unit="D")
+
+def _amounts(rng, n, lo=10, hi=5000):
+    return np.round(rng.uniform(lo, hi, n), 2)
+
+def _frame(n, **cols):
+    out = {"match": np.zeros(n, dtype=np.int64), "code": np.full(n, np.nan),
+           "bamt": np.full(n, np.nan), "aamt": np.full(n, np.nan),
+           "ref1": np.full(n, "", dtype=object), "ref2": np.full(n, "", dtype=object),
+           "date": None, "det": np.full(n, "", dtype=object)}
+    out.update(cols)
+    return pd.DataFrame(out)
+
+def _pick(rng, values, n):
+    values = list(values)
+    return np.asarray(values, dtype=object)[rng.integers(0, len(values), n)]
+
+def _ids(prefix, ids):
+    return (prefix + pd.Series(ids).astype(str)).to_numpy(dtype=object)
+
+def generate_ledger(n_rows: int, seed: int = 0):
+    """
+    (df, aux_df) – DataSheet עם כ-n_rows שורות וקובץ העזר לכלל 3, דטרמיניסטי לפי seed.
+    """
+    rng = np.random.default_rng(seed)
+    n_tx = int(np.ceil(n_rows / ROWS_PER_TX * 1.02))
+    kind = rng.choice(list(MIX), size=n_tx, p=list(MIX.values()))
+    n = {k: int((kind == k).sum()) for k in MIX}
+    tx = {k: np.flatnonzero(kind == k) for k in MIX}
+    parts = []
+
+    # 1: OV/RC – בנק שלילי, ספרים חיובי באותו תאריך (80% עם צד ספרים)
+    k = n["ovrc"]; amt = _amounts(rng, k); d = _dates(rng, k)
+    parts.append(_frame(k, code=_pick(rng, OVRC_CODES, k).astype(float), bamt=-amt, date=d))
+    b = rng.random(k) < 0.8
+    parts.append(_frame(int(b.sum()), aamt=amt[b], date=d[b],
+                        ref1=_pick(rng, ["OV", "RC"], int(b.sum())) + _ids("", tx["ovrc"][b])))
+
+    # 2: הוראות קבע – פרטים מהמאגר (חלקם עם סיומת / לא מוכרים)
+    k = n["standing"]
+    names = list(DEFAULT_NAME_MAP) + ["ספק לא מוכר", "משהו אחר"]
+    det = _pick(rng, names, k) + np.where(rng.random(k) < 0.3, " 123", "")
+    parts.append(_frame(k, code=_pick(rng, STANDING_CODES, k).astype(float), bamt=-_amounts(rng, k),
+                        det=det, date=_dates(rng, k)))
+
+    # 4: שיקים – Ref1 בנק (עם אפס מוביל) ↔ Ref2 ספרים, חלקם בטולרנס
+    k = n["cheque"]; amt = _amounts(rng, k); d = _dates(rng, k)
+    ch = pd.Series(rng.integers(1000, 100_000, k)).astype(str).to_numpy(dtype=object)
+    parts.append(_frame(k, code=np.full(k, float(RULE4_CODE)), bamt=-amt, ref1="0" + ch, date=d))
+    b = rng.random(k) < 0.8
+    parts.append(_frame(int(b.sum()), aamt=np.round(amt[b] + _pick(rng, [0, 0, 0.3, 0.7], int(b.sum())).astype(float), 2),
+                        ref1=_ids("CH", tx["cheque"][b]), ref2=ch[b], date=d[b]))
+
+    # 11: העברות BT – בנק 485, ספרים BT באותו סכום מוחלט (60%)
+    k = n["bt"]; amt = _amounts(rng, k); d = _dates(rng, k)
+    sign = np.where(rng.random(k) < 0.6, 1.0, -1.0)
+    parts.append(_frame(k, code=np.full(k, float(TRANSFER_CODE)), bamt=amt * sign, date=d,
+                        det=np.where(rng.random(k) < 0.5, TRANSFER_PHRASE, "x").astype(object)))
+    b = rng.random(k) < 0.6
+    parts.append(_frame(int(b.sum()), aamt=amt[b] * _pick(rng, [1.0, -1.0], int(b.sum())).astype(float),
+                        ref1=_ids("BT", tx["bt"][b]), date=d[b]))
+
+    # 3: אירועי מקבץ-נט – 1..4 תשלומים בעזר, שורת בנק אחת בסכום הכולל, שורת ספרים לכל תשלום
+    k = n["aux"]; d = _dates(rng, k)
+    cnt = rng.integers(1, 5, k)
+    ev = np.repeat(np.arange(k), cnt)
+    part = _amounts(rng, len(ev), 10, 800)
+    seq = np.arange(len(ev)) - np.repeat(np.cumsum(cnt) - cnt, cnt)
+    pay = (_ids("P", tx["aux"][ev]) + "_" + pd.Series(seq).astype(str).to_numpy(dtype=object))
+    evt = pd.Timestamp(BASE_DATE) + pd.to_timedelta(tx["aux"], unit="min")
+    total = np.round(np.bincount(ev, weights=part, minlength=k), 2)
+    parts.append(_frame(k, code=np.full(k, float(TRANSFER_CODE)), bamt=total, date=d,
+                        det=np.full(k, TRANSFER_PHRASE, dtype=object)))
+    off = np.where(rng.random(len(ev)) < 0.1, 1.0, 0.0)         # ~10% פער → גיליון פערים
+    parts.append(_frame(len(ev), aamt=-(part + off), ref1=pay, date=d[ev]))
+    aux_df = pd.DataFrame({AUX_DATE_KEYS[0]: evt[ev], AUX_AMT_KEYS[0]: part, AUX_PAYNO_KEYS[0]: pay})
+
+    # 5–10 + רעש: עמלות, פאיימי, שיקים ממשמרת וכו'
+    k = n["misc"]; amt = _amounts(rng, k)
+    codes = list(RULE5_CODES) + [175, RULE7_CODE, RULE8_CODE, RULE9_CODE] + list(RULE10_CODES) + [999]
+    dets = [RULE6_COMPANY, RULE7_PHRASE, RULE8_PHRASE, RULE9_PHRASE, "zzz"]
+    bamt = np.where(rng.random(k) < 0.5, amt, -amt)
+    bamt = np.where(rng.random(k) < 0.2, np.round(amt / 10, 2), bamt)
+    parts.append(_frame(k, code=_pick(rng, codes, k).astype(float), bamt=bamt,
+                        det=_pick(rng, dets, k), date=_dates(rng, k)))
+
+    df = pd.concat(parts, ignore_index=True)
+    # גודל מדויק: דילול אקראי, ואז סדר דף בנק (לפי תאריך)
+    if len(df) > n_rows:
+        df = df.iloc[np.sort(rng.choice(len(df), n_rows, replace=False))]
+    df = df.iloc[np.lexsort((rng.random(len(df)), df["date"].to_numpy()))].reset_index(drop=True)
+    df.columns = [MATCH_COLS[0], BANK_CODES[0], BANK_AMTS[0], BOOKS_AMTS[0],
+                  REF1S[0], REF2S[0], DATES[0], DETAILS[0]]
+    return df, aux_df
+
+def generate_workbooks(n_rows: int, seed: int = 0):
+    """(main_bytes, aux_bytes) – קבצי xlsx כמו שמעלים לאפליקציה."""
+    df, aux_df = generate_ledger(n_rows, seed)
+    return export_workbook([("DataSheet", df)]), export_workbook([("עזר", aux_df)])
+
+# ---------------- Benchmark ----------------
+def bench_size(n_rows: int, repeat: int = 3, seed: int = 0) -> dict:
+    """
+    זמני שלבים (המינימום מבין repeat הרצות) + הרצה מלאה לגודל אחד.
+    """
+    main_bytes, aux_bytes = generate_workbooks(n_rows, seed)
+    best_total, best = None, {}
+    for _ in range(repeat):
+        report = RunReport(trace_memory=False)
+        t0 = time.perf_counter()
+        process_workbook(main_bytes, aux_bytes, report)
+        total = time.perf_counter() - t0
+        best_total = total if best_total is None else min(best_total, total)
+        for rec in report.stages:
+            name = rec["שלב"]
+            best[name] = rec["שניות"] if name not in best else min(best[name], rec["שניות"])
+    return {"rows": n_rows, "total": round(best_total, 4), "stages": best}
+
+def run_bench(sizes=DEFAULT_SIZES, repeat=3, seed=0) -> dict:
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "sizes": {str(n): bench_size(n, repeat, seed) for n in sizes},
+    }
+
+def compare(result: dict, baseline: dict, threshold=DEFAULT_THRESHOLD):
+    """
+    (טבלת השוואה, רשימת רגרסיות). רגרסיה = תפוקה (שורות/שנייה) נמוכה
+    מ-baseline ביותר מ-threshold, בהרצה המלאה או בשלב שאורכו ≥ MIN_STAGE_SECONDS.
+    """
+    rows, regressions = [], []
+    for size, cur in result["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if base is None:
+            continue
+        items = [("הרצה מלאה", base["total"], cur["total"])]
+        items += [(name, sec, cur["stages"].get(name)) for name, sec in base["stages"].items()]
+        for name, b_sec, c_sec in items:
+            if c_sec is None or b_sec is None:
+                continue
+            ratio = b_sec / c_sec if c_sec else float("inf")      # תפוקה נוכחית / baseline
+            checked = name == "הרצה מלאה" or b_sec >= MIN_STAGE_SECONDS
+            bad = checked and ratio < 1 - threshold
+            rows.append({"שורות": cur["rows"], "שלב": name, "baseline (s)": b_sec, "נוכחי (s)": c_sec,
+                         "תפוקה יחסית": round(ratio, 2), "רגרסיה": "✗" if bad else ""})
+            if bad:
+                regressions.append(f"{size} שורות / {name}: {b_sec}s → {c_sec}s ({ratio:.0%} מהתפוקה)")
+    return pd.DataFrame(rows), regressions
+
+def _print_result(result):
+    for size, r in result["sizes"].items():
+        print(f"\n{size} שורות – {r['total']}s ({r['rows'] / r['total']:,.0f} שורות/שנייה)")
+        for name, sec in r["stages"].items():
+            print(f"  {name:<20} {sec:>9.4f}s")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="מחולל נתונים ומדידת ביצועים להתאמות בנק.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    g = sub.add_parser("generate", help="יצירת DataSheet + קובץ עזר סינתטיים")
+    g.add_argument("rows", type=int)
+    g.add_argument("-o", "--out-dir", default=".")
+    g.add_argument("--seed", type=int, default=0)
+
+    r = sub.add_parser("run", help="מדידה מול baseline")
+    r.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="רשימת גדלים, מופרדת בפסיקים")
+    r.add_argument("--repeat", type=int, default=3)
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--baseline", default=DEFAULT_BASELINE)
+    r.add_argument("--save", action="store_true", help="שמירת התוצאה כ-baseline חדש")
+    r.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="ירידת תפוקה מותרת (0.25 = 25%%)")
+    args = ap.parse_args(argv)
+
+    if args.cmd == "generate":
+        os.makedirs(args.out_dir, exist_ok=True)
+        main_bytes, aux_bytes = generate_workbooks(args.rows, args.seed)
+        stem = os.path.join(args.out_dir, f"synthetic_{args.rows}")
+        for path, data in ((stem + ".xlsx", main_bytes), (stem + "_aux.xlsx", aux_bytes)):
+            with open(path, "wb") as f:
+                f.write(data)
+            print(path)
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    result = run_bench(sizes, args.repeat, args.seed)
+    _print_result(result)
+
+    if args.save:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nbaseline נשמר: {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"\nאין baseline ({args.baseline}) – הריצי עם --save.", file=sys.stderr)
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    table, regressions = compare(result, baseline, args.threshold)
+    if not table.empty:
+        print()
+        print(table.to_string(index=False))
+    if regressions:
+        print("\nרגרסיה בביצועים:", file=sys.stderr)
+        for line in regressions:
+            print("  " + line, file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
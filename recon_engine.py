@@ -0,0 +1,3143 @@
+# -*- coding: utf-8 -*-
+"""
+מנוע התאמות בנק – 1 עד 12 (גרסת סכומים קשיחה לכלל 3)
+- כלל 1: OV/RC 1:1 (תאריך+סכום; אופציונלית ±RULE1_DATE_WINDOW ימים, הקרוב קודם)
+- כלל 2: הוראות קבע (469/515) + 'הוראת קבע ספקים':
+    כל השורות בחובה; שורת סיכום 20001 בזכות = סה״כ חובה
+    של שורות עם מס’ ספק. שורות בלי מס’ ספק צבועות כתום, עם 'הצעות ספק' (טריגרמות).
+- כלל 3: העברות (485, 'העב' במקבץ-נט') – מסמן רק אם קיים
+    צד בנק וגם צד ספרים ושוויי־סכום (במונחי ערך מוחלט).
+    אין דרישת התאמת תאריך. אם אין התאמה → גיליון 'פערי סכומים – כלל 3'.
+- כלל 4: שיקים ספקים (493) עם טולרנס סכום על התאמת אסמכתאות (Ref1 בנק ↔ Ref2 ספרים).
+- כללים 5–10: טבלת כללים (default_simple_rules / rules_table.json) – מעבר אחד.
+- כלל 11: התאמות BT (קוד 485 מול אסמכתא BT) – לפי סכום מוחלט.
+- רבים-לאחד (כללים 3, 11, SUBSET_MAX_GROUP > 1): שורת בנק = צירוף שורות ספרים פתוחות.
+- 12: placeholder.
+- עיצוב: RTL, A4 לרוחב, Fit-to-width=1, שוליים נוחים.
+- קלט: xlsx / CSV / Parquet (snapshot מפוענח של xlsx נשמר לפי hash); פלט: xlsx או Parquet.
+- מצב מחולק (process_workbook_partitioned): קבצים גדולים מהזיכרון – מחיצות לפי מפתחות הכללים.
+- יומן זוגות (PairLedger): כללי הצימוד רושמים בנק ↔ ספרים בזמן ההחלטה → גיליון 'זוגות התאמה'.
+- חקירת תוצאות (ResultExplorer): סינון/מיון/עמודים בצד השרת על ה-DataSheet המעובד.
+
+ללא תלות ב-Streamlit – משמש את streamlit_app.py ואת recon_batch.py.
+"""
+
+import io, os, re, json, numbers, sqlite3, hashlib, tempfile, threading, time, tracemalloc, uuid, warnings
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, replace
+from itertools import chain, combinations, islice
+from datetime import date, datetime
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+from pandas.tseries.api import guess_datetime_format
+
+try:
+    import python_calamine          # קריאת xlsx מהירה (אופציונלי)
+except ImportError:
+    python_calamine = None
+
+try:
+    import pyarrow as pa            # snapshots של קלט + Parquet (אופציונלי)
+    import pyarrow.ipc  # noqa: F401 – טוען את pa.ipc
+except ImportError:
+    pa = None
+
+# ---------------- Constants ----------------
+STANDING_CODES = {469, 515}         # כלל 2
+OVRC_CODES     = {120, 175}         # כלל 1
+RULE1_DATE_WINDOW = 0               # כלל 1 – ±ימים בין תאריך בנק לספרים (0 = תאריך זהה)
+TRANSFER_CODE  = 485                # כלל 3
+TRANSFER_PHRASE = "העב' במקבץ-נט"
+RULE4_CODE     = 493                # כלל 4
+RULE4_EPS      = 0.50               # טולרנס כלל 4
+
+# כלל 3 – התאמת סכומים (0.00 = חייב זהות מוחלטת בערך מוחלט)
+RULE3_AMOUNT_EPS = 0.00
+
+# כללים 5–10
+RULE5_CODES = {453, 472, 473, 124}  # עמלות – חיובי ועד 1000
+RULE5_MAX   = 1000                  # תקרת כלל 5 (₪)
+RULE6_COMPANY = 'פאיימי בע"מ'       # קוד 175, שלילי, פרטים בדיוק
+RULE7_CODE = 143; RULE7_PHRASE = "שיקים ממשמרת"
+RULE8_CODE = 191; RULE8_PHRASE = "הפק' שיק-שידור"
+RULE9_CODE = 205; RULE9_PHRASE = "הפק.שיק במכונה"
+RULE10_CODES = {191, 132, 396}
+
+# כללים 5–10 כטבלה – סדר השורות = עדיפות; ניתן לדרוס מ-RULES_TABLE_FILE (JSON).
+#   codes – קודי פעולת בנק; sign – positive/negative/nonzero (סכום בדף);
+#   min_abs/max_abs – טווח |סכום| ב-₪ (כולל); details + details_match (exact/contains).
+RULES_TABLE_FILE = "rules_table.json"
+
+def default_simple_rules(rule5_max=None) -> list:
+    return [
+        {"match": 5,  "codes": sorted(RULE5_CODES), "sign": "positive",
+         "max_abs": RULE5_MAX if rule5_max is None else rule5_max},
+        {"match": 6,  "codes": [175],        "sign": "negative", "details": RULE6_COMPANY},
+        {"match": 7,  "codes": [RULE7_CODE], "sign": "negative", "details": RULE7_PHRASE},
+        {"match": 8,  "codes": [RULE8_CODE], "sign": "negative", "details": RULE8_PHRASE},
+        {"match": 9,  "codes": [RULE9_CODE], "sign": "negative", "details": RULE9_PHRASE},
+        {"match": 10, "codes": sorted(RULE10_CODES), "sign": "nonzero"},
+    ]
+
+# רבים-לאחד (כללים 3, 11): שורת בנק אחת = סכום של כמה שורות ספרים פתוחות.
+#   SUBSET_MAX_GROUP – מקס' שורות ספרים בקבוצה (1 = כבוי)
+#   SUBSET_DATE_WINDOW – ±ימים מתאריך הבנק (None = ללא מגבלה)
+#   SUBSET_MAX_CANDIDATES – מועמדים לכל שורת בנק (הקרובים בתאריך)
+#   SUBSET_TIME_BUDGET – שניות לכל כלל; בתום הזמן השאר נשאר פתוח
+SUBSET_MAX_GROUP      = 1
+SUBSET_DATE_WINDOW    = 7
+SUBSET_MAX_CANDIDATES = 40
+SUBSET_TIME_BUDGET    = 2.0
+
+# פרמטרים שניתן לכוונן להרצה בודדת (what-if) בלי לשנות את הקבועים
+TUNABLE_PARAMS = ("RULE1_DATE_WINDOW", "RULE4_EPS", "RULE3_AMOUNT_EPS", "RULE5_MAX", "SUBSET_MAX_GROUP", "SUBSET_DATE_WINDOW")
+
+# נקודות ביקורת: כמה קבצי קלט מפוענחים נשמרים, וכמה וקטורי match לכל קובץ
+CHECKPOINT_INPUTS = 2
+CHECKPOINT_POINTS = 64
+
+# הרצות ברקע (UI): מס' עובדים במקביל, כמה משימות שהסתיימו נשמרות
+JOB_WORKERS = 2
+JOB_KEEP    = 32
+
+# משקל יחסי של כל שלב בסרגל ההתקדמות (שלב שאינו כאן – 1)
+PROGRESS_WEIGHTS = {"קריאה": 30, "מסגרת התאמה": 8, "קריאת עזר": 5, "כלל 3": 3, "יצוא": 40}
+
+# קריאה זורמת – מס' שורות בחתיכה
+INGEST_CHUNK_ROWS = 50_000
+# יצוא – מעל מס' שורות זה עוברים ל-constant_memory של xlsxwriter
+EXPORT_CONSTANT_MEMORY_ROWS = 200_000
+EXPORT_PROGRESS_ROWS = 20_000                    # דיווח התקדמות/בדיקת ביטול ביצוא
+
+# מטמון תוצאות (לפי תוכן הקבצים + פרמטרים + גרסת מאגר)
+RESULT_CACHE_DIR        = ".recon_cache"
+RESULT_CACHE_MEM_BYTES  = 256 * 2**20
+RESULT_CACHE_DISK_BYTES = 2 * 2**30
+RESULT_CACHE_FRAME_BYTES = 512 * 2**20  # DataSheets מעובדים בזיכרון (לחקירה ב-UI); בדיסק – <key>.arrow
+RESULT_CACHE_VERSION    = 1         # להעלות כשלוגיקת הכללים או פורמט הפלט משתנים (חלק מהמפתח)
+
+# חקירת שורות (UI): שורות בעמוד, כמה אינדקסים של תוצאות נשמרים
+EXPLORER_PAGE_ROWS = 50
+EXPLORER_KEEP      = 2
+
+# snapshots של קלט מפוענח (Arrow IPC, נקרא במיפוי זיכרון) – לפי hash התוכן
+INGEST_CACHE_DIR        = os.path.join(RESULT_CACHE_DIR, "ingest")
+INGEST_CACHE_DISK_BYTES = 2 * 2**30
+INGEST_SNAPSHOT_VERSION = 2         # להעלות כשהקריאה (rows_to_df וכו') משתנה
+
+# ---------------- VLOOKUP default mappings ----------------
+VK_FILE = "rules_store.json"        # פורמט ישן – הגירה חד-פעמית ל-VK_DB
+VK_DB   = "rules_store.db"
+
+# הצעות ספק (טריגרמות) לשורות הוראת קבע בלי מס' ספק
+SUGGEST_TOP_K     = 3
+SUGGEST_MIN_SCORE = 0.35            # דמיון Dice מינימלי (0–1)
+SUGGEST_COL       = "הצעות ספק"
+
+# פריטים פתוחים (0) מהרצות קודמות – להתאמה בין תקופות, רק באותו חשבון/ישות
+OPEN_ITEMS_DB = "open_items.db"
+CARRY_FORWARD_DAYS = 62             # ± ימים בין שורה נוכחית לפריט פתוח
+
+# מצב מחולק (out-of-core): תקציב זיכרון להרצה; ממנו נגזרים גודל חתיכת קריאה
+# (הערכה לשורה מלאה – DataFrame + ReconFrame) וגודל מחיצה (הערכה לשורת מפתחות)
+PARTITION_MEMORY_BYTES  = 512 * 2**20
+PARTITION_ROW_BYTES     = 1_000
+PARTITION_KEY_ROW_BYTES = 1_000
+PARTITION_BUCKETS       = 256           # דליי hash לכל משפחת מפתחות
+PARTITION_SPILL_DIR     = None          # None = תיקיית temp של המערכת
+PARTITION_AUTO_BYTES    = 64 * 2**20    # UI: קובץ מקור גדול מזה → מצב מחולק
+
+DEFAULT_NAME_MAP = {
+    "בזק בינלאומי ב": "30006",
+    "פרי ירוחם חב'": "34714",
+    "סלקום ישראל בע": "30055",
+    "בזק-הוראות קבע": "34746",
+    "דרך ארץ הייווי": "34602",
+    "גלובס פבלישר ע": "30067",
+    "פלאפון תקשורת": "30030",
+    "מרכז הכוכביות": "30002",
+    "ע.אשדוד-מסים": "30056",
+    "א.ש.א(בס\"ד)אחז": "30050",
+    "או.פי.ג'י(מ.כ)": "30047",
+    "רשות האכיפה וה": "67-1",
+    "קול ביז מילניו": "30053",
+    "פריוריטי סופטו": "30097",
+    "אינטרנט רימון": "34636",
+    "עו\"דכנית בע\"מ": "30018",
+    "עיריית רמת גן": "30065",
+    "פז חברת נפט בע": "34811",
+    "ישראכרט": "28002",
+    "חברת החשמל ליש": "30015",
+    "הפניקס ביטוח": "34686",
+    "מימון ישיר מקב": "34002",
+    "שלמה טפר": "30247",
+    "נמרוד תבור עורך-דין": "30038",
+    "עיריית בית שמש": "34805",
+    "פז קמעונאות וא": "34811",
+    "הו\"ק הלו' רבית": "8004",
+}
+
+# placeholders 11–12 (rule 11 overridden below)
+def rule11_placeholder(rf, max_group=1, window=None):
+    """
+    כלל 11 – התאמות BT:
+    • צד בנק: קוד פעולת בנק = 485 וסכום בבנק ≠ 0.
+    • צד ספרים: אסמכתא 1 מתחילה ב-"BT" וסכום בספרים ≠ 0.
+    • התאמה היא 1:1 לפי סכום מוחלט (|סכום בנק| = |סכום ספרים|).
+    • max_group > 1 – אחר כך רבים-לאחד (subset_sum_match, ±window ימים).
+    • אין דריסה של כללים – עובדים רק על שורות שמס' ההתאמה שלהן עדיין 0.
+    """
+
+    # אם חסרה עמודת קוד / סכום / אסמכתא / סכום ספרים – אי אפשר להריץ את הכלל
+    if not all(rf.cols[k] for k in ("code", "bamt", "ref1", "aamt")):
+        return
+
+    match = rf.match
+    bamt, aamt = rf.bamt_c, rf.aamt_c
+
+    # צד בנק – קוד 485; צד ספרים – אסמכתא 1 מתחילה ב-BT
+    bank = (match == 0) & (rf.code_i == 485) & rf.has_bamt & (bamt != 0)
+    books = (match == 0) & rf.has_aamt & (aamt != 0) & (rf.ref1_s_pfx == "BT")
+
+    # התאמות 1:1 לפי סכום מוחלט (אגורות)
+    i, j = pair_rows(bank, books, [np.abs(bamt)], [np.abs(aamt)])
+    match[i] = 11
+    match[j] = 11
+    rf.pairs.add_pairs(11, i, j, bamt, aamt)
+
+    # רבים-לאחד: שורת בנק = סכום של כמה שורות BT
+    subset_sum_match(match, np.flatnonzero(bank & (match == 0)), np.flatnonzero(books & (match == 0)),
+                     bamt, aamt, rf.date, 11, max_group, window, ledger=rf.pairs)
+
+
+def rule12_placeholder(rf):
+    return
+
+# ---------------- Column maps ----------------
+MATCH_COLS = ["מס.התאמה","מס. התאמה","מס התאמה","מספר התאמה","התאמה"]
+BANK_CODES = ["קוד פעולת בנק","קוד פעולה","קוד פעולת","Bank Code"]
+BANK_AMTS  = ["סכום בדף","סכום דף","סכום בבנק","סכום תנועת בנק","Bank Amount"]
+BOOKS_AMTS = ["סכום בספרים","סכום בספר","סכום ספרים","Books Amount"]
+REF1S      = ["אסמכתא 1","אסמכתא1","אסמכתא","אסמכתה","Ref1"]
+REF2S      = ["אסמכתא 2","אסמכתא2","אסמכתא-2","אסמכתה 2","Ref2"]
+DATES      = ["תאריך מאזן","תאריך ערך","תאריך","Date"]
+DETAILS    = ["פרטים","תיאור","שם ספק","Details","תאור"]
+
+# aux (עזר להעברות/כלל 3)
+AUX_DATE_KEYS = ["תאריך פריקה","תאריך","פריקה"]   # כולל שעה/חותמת אירוע
+AUX_AMT_KEYS  = ["אחרי ניכוי","אחרי","סכום"]
+AUX_PAYNO_KEYS= ["מס' תשלום","מס תשלום","מספר תשלום"]
+
+# ---------------- Helpers ----------------
+def pick_col(df, names):
+    for n in names:
+        if n in df.columns:
+            return n
+    for n in names:
+        for c in df.columns:
+            if isinstance(c, str) and n in c:
+                return c
+    return None
+
+_NUM_JUNK = re.compile("[,₪\u200f\u200e]")
+EXCEL_EPOCH = pd.Timestamp("1899-12-30")
+EXCEL_SERIAL_MAX = 2958465                      # 9999-12-31
+
+def unique_columns(columns) -> list:
+    """כותרות ייחודיות לפי מיקום: ריקה → 'עמודה N', חוזרת → .1, .2 (כמו pandas.read_excel)."""
+    out, used, dup = [], set(), Counter()
+    for k, c in enumerate(columns):
+        name = base = ("" if pd.isna(c) else str(c).strip()) or f"עמודה {k + 1}"
+        while name in used:
+            dup[base] += 1
+            name = f"{base}.{dup[base]}"
+        used.add(name)
+        out.append(name)
+    return out
+
+def _is_blank(s: pd.Series) -> np.ndarray:
+    """חסר או מחרוזת ריקה – לא נחשב שגיאת קליטה."""
+    blank = s.isna().to_numpy(dtype=bool, copy=True)
+    is_str = s.map(type).to_numpy() == str
+    if is_str.any():
+        blank[is_str] = s[is_str].str.strip().eq("").to_numpy(dtype=bool)
+    return blank
+
+def _is_number_type(t) -> bool:
+    """מספר ממשי מכל סוג (int/float/Decimal/np.int32/np.float32...), לא bool."""
+    return issubclass(t, numbers.Number) and not issubclass(t, (bool, np.bool_, complex, np.complexfloating))
+
+def _number_mask(kind: np.ndarray) -> np.ndarray:
+    """kind – מערך type() לכל תא; בדיקה אחת לכל סוג שונה."""
+    num = [t for t in set(kind) if _is_number_type(t)]
+    return np.isin(kind, num) if num else np.zeros(len(kind), dtype=bool)
+
+def parse_amounts(s: pd.Series):
+    """
+    עמודת סכום/קוד → (float ndarray, failed). עמודה מספרית – ישירות;
+    אחרת: מספרים כמו שהם, מחרוזות בניקוי אחד (פסיקים, ₪, סימוני כיוון) ו-to_numeric.
+    failed – ערך לא ריק שלא הומר.
+    """
+    if pd.api.types.is_numeric_dtype(s) and not pd.api.types.is_bool_dtype(s):
+        return s.to_numpy(dtype=float, na_value=np.nan), np.zeros(len(s), dtype=bool)
+    out = np.full(len(s), np.nan)
+    kind = s.map(type).to_numpy()
+    is_num = _number_mask(kind)
+    if is_num.any():
+        out[is_num] = s[is_num].to_numpy(dtype=float)
+    is_str = kind == str
+    if is_str.any():
+        cleaned = s[is_str].str.replace(_NUM_JUNK, "", regex=True).str.strip()
+        out[is_str] = pd.to_numeric(cleaned, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    return out, np.isnan(out) & ~_is_blank(s)
+
+def parse_dates(s: pd.Series):
+    """
+    עמודת תאריך → (datetime64[ns] מנורמל ליום, failed), בהמרה וקטורית:
+    datetime כמו שהם; מספרים כמספר סידורי של Excel; מחרוזות – פורמט מנוחש פעם
+    אחת לעמודה (dayfirst) והמרה אחת, ורק מה שלא התאים לפורמט מפוענח פרטנית.
+    """
+    if pd.api.types.is_datetime64_any_dtype(s):
+        out = pd.to_datetime(s)
+    else:
+        out = pd.Series(pd.NaT, index=s.index, dtype="datetime64[ns]")
+        kind = s.map(type).to_numpy()
+        is_str = kind == str
+        is_num = _number_mask(kind)
+        is_dt = ~(is_str | is_num) & s.notna().to_numpy(dtype=bool)
+        if is_dt.any():
+            out[is_dt] = pd.to_datetime(s[is_dt], errors="coerce", utc=True).dt.tz_localize(None)
+        if is_num.any():
+            serial = s[is_num].to_numpy(dtype=float)
+            ok = (serial >= 1) & (serial <= EXCEL_SERIAL_MAX)
+            out[np.flatnonzero(is_num)[ok]] = EXCEL_EPOCH + pd.to_timedelta(serial[ok], unit="D")
+        if is_str.any():
+            strs = s[is_str].str.strip()
+            strs = strs[strs != ""]
+            if len(strs):
+                fmt = guess_datetime_format(strs.iloc[0], dayfirst=True)
+                if fmt and fmt.startswith("%Y"):            # שנה ראשונה → סדר ISO (חודש לפני יום)
+                    fmt = guess_datetime_format(strs.iloc[0])
+                conv = pd.to_datetime(strs, format=fmt, errors="coerce") if fmt else pd.Series(pd.NaT, index=strs.index)
+                for extra in ({"format": "ISO8601"}, {"format": "mixed", "dayfirst": True}):
+                    left = conv.isna()
+                    if left.any():
+                        conv[left] = pd.to_datetime(strs[left], errors="coerce", **extra)
+                out[conv.index] = conv
+    if getattr(out.dt, "tz", None) is not None:
+        out = out.dt.tz_localize(None)
+    out = out.dt.normalize().to_numpy(dtype="datetime64[ns]")
+    return out, np.isnat(out) & ~_is_blank(s)
+
+def to_cents(a) -> np.ndarray:
+    """סכומים (float, NaN מותר) → אגורות int64. ערך חסר → 0 (ראו has_*)."""
+    a = np.asarray(a, dtype=float)
+    return np.rint(np.where(np.isfinite(a), a, 0.0) * 100).astype(np.int64)
+
+def cents(x) -> int:
+    """סכום בודד (₪) → אגורות."""
+    return int(round(float(x) * 100))
+
+def rows_to_df(rows, chunk_rows=None):
+    """
+    בונה DataFrame מאיטרטור שורות (שורה ראשונה = כותרת) בחתיכות:
+    כל חתיכה הופכת לעמודות מוקלדות, כך שלא מחזיקים את כל השורות כרשימה.
+    """
+    chunk_rows = chunk_rows or INGEST_CHUNK_ROWS
+    it = iter(rows)
+    try:
+        first = next(it)
+    except StopIteration:
+        return pd.DataFrame()
+    header = [str(x) if x is not None else "" for x in first]
+    width  = len(header)
+
+    parts = [[] for _ in range(width)]
+    while True:
+        chunk = []
+        for r in it:
+            r = tuple(r[:width])
+            if len(r) < width:
+                r = r + (None,) * (width - len(r))
+            chunk.append(r)
+            if len(chunk) >= chunk_rows:
+                break
+        if not chunk:
+            break
+        for c, values in enumerate(zip(*chunk)):
+            parts[c].append(pd.Series(values))
+        del chunk
+
+    cols = {}
+    for c, ps in enumerate(parts):
+        if not ps:
+            cols[c] = pd.Series([], dtype=object)
+            continue
+        s = pd.concat(ps, ignore_index=True) if len(ps) > 1 else ps[0]
+        # סוגים שונים בין חתיכות → הסקה מחדש כמו בבנייה מרשימה אחת
+        if len({p.dtype for p in ps}) > 1:
+            s = pd.Series(s.tolist())
+        cols[c] = s
+        parts[c] = None
+    df = pd.DataFrame(cols)
+    df.columns = header
+    return df
+
+def ws_to_df(ws):
+    return rows_to_df(ws.iter_rows(values_only=True))
+
+def _calamine_value(v):
+    """
+    ערך calamine → הסוג ש-openpyxl מחזיר: "" (תא ריק) → None, float שלם → int
+    (777 ולא "777.0" במפתחות אסמכתא / מס' תשלום), date → datetime.
+    """
+    t = type(v)
+    if t is float:
+        return int(v) if v.is_integer() else v
+    if t is str:
+        return None if v == "" else v
+    if t is date:
+        return datetime(v.year, v.month, v.day)
+    return v
+
+def _iter_rows_calamine(data, sheet_name):
+    wb = python_calamine.CalamineWorkbook.from_filelike(io.BytesIO(data))
+    names = wb.sheet_names
+    name = sheet_name if sheet_name in names else names[0]
+    for r in wb.get_sheet_by_name(name).iter_rows():
+        yield tuple(map(_calamine_value, r))
+
+def read_sheet_df(data: bytes, sheet_name=None) -> pd.DataFrame:
+    """
+    קריאה זורמת של גיליון: sheet_name אם קיים, אחרת הגיליון הראשון.
+    calamine אם מותקן (אותם סוגי ערכים כמו openpyxl – _calamine_value), אחרת
+    openpyxl במצב read-only; קובץ ש-calamine לא מצליח לפענח – openpyxl.
+    """
+    if python_calamine is not None:
+        try:
+            return rows_to_df(_iter_rows_calamine(data, sheet_name))
+        except python_calamine.CalamineError:
+            pass
+
+    wb = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.worksheets[0]
+        # קבצים בלי dimension תקין – קריאה מלאה במקום חיתוך ל-A1
+        if ws.max_row in (None, 1) and ws.max_column in (None, 1):
+            ws.reset_dimensions()
+        return ws_to_df(ws)
+    finally:
+        wb.close()
+
+# ---------------- Columnar input/output ----------------
+def input_format(data: bytes) -> str:
+    """xlsx / xls / parquet / feather / csv – לפי חתימת התוכן (לא לפי שם הקובץ)."""
+    head = bytes(data[:8])
+    if head.startswith(b"PK\x03\x04"):
+        return "xlsx"
+    if head.startswith(b"\xd0\xcf\x11\xe0"):
+        return "xls"
+    if head.startswith(b"PAR1"):
+        return "parquet"
+    if head.startswith(b"ARROW1"):
+        return "feather"
+    return "csv"
+
+def read_csv_df(data: bytes) -> pd.DataFrame:
+    """
+    CSV – UTF-8 (עם/בלי BOM), ואם לא מתפענח – Windows-1255 (יצוא בנקים ישן).
+    אסמכתאות ופרטים נקראים כטקסט (69911 ולא 69911.0); שאר העמודות – הסקת סוג.
+    """
+    text_cols = dict.fromkeys(REF1S + REF2S + DETAILS, str)
+    try:
+        return pd.read_csv(io.BytesIO(data), encoding="utf-8-sig", dtype=text_cols)
+    except UnicodeDecodeError:
+        return pd.read_csv(io.BytesIO(data), encoding="cp1255", dtype=text_cols)
+
+def read_input_df(data: bytes, sheet_name=None, snapshot=False) -> pd.DataFrame:
+    """
+    קלט לפי תוכן: xlsx (read_sheet_df; snapshot=True – דרך מטמון snapshots),
+    xls, CSV, Parquet או Feather.
+    """
+    fmt = input_format(data)
+    if fmt == "xlsx":
+        return read_sheet_snapshot(data, sheet_name) if snapshot else read_sheet_df(data, sheet_name)
+    if fmt == "xls":
+        return pd.read_excel(io.BytesIO(data))
+    if fmt == "parquet":
+        return pd.read_parquet(io.BytesIO(data))
+    if fmt == "feather":
+        return pd.read_feather(io.BytesIO(data))
+    return read_csv_df(data)
+
+def _frame_to_arrow(df):
+    """
+    DataFrame → pa.Table ל-snapshot. עמודות לפי מיקום (c0, c1, ...) – כותרות Excel
+    יכולות לחזור או להיות ריקות; הכותרות וסוגי pandas נשמרים ב-metadata.
+    עמודת object מעורבת (מספרים + טקסט, כמו אסמכתאות) מפוצלת לעמודה לכל סוג Python.
+    """
+    arrays, names, parts = [], [], {}
+    for n in range(df.shape[1]):
+        s = df.iloc[:, n]
+        try:
+            arrays.append(pa.array(s, from_pandas=True))
+            names.append(f"c{n}")
+            continue
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+        kinds = np.array([type(v).__name__ for v in s], dtype=object)
+        parts[n] = sorted(set(kinds) - {"NoneType"})
+        for k in parts[n]:
+            arrays.append(pa.array(s.where(kinds == k, None).tolist()))
+            names.append(f"c{n}:{k}")
+    meta = {"columns": [str(c) for c in df.columns], "dtypes": [str(t) for t in df.dtypes], "parts": parts}
+    return pa.Table.from_arrays(arrays, names=names).replace_schema_metadata({"recon": json.dumps(meta)})
+
+def _arrow_to_frame(table) -> pd.DataFrame:
+    meta = json.loads(table.schema.metadata[b"recon"])
+    cols = []
+    for n, dtype in enumerate(meta["dtypes"]):
+        kinds = meta["parts"].get(str(n))
+        if kinds is None:
+            col = table.column(f"c{n}")
+            s = col.to_pandas()
+            if str(s.dtype) != dtype:
+                s = s.astype(dtype)
+            if dtype == "object" and col.null_count:           # חסר נשאר None (לא NaN) כמו בקריאה
+                s = s.where(~col.is_null().to_numpy(zero_copy_only=False), None)
+            cols.append(s)
+            continue
+        out = np.full(table.num_rows, None, dtype=object)
+        for k in kinds:
+            col = table.column(f"c{n}:{k}")
+            valid = col.is_valid().to_numpy(zero_copy_only=False)
+            vals = col.filter(col.is_valid()).to_pylist()
+            out[valid] = np.array(vals + [None], dtype=object)[:-1]   # בלי פירוק רשימות/tuple
+        cols.append(pd.Series(out, dtype=object))
+    df = pd.concat(cols, axis=1, ignore_index=True) if cols else pd.DataFrame(index=range(table.num_rows))
+    df.columns = meta["columns"]
+    return df
+
+def read_sheet_snapshot(data: bytes, sheet_name=None) -> pd.DataFrame:
+    """
+    read_sheet_df עם מטמון: הגיליון המפוענח נשמר כ-Arrow IPC ב-INGEST_CACHE_DIR
+    לפי hash התוכן, ובהעלאה חוזרת של אותו קובץ נקרא במיפוי זיכרון במקום
+    פענוח XLSX. בלי pyarrow / דיסק לא זמין – קריאה רגילה.
+    """
+    if pa is None:
+        return read_sheet_df(data, sheet_name)
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(repr((sheet_name, INGEST_SNAPSHOT_VERSION, python_calamine is not None)).encode("utf-8"))
+    path = os.path.join(INGEST_CACHE_DIR, h.hexdigest() + ".arrow")
+    try:
+        df = _read_arrow_frame(path)
+        os.utime(path)                             # LRU לפי mtime
+        return df
+    except (OSError, pa.ArrowException, KeyError, ValueError):
+        pass
+
+    df = read_sheet_df(data, sheet_name)
+    try:
+        os.makedirs(INGEST_CACHE_DIR, exist_ok=True)
+        _write_arrow_frame(df, path)
+        _evict_snapshots()
+    except (OSError, pa.ArrowException):
+        pass                                       # snapshot הוא רק האצה
+    return df
+
+def _write_arrow_frame(df, path):
+    """DataFrame → קובץ Arrow IPC (כתיבה לקובץ זמני והחלפה אטומית)."""
+    table = _frame_to_arrow(df)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as w:
+        w.write_table(table)
+    os.replace(tmp, path)
+
+def _read_arrow_frame(path) -> pd.DataFrame:
+    with pa.memory_map(path) as src:
+        return _arrow_to_frame(pa.ipc.open_file(src).read_all())
+
+def _evict_snapshots():
+    entries = []
+    for name in os.listdir(INGEST_CACHE_DIR):
+        if name.endswith(".arrow"):
+            info = os.stat(os.path.join(INGEST_CACHE_DIR, name))
+            entries.append((info.st_mtime, info.st_size, name))
+    total = sum(e[1] for e in entries)
+    for _, size, name in sorted(entries):
+        if total <= INGEST_CACHE_DISK_BYTES:
+            break
+        try:
+            os.remove(os.path.join(INGEST_CACHE_DIR, name))
+        except OSError:
+            pass
+        total -= size
+
+def to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    """
+    DataFrame → Parquet. עמודות לפי מיקום עם כותרות ייחודיות (unique_columns – Parquet
+    דורש שמות ייחודיים); עמודת object מעורבת נכתבת כטקסט (Parquet דורש סוג אחד לעמודה).
+    """
+    cols = []
+    for k in range(df.shape[1]):
+        s = df.iloc[:, k]
+        if s.dtype == object:
+            try:
+                pa.array(s, from_pandas=True)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                s = s.where(s.isna(), s.astype(str))
+        cols.append(s)
+    out = pd.concat(cols, axis=1, ignore_index=True) if cols else pd.DataFrame(index=df.index)
+    out.columns = unique_columns(df.columns)
+    buf = io.BytesIO()
+    out.to_parquet(buf, index=False)
+    return buf.getvalue()
+
+def only_digits(s):
+    return re.sub(r"\D","", str(s)).lstrip("0") or "0"
+
+# ---------------- Instrumentation ----------------
+_TRACE_LOCK = threading.Lock()     # tracemalloc גלובלי לתהליך – RunReport אחד מודד זיכרון בכל רגע
+
+class RunReport:
+    """
+    מדידת ביצועים להרצה: לכל שלב/כלל – זמן, שורות שנבדקו, שורות שהותאמו
+    (שינוי בוקטור match) וזיכרון שיא (tracemalloc). שלבים יכולים להיות מקוננים.
+    tracemalloc מאט את ההרצה (בעיקר קריאה ויצוא) – trace_memory=False למדידת זמן בלבד.
+    tracemalloc משותף לכל התהליך: הדוח הראשון שמודד תופס אותו עד finish();
+    דוח שמתחיל בזמן שדוח אחר מודד – זמנים בלבד (זיכרון ריק). JobManager מריץ
+    משימה מדודה לבד, כך שגם הרצות לא מדודות לא נספרות בשיא שלה.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._peaks = []            # שיא הילדים לכל שלב פתוח
+        self._tracing = False       # הדוח הפעיל את tracemalloc
+        self._owner = False         # הדוח מחזיק ב-_TRACE_LOCK
+
+    @contextmanager
+    def stage(self, name, rf=None, rows=None):
+        if self.trace_memory and not self._owner:
+            if _TRACE_LOCK.acquire(blocking=False):
+                self._owner = True
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self._tracing = True
+            else:
+                self.trace_memory = False
+        tracing = tracemalloc.is_tracing() and self.trace_memory
+
+        rec = {"שלב": name, "רמה": len(self._peaks), "שניות": None,
+               "שורות שנבדקו": rows, "הותאמו": None, "זיכרון שיא (MB)": None}
+        before = None
+        if rf is not None:
+            before = rf.match.copy()
+            if rows is None:
+                rec["שורות שנבדקו"] = int(np.count_nonzero(before == 0))
+        self.stages.append(rec)
+
+        if tracing:
+            # reset_peak מאפס גם את שיא ההורה – שומרים אותו לפני
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._peaks.append(0)
+        t0 = time.perf_counter()
+        try:
+            yield rec
+        finally:
+            rec["שניות"] = round(time.perf_counter() - t0, 4)
+            child_peak = self._peaks.pop()
+            if tracing:
+                peak = max(tracemalloc.get_traced_memory()[1], child_peak)
+                rec["זיכרון שיא (MB)"] = round(peak / 2**20, 2)
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            if before is not None:
+                rec["הותאמו"] = int(np.count_nonzero(rf.match != before))
+
+    def finish(self):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        if self._owner:
+            self._owner = False
+            _TRACE_LOCK.release()
+
+    def to_frame(self) -> pd.DataFrame:
+        df = pd.DataFrame(self.stages, columns=["שלב", "רמה", "שניות", "שורות שנבדקו",
+                                                "הותאמו", "זיכרון שיא (MB)"])
+        df["שלב"] = ["  " * r + n for n, r in zip(df["שלב"], df["רמה"])]
+        df[["שורות שנבדקו", "הותאמו"]] = df[["שורות שנבדקו", "הותאמו"]].astype("Int64")
+        return df.drop(columns="רמה")
+
+def _stage(report, name, rf=None, rows=None):
+    """report.stage(...) או הקשר ריק כשאין מדידה (rec הוא dict זמני)."""
+    if report is None:
+        return nullcontext({})
+    return report.stage(name, rf, rows)
+
+# ---------------- Recon frame ----------------
+def _digits(s: pd.Series) -> np.ndarray:
+    """only_digits וקטורי."""
+    return s.str.replace(r"\D", "", regex=True).str.lstrip("0").replace("", "0").to_numpy(dtype=object)
+
+def _prefix2(s: pd.Series) -> np.ndarray:
+    return s.str.upper().str[:2].to_numpy(dtype=object)
+
+class PairLedger:
+    """
+    יומן זוגות: כל שלב צימוד (כללים 1, 3, 4, 11, רבים-לאחד) רושם כאן את הקבוצה
+    ברגע ההחלטה – בלי סריקה חוזרת של match. מערכים קומפקטיים שנצברים בחתיכות:
+    לכל שורה – שורה (int32), קבוצה (int32), צד (int8: 0 בנק, 1 ספרים), סכום באגורות;
+    לכל קבוצה – כלל (int16) ופער |Σספרים| − |Σבנק| באגורות. O(התאמות) בזמן ובזיכרון.
+    """
+
+    def __init__(self):
+        self._rows, self._groups, self.groups = [], [], 0
+
+    def __len__(self):
+        return sum(len(p[0]) for p in self._rows)
+
+    def add_pairs(self, rule, i, j, bank_c, books_c):
+        """זוגות 1:1 – i (בנק) ו-j (ספרים) מקבילים; קבוצה לכל זוג."""
+        n = len(i)
+        if not n:
+            return
+        i, j = np.asarray(i, dtype=np.int64), np.asarray(j, dtype=np.int64)
+        bc, oc = bank_c[i], books_c[j]
+        g = np.arange(self.groups, self.groups + n, dtype=np.int32)
+        self._rows.append((np.column_stack([i, j]).ravel().astype(np.int32), np.repeat(g, 2),
+                           np.tile(np.array([0, 1], dtype=np.int8), n),
+                           np.column_stack([bc, oc]).ravel().astype(np.int64)))
+        self._groups.append((np.full(n, rule, dtype=np.int16), (np.abs(oc) - np.abs(bc)).astype(np.int64)))
+        self.groups += n
+
+    def add_group(self, rule, bank_rows, books_rows, bank_c, books_c):
+        """קבוצה אחת: שורות בנק ↔ שורות ספרים (כלל 3, רבים-לאחד)."""
+        bank_rows = np.asarray(bank_rows, dtype=np.int64)
+        books_rows = np.asarray(books_rows, dtype=np.int64)
+        bc, oc = bank_c[bank_rows], books_c[books_rows]
+        nb, no = len(bank_rows), len(books_rows)
+        self._rows.append((np.r_[bank_rows, books_rows].astype(np.int32),
+                           np.full(nb + no, self.groups, dtype=np.int32),
+                           np.r_[np.zeros(nb, dtype=np.int8), np.ones(no, dtype=np.int8)],
+                           np.r_[bc, oc].astype(np.int64)))
+        self._groups.append((np.array([rule], dtype=np.int16),
+                             np.array([abs(int(oc.sum())) - abs(int(bc.sum()))], dtype=np.int64)))
+        self.groups += 1
+
+    def extend(self, other, rows=None):
+        """רשומות other בהמשך המספור; rows – מיפוי שורות (מחיצה → שורה גלובלית)."""
+        for r, g, side, c in other._rows:
+            self._rows.append(((r if rows is None else rows[r]).astype(np.int32), g + self.groups, side, c))
+        self._groups += other._groups
+        self.groups += other.groups
+
+    def arrays(self) -> dict:
+        """מערכים מאוחדים: row, group, side, cents (לשורה); rule, delta (לקבוצה)."""
+        def merged(parts, dtypes):
+            return [tuple(np.concatenate([p[k] for p in parts]) if parts else np.array([], dtype=t)
+                          for k, t in enumerate(dtypes))]
+
+        if len(self._rows) != 1:
+            self._rows = merged(self._rows, (np.int32, np.int32, np.int8, np.int64))
+            self._groups = merged(self._groups, (np.int16, np.int64))
+        (row, group, side, c), (rule, delta) = self._rows[0], self._groups[0]
+        return {"row": row, "group": group, "side": side, "cents": c, "rule": rule, "delta": delta}
+
+    def snapshot(self):
+        """עותק לנקודת ביקורת."""
+        a = self.arrays()
+        return self.groups, {k: v.copy() for k, v in a.items()}
+
+    def restore(self, snap):
+        self.groups, a = snap[0], {k: v.copy() for k, v in snap[1].items()}
+        self._rows = [(a["row"], a["group"], a["side"], a["cents"])]
+        self._groups = [(a["rule"], a["delta"])]
+
+    def to_frame(self) -> pd.DataFrame:
+        """גיליון 'זוגות התאמה': קבוצה, כלל, צד, שורת Excel, סכום, פער הקבוצה (₪)."""
+        a = self.arrays()
+        g = a["group"]
+        return pd.DataFrame({"קבוצה": g + 1, "כלל": a["rule"][g],
+                             "צד": np.where(a["side"] == 0, "בנק", "ספרים").astype(object),
+                             "שורה": a["row"] + 2, "סכום": a["cents"] / 100, "פער קבוצה": a["delta"][g] / 100})
+
+    def write(self, out):
+        """
+        קובץ מכונה (Parquet; CSV בלי pyarrow) – שורה לכל שורה מותאמת:
+        group, rule, side (0 בנק / 1 ספרים), row (שורת Excel), cents, delta_cents.
+        """
+        a = self.arrays()
+        g = a["group"]
+        df = pd.DataFrame({"group": g + 1, "rule": a["rule"][g], "side": a["side"], "row": a["row"] + 2,
+                           "cents": a["cents"], "delta_cents": a["delta"][g]})
+        if pa is not None:
+            df.to_parquet(out, index=False)
+        else:
+            df.to_csv(out, index=False)
+
+@dataclass
+class ReconFrame:
+    """
+    מסגרת התאמה קנונית – נבנית פעם אחת לכל הרצה.
+    מיפוי העמודות + מערכים מפוענחים; כל הכללים כותבים לוקטור match אחד,
+    וכללי הצימוד גם ליומן הזוגות pairs.
+    """
+    df: pd.DataFrame
+    cols: dict
+    match: np.ndarray         # int64 – מס' התאמה (משותף לכל הכללים)
+    code: np.ndarray          # float – קוד פעולת בנק
+    code_i: np.ndarray        # float – קוד אחרי קיטום לשלם (int(code))
+    bamt_c: np.ndarray        # int64 – סכום בדף באגורות
+    aamt_c: np.ndarray        # int64 – סכום בספרים באגורות
+    has_bamt: np.ndarray      # bool – יש סכום בדף
+    has_aamt: np.ndarray      # bool – יש סכום בספרים
+    date: np.ndarray          # datetime64 – תאריך מנורמל ליום
+    ref1_s: np.ndarray        # אסמכתא 1 אחרי strip (NaN נשמר)
+    ref1_pfx: np.ndarray      # שתי אותיות ראשונות (upper) – OV/RC/CH
+    ref1_s_pfx: np.ndarray    # כנ"ל אחרי strip – BT
+    ref1_ok: np.ndarray       # bool – באסמכתא 1 יש ספרות (מפתח join של כלל 4)
+    ref2_ok: np.ndarray       # bool – באסמכתא 2 יש ספרות
+    ref1_d: np.ndarray        # ספרות בלבד (only_digits)
+    ref2_d: np.ndarray
+    det: np.ndarray           # פרטים (str)
+    parse_errors: pd.DataFrame = None   # שגיאות קליטה (שורה/עמודה/ערך)
+    pairs: PairLedger = field(default_factory=PairLedger)   # יומן זוגות (כללי צימוד)
+
+    @property
+    def col_match(self):
+        return self.cols["match"]
+
+    def __len__(self):
+        return len(self.match)
+
+def build_recon_frame(df: pd.DataFrame) -> ReconFrame:
+    n = len(df)
+    cols = {
+        "match": pick_col(df, MATCH_COLS) or df.columns[0],
+        "code":  pick_col(df, BANK_CODES),
+        "bamt":  pick_col(df, BANK_AMTS),
+        "aamt":  pick_col(df, BOOKS_AMTS),
+        "ref1":  pick_col(df, REF1S),
+        "ref2":  pick_col(df, REF2S),
+        "date":  pick_col(df, DATES),
+        "det":   pick_col(df, DETAILS),
+    }
+
+    errors = []
+
+    def report_failed(key, failed):
+        rows = np.flatnonzero(failed)
+        if len(rows):
+            errors.append(pd.DataFrame({"שורה": rows + 2, "עמודה": cols[key],
+                                        "ערך": df[cols[key]].iloc[rows].astype(str).to_numpy(dtype=object)}))
+
+    def num(key):
+        c = cols[key]
+        if not c:
+            return np.full(n, np.nan)
+        vals, failed = parse_amounts(df[c])
+        report_failed(key, failed)
+        return vals
+
+    def text(key):
+        c = cols[key]
+        return df[c].astype(str) if c else pd.Series([""] * n, dtype=object)
+
+    match = pd.to_numeric(df[cols["match"]], errors="coerce").fillna(0).astype(int).to_numpy(dtype=np.int64, copy=True)
+    code  = num("code")
+    bamt  = num("bamt")
+    aamt  = num("aamt")
+    if cols["date"]:
+        date, failed = parse_dates(df[cols["date"]])
+        report_failed("date", failed)
+    else:
+        date = np.full(n, np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    ref1 = text("ref1")
+    ref2 = text("ref2")
+    # str(x) על ערך חסר נותן "nan" – כמו בגישה התא-תא המקורית
+    ref1_t = ref1.fillna("nan")
+    ref2_t = ref2.fillna("nan")
+
+    return ReconFrame(
+        df=df,
+        cols=cols,
+        match=match,
+        code=code,
+        code_i=np.trunc(code),
+        bamt_c=to_cents(bamt),
+        aamt_c=to_cents(aamt),
+        has_bamt=np.isfinite(bamt),
+        has_aamt=np.isfinite(aamt),
+        date=date,
+        ref1_s=ref1.str.strip().to_numpy(dtype=object),
+        ref1_pfx=_prefix2(ref1_t),
+        ref1_s_pfx=_prefix2(ref1_t.str.strip()),
+        # חסרה / בלי ספרות → ref_d הוא "0" לכולן; לא מפתח (אחרת כולן מתחברות זו לזו)
+        ref1_ok=ref1.str.contains(r"\d", regex=True, na=False).to_numpy(dtype=bool),
+        ref2_ok=ref2.str.contains(r"\d", regex=True, na=False).to_numpy(dtype=bool),
+        ref1_d=_digits(ref1_t),
+        ref2_d=_digits(ref2_t),
+        det=text("det").to_numpy(dtype=object),
+        parse_errors=(pd.concat(errors, ignore_index=True).sort_values("שורה", kind="stable", ignore_index=True)
+                      if errors else pd.DataFrame(columns=["שורה", "עמודה", "ערך"])),
+    )
+
+# ---------------- VLOOKUP store ----------------
+# SQLite (WAL): name_map/amount_map + מונה גרסה; כתיבות ב-upsert בטרנזקציה
+_VK_SCHEMA = """
+CREATE TABLE IF NOT EXISTS name_map (
+    id       INTEGER PRIMARY KEY,          -- סדר הכנסה = קדימות בהתאמה
+    name     TEXT NOT NULL UNIQUE,
+    supplier TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS amount_map (
+    cents    INTEGER PRIMARY KEY,          -- סכום מוחלט באגורות
+    supplier TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta(key, value) VALUES ('version', 0);
+"""
+_VK_READY = set()
+_VK_CACHE = {}
+
+def _vk_connect():
+    conn = sqlite3.connect(VK_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    path = os.path.abspath(VK_DB)
+    if path not in _VK_READY:
+        _vk_init(conn)
+        _VK_READY.add(path)
+    return conn
+
+def _vk_write(conn, fn):
+    """fn(conn) בטרנזקציית כתיבה אחת; מעלה גרסה אם משהו השתנה."""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        before = conn.total_changes
+        fn(conn)
+        changed = conn.total_changes - before
+        if changed:
+            conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        conn.execute("COMMIT")
+        return changed
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _vk_init(conn):
+    """סכמה, הגירה חד-פעמית מ-rules_store.json וזריעת DEFAULT_NAME_MAP."""
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.executescript(_VK_SCHEMA)
+
+    def seed(c):
+        if c.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone() is None:
+            if os.path.exists(VK_FILE):
+                try:
+                    with open(VK_FILE, "r", encoding="utf-8") as f:
+                        old = json.load(f)
+                except Exception:
+                    old = {}
+                _upsert_names(c, (old.get("name_map") or {}).items())
+                _upsert_amounts(c, (old.get("amount_map") or {}).items())
+            c.execute("INSERT INTO meta(key, value) VALUES ('migrated', 1)")
+        # מיזוג מיפוי ברירת מחדל – לא לדרוס מה שכבר קיים
+        c.executemany("INSERT OR IGNORE INTO name_map(name, supplier) VALUES (?, ?)",
+                      DEFAULT_NAME_MAP.items())
+    _vk_write(conn, seed)
+
+def _upsert_names(conn, items):
+    conn.executemany(
+        "INSERT INTO name_map(name, supplier) VALUES (?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET supplier = excluded.supplier "
+        "WHERE supplier != excluded.supplier",
+        ((str(k), str(v)) for k, v in items))
+
+def _upsert_amounts(conn, items):
+    conn.executemany(
+        "INSERT INTO amount_map(cents, supplier) VALUES (?, ?) "
+        "ON CONFLICT(cents) DO UPDATE SET supplier = excluded.supplier "
+        "WHERE supplier != excluded.supplier",
+        ((abs(cents(k)), str(v)) for k, v in items))
+
+def vk_version() -> int:
+    conn = _vk_connect()
+    try:
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+    finally:
+        conn.close()
+
+def vk_load():
+    """
+    טוען את המיפויים (name_map לפי סדר הכנסה, amount_map לפי אגורות).
+    נקרא מחדש מה-DB רק כשמונה הגרסה השתנה.
+    """
+    conn = _vk_connect()
+    try:
+        key = (os.path.abspath(VK_DB), conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0])
+        if _VK_CACHE.get("key") != key:
+            _VK_CACHE.update(
+                key=key,
+                version=key[1],
+                name_map=dict(conn.execute("SELECT name, supplier FROM name_map ORDER BY id")),
+                amount_map=dict(conn.execute("SELECT cents, supplier FROM amount_map")),
+            )
+    finally:
+        conn.close()
+    return {"name_map": dict(_VK_CACHE["name_map"]),
+            "amount_map": dict(_VK_CACHE["amount_map"]),
+            "version": _VK_CACHE["version"]}
+
+def vk_upsert_names(items) -> int:
+    """(פרטים, מס' ספק) – הוספה/עדכון; מחזיר מס' רשומות שהשתנו."""
+    conn = _vk_connect()
+    try:
+        return _vk_write(conn, lambda c: _upsert_names(c, items))
+    finally:
+        conn.close()
+
+def vk_upsert_amounts(items) -> int:
+    """(סכום ₪, מס' ספק) – הוספה/עדכון לפי ערך מוחלט."""
+    conn = _vk_connect()
+    try:
+        return _vk_write(conn, lambda c: _upsert_amounts(c, items))
+    finally:
+        conn.close()
+
+def import_name_map_from_excel(file):
+    """
+    ייבוא מיפוי ספקים מאקסל:
+    עמודה 1 – 'פרטים' (או כותרת דומה),
+    עמודה 2 – 'מס' ספק'.
+    כל הקובץ נכתב בטרנזקציה אחת. file – נתיב או קובץ פתוח (xlsx/xls/CSV/Parquet);
+    xlsx נקרא דרך מטמון ה-snapshots.
+    """
+    if hasattr(file, "read"):
+        data = file.read()
+    else:
+        with open(file, "rb") as f:
+            data = f.read()
+    df = read_input_df(data, snapshot=True)
+
+    col_det = pick_col(df, DETAILS) or df.columns[0]
+    col_sup = pick_col(df, ["מס' ספק", "מס ספק", "מספר ספק", "ספק", "Supplier", "Supplier No"])
+    if col_sup is None:
+        if len(df.columns) < 2:
+            raise ValueError("הקובץ חייב לפחות שתי עמודות: פרטים ומס' ספק.")
+        col_sup = df.columns[1]
+
+    df_sub = df[[col_det, col_sup]].dropna()     # תא ריק – לא 'nan'/'None' כמפתח
+    pairs = [(n, p) for n, p in zip((str(x).strip() for x in df_sub[col_det]),
+                                    (str(x).strip() for x in df_sub[col_sup]))
+             if n and p]
+    # אם הערך השתנה – נעדכן (אחרון מנצח בתוך הקובץ)
+    return vk_upsert_names(dict(pairs).items())
+
+class SupplierMatcher:
+    """
+    אוטומט Aho–Corasick על מפתחות name_map: מעבר אחד על כל 'פרטים'
+    מוצא את כל המפתחות המוכלים בו. קדימות – המפתח שהוכנס ראשון
+    (כמו לולאת ה-contains המקורית).
+    """
+    _NONE = 1 << 62
+
+    def __init__(self, name_map: dict):
+        self.values = list(name_map.values())
+        goto, best = [{}], [self._NONE]
+        for pid, k in enumerate(name_map):
+            if not k:
+                continue
+            node = 0
+            for ch in k:
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    goto.append({})
+                    best.append(self._NONE)
+                    nxt = goto[node][ch] = len(goto) - 1
+                node = nxt
+            best[node] = min(best[node], pid)
+
+        # קישורי כישלון ב-BFS; best[node] = המפתח המוקדם ביותר בשרשרת הפלט
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        for node in queue:
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                best[nxt] = min(best[nxt], best[fail[nxt]])
+                queue.append(nxt)
+        self.goto, self.fail, self.best = goto, fail, best
+
+    def find(self, text: str):
+        """מס' הספק של המפתח המוקדם ביותר שמוכל ב-text, או None."""
+        goto, fail, best = self.goto, self.fail, self.best
+        node, hit = 0, self._NONE
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if best[node] < hit:
+                hit = best[node]
+        return None if hit == self._NONE else self.values[hit]
+
+    def resolve(self, texts) -> list:
+        """פתרון לכל הטקסטים; כל ערך ייחודי נסרק פעם אחת."""
+        texts = [str(t) for t in texts]
+        found = {t: self.find(t) for t in dict.fromkeys(texts)}
+        return [found[t] for t in texts]
+
+_MATCHER_CACHE = {}
+
+def get_supplier_matcher(name_map: dict, version=None) -> SupplierMatcher:
+    """האוטומט נבנה פעם אחת ונשמר עד שגרסת המאגר (או המיפוי) משתנה."""
+    key = ("v", version) if version is not None else hash(tuple(name_map.items()))
+    m = _MATCHER_CACHE.get(key)
+    if m is None:
+        _MATCHER_CACHE.clear()
+        m = _MATCHER_CACHE[key] = SupplierMatcher(name_map)
+    return m
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+def _trigrams(text) -> set:
+    """טריגרמות של טקסט מנורמל (אותיות/ספרות, רווח אחד, רווח בקצוות)."""
+    t = " " + " ".join(_NON_WORD.sub(" ", str(text)).lower().split()) + " "
+    return {t[i:i + 3] for i in range(len(t) - 2)} if len(t) > 2 else set()
+
+class SupplierSuggester:
+    """
+    אינדקס טריגרמות הפוך על מפתחות name_map: לכל 'פרטים' – עד k ספקים שונים
+    לפי דמיון Dice (2·משותפות / (|א|+|ב|)). השאילתה סופרת משותפות ב-bincount
+    על רשימות ההופעה של הטריגרמות שלה בלבד – לא מול כל המפתחות.
+    """
+
+    def __init__(self, name_map: dict):
+        self.keys = [k for k in name_map if k]
+        self.suppliers = [name_map[k] for k in self.keys]
+        postings, sizes = {}, []
+        for i, k in enumerate(self.keys):
+            grams = _trigrams(k)
+            sizes.append(len(grams))
+            for g in grams:
+                postings.setdefault(g, []).append(i)
+        self.sizes = np.asarray(sizes, dtype=np.float64)
+        self.postings = {g: np.asarray(v, dtype=np.int64) for g, v in postings.items()}
+
+    def suggest(self, text, k=None, min_score=None) -> list:
+        """[(מס' ספק, מפתח, ציון)] מהדומה ביותר; ספק שמופיע בכמה מפתחות – פעם אחת."""
+        k = SUGGEST_TOP_K if k is None else k
+        min_score = SUGGEST_MIN_SCORE if min_score is None else min_score
+        grams = _trigrams(text)
+        hits = [self.postings[g] for g in grams if g in self.postings]
+        if not hits:
+            return []
+        shared = np.bincount(np.concatenate(hits), minlength=len(self.keys))
+        score = 2 * shared / (len(grams) + self.sizes)
+        cand = np.flatnonzero(score >= min_score)
+        cand = cand[np.lexsort((cand, -score[cand]))]
+        out, seen = [], set()
+        for i in cand:
+            if self.suppliers[i] not in seen:
+                seen.add(self.suppliers[i])
+                out.append((self.suppliers[i], self.keys[i], round(float(score[i]), 3)))
+                if len(out) == k:
+                    break
+        return out
+
+_SUGGESTER_CACHE = {}
+
+def get_supplier_suggester(name_map: dict, version=None) -> SupplierSuggester:
+    """האינדקס נבנה פעם אחת לכל גרסת מאגר (כמו get_supplier_matcher)."""
+    key = ("v", version) if version is not None else hash(tuple(name_map.items()))
+    m = _SUGGESTER_CACHE.get(key)
+    if m is None:
+        _SUGGESTER_CACHE.clear()
+        m = _SUGGESTER_CACHE[key] = SupplierSuggester(name_map)
+    return m
+
+def format_suggestions(found) -> str:
+    return "; ".join(f"{sup} – {key} ({score:.2f})" for sup, key, score in found)
+
+def unmapped_standing_orders(out) -> pd.DataFrame:
+    """שורות גיליון הוראת קבע בלי מס' ספק מקובץ פלט (bytes או נתיב): 'פרטים', 'סכום חובה'."""
+    cols = ["פרטים", "סכום חובה"]
+    try:
+        vk = pd.read_excel(io.BytesIO(out) if isinstance(out, bytes) else out, sheet_name=VK_SHEET)
+    except (ValueError, KeyError, OSError):
+        return pd.DataFrame(columns=cols)
+    if not {"פרטים", "מס' ספק", "סכום חובה"} <= set(vk.columns):
+        return pd.DataFrame(columns=cols)
+    return vk.loc[vk["מס' ספק"].isna() & vk["פרטים"].notna(), cols].reset_index(drop=True)
+
+def supplier_suggestions(out, limit=None) -> pd.DataFrame:
+    """
+    שורות הוראת קבע בלי מס' ספק – קובץ פלט (bytes או נתיב) או תוצאת
+    unmapped_standing_orders – לכל 'פרטים' ייחודי: 'פרטים', 'סכום חובה' (סה"כ), 'שורות',
+    'הצעות' [(ספק, מפתח, ציון)] – לפי המאגר הנוכחי, כך שמיפוי שנשמר בינתיים כבר
+    לא מוצע. ממוין לפי סכום, עד limit.
+    """
+    cols = ["פרטים", "סכום חובה", "שורות", "הצעות"]
+    vk = out if isinstance(out, pd.DataFrame) else unmapped_standing_orders(out)
+    if vk.empty:
+        return pd.DataFrame(columns=cols)
+    store = vk_load()
+    matcher = get_supplier_matcher(store["name_map"], store["version"])
+    vk = vk[[matcher.find(str(t)) is None for t in vk["פרטים"]]]
+    g = (vk.assign(פרטים=vk["פרטים"].astype(str))
+           .groupby("פרטים", sort=False).agg(**{"סכום חובה": ("סכום חובה", "sum"), "שורות": ("סכום חובה", "size")})
+           .sort_values("סכום חובה", ascending=False).reset_index())
+    if limit is not None:
+        g = g.head(limit)
+    sugg = get_supplier_suggester(store["name_map"], store["version"])
+    g["הצעות"] = [sugg.suggest(t) for t in g["פרטים"]]
+    return g[cols]
+
+def build_vlookup_sheet(rf: ReconFrame) -> pd.DataFrame:
+    """
+    כל שורה כלל 2 → 'סכום חובה' = |סכום|.
+    שורת סיכום 20001 בזכות = סה״כ חובה של השורות שיש להן 'מס' ספק'.
+    שורות בלי 'מס' ספק' – יצבעו בכתום בשלב העיצוב, ובעמודה 'הצעות ספק' –
+    הספקים הדומים ביותר לפי טריגרמות (SupplierSuggester).
+    """
+    store = vk_load()
+    name_map   = store["name_map"]
+    amount_map = store["amount_map"]
+
+    col_bamt  = rf.cols["bamt"]
+    col_det   = rf.cols["det"]
+
+    rows = np.flatnonzero(rf.match == 2)
+    vk = rf.df.iloc[rows][[col_det, col_bamt]].rename(columns={col_det: "פרטים", col_bamt: "סכום"})
+    if vk.empty:
+        return pd.DataFrame(columns=["פרטים", "סכום", "מס' ספק", "סכום חובה", "סכום זכות", SUGGEST_COL])
+
+    hova_c = np.where(rf.has_bamt[rows], np.abs(rf.bamt_c[rows]), 0)
+
+    # שם (Aho–Corasick) ואם לא נמצא – סכום מוחלט (אגורות) מ-amount_map
+    by_name = pd.Series(get_supplier_matcher(name_map, store["version"]).resolve(vk["פרטים"]), index=vk.index, dtype=object)
+    by_amt  = pd.Series(np.where(rf.has_bamt[rows], hova_c, -1), index=vk.index).map(amount_map)
+    vk["מס' ספק"]   = by_name.where(by_name.notna(), by_amt.astype(object).where(by_amt.notna(), ""))
+    vk["סכום חובה"] = hova_c / 100
+    vk["סכום זכות"] = 0.0
+
+    # בלי מס' ספק – הצעות לבחירה ידנית (כל 'פרטים' ייחודי נבדק פעם אחת)
+    unmapped = (vk["מס' ספק"].astype(str).str.len() == 0).to_numpy()
+    vk[SUGGEST_COL] = ""
+    if unmapped.any():
+        sugg = get_supplier_suggester(name_map, store["version"])
+        texts = vk["פרטים"].astype(str)[unmapped]
+        found = {t: format_suggestions(sugg.suggest(t)) for t in dict.fromkeys(texts)}
+        vk.loc[unmapped, SUGGEST_COL] = texts.map(found).to_numpy(dtype=object)
+
+    total_c = int(hova_c[(vk["מס' ספק"].astype(str).str.len() > 0).to_numpy()].sum())
+    if total_c:
+        vk = pd.concat([vk, pd.DataFrame([{
+            "פרטים": "סה\"כ זכות – עם מס' ספק",
+            "סכום": 0.0,
+            "מס' ספק": 20001,
+            "סכום חובה": 0.0,
+            "סכום זכות": total_c / 100
+        }])], ignore_index=True)
+
+    return vk
+
+# ---------------- Pairing kernel ----------------
+def pair_rows(bank_mask, books_mask, bank_keys, books_keys, unique_only=False):
+    """
+    התאמה 1:1 וקטורית לפי מפתח (סכום באגורות, אופציונלית + תאריך).
+    • unique_only – רק מפתחות עם שורה אחת בדיוק בכל צד (כלל 1).
+    • אחרת – min(n, m) זוגות לפי דירוג השורות בכל קבוצה (כלל 11).
+    מחזיר (i, j) – שורות בנק/ספרים, בסדר שבו לולאת מילונים הייתה מתאימה.
+    """
+    bi, bj = np.flatnonzero(bank_mask), np.flatnonzero(books_mask)
+    kn = [f"k{n}" for n in range(len(bank_keys))]
+    b = pd.DataFrame({"i": bi, **{k: a[bi] for k, a in zip(kn, bank_keys)}})
+    o = pd.DataFrame({"j": bj, **{k: a[bj] for k, a in zip(kn, books_keys)}})
+
+    gb, go = b.groupby(kn, sort=False), o.groupby(kn, sort=False)
+    b["r"], o["r"] = gb.cumcount(), go.cumcount()
+    b["first"] = gb["i"].transform("min")
+    if unique_only:
+        b = b[gb["i"].transform("size") == 1]
+        o = o[go["j"].transform("size") == 1]
+
+    p = b.merge(o, on=kn + ["r"]).sort_values(["first", "r"], kind="stable")
+    i, j = p["i"].to_numpy(), p["j"].to_numpy()
+
+    # שורה שהיא גם צד בנק וגם צד ספרים – 1:1 לפי הסדר (נדיר)
+    if np.any(bank_mask & books_mask):
+        used, keep = set(), []
+        for n, (x, y) in enumerate(zip(i, j)):
+            if x not in used and y not in used:
+                used.update((x, y))
+                keep.append(n)
+        i, j = i[keep], j[keep]
+    return i, j
+
+_COMBOS = {}
+
+def pair_nearest(bank_mask, books_mask, bank_key, books_key, day, window):
+    """
+    התאמה 1:1 לפי מפתח (סכום באגורות) עם תאריך בטווח ±window ימים (כולל הקצוות),
+    הקרוב ביותר קודם. מיון אחד לפי (מפתח, תאריך) ומעבר אחד: שורות ממתינות (תמיד
+    מאותו צד, לפי תאריך) נשמטות כשהן יוצאות מהטווח; שורה מהצד השני מותאמת לממתינה
+    האחרונה (הקרובה מבין הקודמות לה) – אלא אם השורה הבאה במיון, מהצד הממתין, קרובה
+    ממנה. O(n log n) גם כשמפתחות חוזרים.
+    מובטח: כל זוג באותו מפתח ובטווח; כל שורה בזוג אחד לכל היותר; כשהמסכות זרות (כמו
+    בכלל 1) התוצאה מקסימלית – לא נשאר זוג פנוי שאפשר להוסיף. שורה בשתי המסכות לא
+    מותאמת לעצמה, ואז המקסימליות לא מובטחת.
+    לא מובטח: מספר הזוגות המרבי – זו חמדנות לפי קרבה, ולעתים נדירות יוצאים פחות זוגות
+    מהאפשרי (למשל כשהקרוב לוקח שורה שהייתה היחידה בטווח של שורה אחרת).
+    שוויון במרחק → התאריך המוקדם. כמה מועמדים באותו מפתח, תאריך וצד – לפי סדר המיון
+    (כלל 1 משאיר מפתחות כאלה מחוץ למעבר הזה).
+    מחזיר (i, j) – שורות בנק/ספרים.
+    """
+    bi, bj = np.flatnonzero(bank_mask), np.flatnonzero(books_mask)
+    rows = np.r_[bi, bj]
+    side = np.r_[np.zeros(len(bi), dtype=np.int8), np.ones(len(bj), dtype=np.int8)]
+    key = np.r_[bank_key[bi], books_key[bj]]
+    d = np.r_[day[bi], day[bj]]
+    order = np.lexsort((rows, side, d, key))
+    rows, side, key, d = (a[order].tolist() for a in (rows, side, key, d))
+
+    n, used, pending, cur = len(rows), set(), deque(), None
+    out_i, out_j = [], []
+
+    def pair(k, m):
+        used.update((rows[k], rows[m]))
+        b, o = (k, m) if side[k] == 0 else (m, k)
+        out_i.append(rows[b])
+        out_j.append(rows[o])
+
+    for k in range(n):
+        r = rows[k]
+        if r in used:
+            continue
+        if key[k] != cur:
+            pending.clear()
+            cur = key[k]
+        while pending and (d[k] - d[pending[0]] > window or rows[pending[0]] in used):
+            pending.popleft()
+        while pending and rows[pending[-1]] in used:
+            pending.pop()
+        if not pending or side[pending[-1]] == side[k]:
+            pending.append(k)
+            continue
+        p = pending[-1]
+        if rows[p] == r:                    # אותה שורה בשני הצדדים
+            continue
+        nx = k + 1
+        if (nx < n and key[nx] == cur and side[nx] == side[p] and rows[nx] not in used and rows[nx] != r
+                and d[nx] - d[k] < d[k] - d[p]):
+            pair(k, nx)
+        else:
+            pending.pop()
+            pair(k, p)
+    return np.asarray(out_i, dtype=np.int64), np.asarray(out_j, dtype=np.int64)
+
+def _combos(n, size):
+    """כל צירופי size מתוך n כמערך אינדקסים (נשמר לפי (n, size))."""
+    key = (n, size)
+    if key not in _COMBOS:
+        _COMBOS[key] = np.array(list(combinations(range(n), size)), dtype=np.int64).reshape(-1, size)
+    return _COMBOS[key]
+
+def _subset_sum(vals, target, max_group, deadline):
+    """
+    אינדקסים (2..max_group) ב-vals (חיוביים, ממוינים) שסכומם בדיוק target, או None.
+    meet-in-the-middle לכל גודל k: סכומי כל צירופי ⌊k/2⌋ ממוינים, וחיפוש המשלים
+    של כל צירוף ⌈k/2⌉ ב-searchsorted. גיזום: k שסכום k הקטנים > target או סכום
+    k הגדולים < target – מדולג.
+    """
+    vals = np.asarray(vals, dtype=np.int64)
+    n = len(vals)
+    csum = np.r_[0, np.cumsum(vals)]
+    for k in range(2, min(max_group, n) + 1):
+        if csum[k] > target:
+            break
+        if csum[n] - csum[n - k] < target:
+            continue
+        if time.perf_counter() > deadline:
+            return None
+        left, right = _combos(n, k // 2), _combos(n, k - k // 2)
+        ls = vals[left].sum(axis=1)
+        order = np.argsort(ls, kind="stable")
+        ls = ls[order]
+        need = target - vals[right].sum(axis=1)
+        lo, hi = np.searchsorted(ls, need, "left"), np.searchsorted(ls, need, "right")
+        for r in np.flatnonzero(hi > lo):
+            for l in order[lo[r]:hi[r]]:
+                if not set(left[l]) & set(right[r]):
+                    return tuple(sorted(left[l].tolist() + right[r].tolist()))
+    return None
+
+def subset_sum_match(match, bank_rows, books_rows, bank_c, books_c, datev, rule,
+                     max_group, window=None, max_cand=None, budget=None, ledger=None) -> int:
+    """
+    רבים-לאחד: לכל שורת בנק פתוחה (לפי סדר השורות) – קבוצה של 2..max_group
+    שורות ספרים פתוחות באותו סימן, שסכום |הסכומים| שלהן = |סכום הבנק| באגורות.
+    • מועמדים: ±window ימים מתאריך הבנק (None = הכל), ≤ היעד, max_cand
+      הקרובים בתאריך (שוויון → השורה המוקדמת).
+    • budget – שניות לכל הקריאה; בתום הזמן עוצרים (השאר נשאר 0).
+    מסמן rule בבנק ובספרים (וכל קבוצה ב-ledger, אם ניתן); מחזיר את מס' הקבוצות שנמצאו.
+    """
+    if max_group < 2 or not len(bank_rows) or not len(books_rows):
+        return 0
+    max_cand = SUBSET_MAX_CANDIDATES if max_cand is None else max_cand
+    deadline = time.perf_counter() + (SUBSET_TIME_BUDGET if budget is None else budget)
+    has_day = ~np.isnat(datev)
+    day = np.where(has_day, datev.astype("datetime64[D]").astype(np.int64), 0)
+
+    # ספרים ממוינים לפי תאריך → טווח לכל שורת בנק ב-searchsorted
+    books_rows = np.asarray(books_rows, dtype=np.int64)
+    if window is not None:
+        books_rows = books_rows[has_day[books_rows]]
+        books_rows = books_rows[np.argsort(day[books_rows], kind="stable")]
+    books_day = day[books_rows]
+
+    found = 0
+    for b in bank_rows:
+        if time.perf_counter() > deadline:
+            break
+        target = abs(int(bank_c[b]))
+        if match[b] != 0 or target == 0:
+            continue
+        if window is None:
+            cand = books_rows
+        elif not has_day[b]:
+            continue
+        else:
+            lo = np.searchsorted(books_day, day[b] - window, side="left")
+            hi = np.searchsorted(books_day, day[b] + window, side="right")
+            cand = books_rows[lo:hi]
+        vals = books_c[cand]
+        cand = cand[(match[cand] == 0) & (vals != 0) & (np.abs(vals) <= target)]
+        for pos in (True, False):
+            sel = cand[(books_c[cand] > 0) == pos]
+            if len(sel) < 2:
+                continue
+            sel = sel[np.lexsort((sel, np.abs(day[sel] - day[b])))][:max_cand]
+            sel = sel[np.argsort(np.abs(books_c[sel]), kind="stable")]
+            group = _subset_sum(np.abs(books_c[sel]), target, max_group, deadline)
+            if group:
+                match[b] = rule
+                match[sel[list(group)]] = rule
+                if ledger is not None:
+                    ledger.add_group(rule, [b], sel[list(group)], bank_c, books_c)
+                found += 1
+                break
+    return found
+
+# ---------------- Rules 1–4 ----------------
+def _rule_1(rf, window=0):
+    match, code_i, bamt, aamt, datev = rf.match, rf.code_i, rf.bamt_c, rf.aamt_c, rf.date
+    has_date = ~np.isnat(datev)
+    bank = (match == 0) & np.isin(code_i, list(OVRC_CODES)) & rf.has_bamt & (bamt < 0) & has_date
+    books = (match == 0) & rf.has_aamt & (aamt > 0) & has_date & np.isin(rf.ref1_pfx, ["OV", "RC"])
+    day = datev.view("int64")
+    i, j = pair_rows(bank, books, [np.abs(bamt), day], [np.abs(aamt), day], unique_only=True)
+    match[i] = 1
+    match[j] = 1
+    rf.pairs.add_pairs(1, i, j, bamt, aamt)
+
+    # ±window ימים: מה שנשאר פתוח – לפי סכום, התאריך הקרוב ביותר. מפתחות (סכום, תאריך)
+    # שהמעבר המדויק דילג עליהם כלא-חד-משמעיים נשארים בחוץ גם כאן (כל השורות שלהם).
+    if window:
+        b_rows, o_rows = np.flatnonzero(bank), np.flatnonzero(books)
+        keys = pd.DataFrame({"a": np.r_[np.abs(bamt[b_rows]), np.abs(aamt[o_rows])],
+                             "d": np.r_[day[b_rows], day[o_rows]],
+                             "s": np.r_[np.zeros(len(b_rows), np.int64), np.ones(len(o_rows), np.int64)]})
+        g = keys.groupby(["a", "d"])["s"]
+        n_books, n_all = g.transform("sum").to_numpy(), g.transform("size").to_numpy()
+        ambiguous = np.zeros(len(match), dtype=bool)
+        ambiguous[np.r_[b_rows, o_rows][(n_books > 1) | (n_all - n_books > 1)]] = True
+        i, j = pair_nearest(bank & (match == 0) & ~ambiguous, books & (match == 0) & ~ambiguous,
+                            np.abs(bamt), np.abs(aamt), datev.astype("datetime64[D]").astype(np.int64), window)
+        match[i] = 1
+        match[j] = 1
+        rf.pairs.add_pairs(1, i, j, bamt, aamt)
+
+def _rule_2(rf):
+    rf.match[(rf.match == 0) & np.isin(rf.code_i, list(STANDING_CODES))] = 2
+
+def _rule_4(rf, eps=None):
+    #    join לפי אסמכתא מנורמלת (ספרות); בכל קבוצה – הבנק לפי סדר השורות,
+    #    לכל שורת בנק הספרים הקרובה ביותר בסכום (שוויון → השורה המוקדמת).
+    match, code_i, bamt, aamt = rf.match, rf.code_i, rf.bamt_c, rf.aamt_c
+    eps = cents(RULE4_EPS if eps is None else eps)
+    bank_idx = np.flatnonzero((match == 0) & (code_i == RULE4_CODE) & rf.ref1_ok & rf.has_bamt)
+    books_idx = np.flatnonzero((match == 0) & (rf.ref1_pfx == "CH") & rf.ref2_ok & rf.has_aamt)
+    cand = pd.DataFrame({"i": bank_idx, "key": rf.ref1_d[bank_idx], "ab": np.abs(bamt[bank_idx])}).merge(
+        pd.DataFrame({"j": books_idx, "key": rf.ref2_d[books_idx], "aj": np.abs(aamt[books_idx])}), on="key")
+    cand["d"] = (cand["aj"] - cand["ab"]).abs()
+    cand = cand[(cand["d"] <= eps) & (cand["i"] != cand["j"])].sort_values(["i", "d", "j"], kind="stable")
+    pi, pj = [], []
+    for i, j in zip(cand["i"].to_numpy(), cand["j"].to_numpy()):
+        if match[i] == 0 and match[j] == 0:
+            match[i] = 4
+            match[j] = 4
+            pi.append(i)
+            pj.append(j)
+    rf.pairs.add_pairs(4, pi, pj, bamt, aamt)
+
+# ---------------- Rule 3 ----------------
+def apply_rule_3(rf: ReconFrame, a_df: pd.DataFrame, eps=None, max_group=1, window=None) -> list:
+    """
+    כלל 3 – סכומים זהים בלבד (ללא דרישת תאריך).
+    eps – טולרנס בש"ח (ברירת מחדל RULE3_AMOUNT_EPS).
+    max_group > 1 – אחרי האירועים, בנק 485 פתוח ↔ צירוף שורות תשלום פתוחות
+    (subset_sum_match, ±window ימים); אירוע שכל שורותיו הותאמו כך יוצא מהפערים.
+    מחזיר רשימת פערים לגיליון 'פערי סכומים – כלל 3'.
+    """
+    c_dt   = pick_col(a_df, AUX_DATE_KEYS)   # תאריך/חותמת אירוע
+    c_amt  = pick_col(a_df, AUX_AMT_KEYS)    # אחרי ניכוי
+    c_pay  = pick_col(a_df, AUX_PAYNO_KEYS)  # מס' תשלום
+    if not (c_dt and c_amt):
+        return []
+
+    a_dt  = pd.to_datetime(a_df[c_dt], errors="coerce")               # אירוע
+    a_amt = to_cents(pd.to_numeric(a_df[c_amt], errors="coerce"))
+    sums  = (pd.DataFrame({"evt": a_dt, "amt": a_amt})
+               .dropna(subset=["evt"])
+               .groupby("evt")["amt"].sum())                          # ממוין לפי אירוע
+    evt_id = pd.Series(np.arange(len(sums)), index=sums.index)
+
+    match = rf.match
+    bamt  = rf.bamt_c
+    aamt  = rf.aamt_c
+    eps   = cents(RULE3_AMOUNT_EPS if eps is None else eps)
+    has_books = bool(c_pay and rf.cols["ref1"] and rf.cols["aamt"])
+
+    # ספרים: join של (אירוע, מס' תשלום) מול אסמכתא 1 → (אירוע, שורה), ממוין לפי אירוע
+    cand_evt = cand_row = np.array([], dtype=np.int64)
+    if has_books:
+        pays = (pd.DataFrame({"evt": a_dt, "pay": a_df[c_pay].astype(str).str.strip()})
+                  .dropna().drop_duplicates())
+        rows0 = np.flatnonzero(match == 0)
+        cand = (pays.merge(pd.DataFrame({"pay": rf.ref1_s[rows0], "row": rows0}), on="pay")
+                    .assign(eid=lambda d: evt_id.reindex(d["evt"]).to_numpy())
+                    .sort_values(["eid", "row"]))
+        cand_evt, cand_row = cand["eid"].to_numpy(dtype=np.int64), cand["row"].to_numpy(dtype=np.int64)
+    eids = np.arange(len(sums))
+    b_lo, b_hi = np.searchsorted(cand_evt, eids, "left"), np.searchsorted(cand_evt, eids, "right")
+
+    # בנק: שורות 485 ממוינות לפי |סכום| → טווח לכל אירוע ב-searchsorted
+    bank_mask = ((match == 0) & (rf.code == TRANSFER_CODE) & rf.has_bamt & (bamt > 0)
+                 & pd.Series(rf.det).str.contains(TRANSFER_PHRASE, na=False).to_numpy(dtype=bool))
+    bank_rows = np.flatnonzero(bank_mask)
+    order = np.argsort(np.abs(bamt[bank_rows]), kind="stable")
+    bank_rows = bank_rows[order]
+    bank_abs  = np.abs(bamt[bank_rows])
+    evt_abs   = np.abs(sums.to_numpy(dtype=np.int64))
+    k_lo = np.searchsorted(bank_abs, evt_abs - eps, "left")
+    k_hi = np.searchsorted(bank_abs, evt_abs + eps, "right")
+
+    mismatches = []
+    for k, (evt, evt_sum) in enumerate(sums.items()):
+        # ספרים של האירוע שעדיין פתוחים (אירוע קודם יכול היה לתפוס אותם)
+        books_idx = cand_row[b_lo[k]:b_hi[k]]
+        books_idx = books_idx[match[books_idx] == 0]
+        books_sum = int(aamt[books_idx].sum())
+
+        # בנק – כל השורות שסכומן |bamt| == |evt_sum|
+        bank_idx = bank_rows[k_lo[k]:k_hi[k]]
+
+        if len(bank_idx) and len(books_idx):
+            # התאמה חייבת להיות שוויון בערך מוחלט
+            if abs(abs(books_sum) - abs(evt_sum)) <= eps:
+                bank_hit = bank_idx[np.isin(match[bank_idx], (0, 2))]
+                match[bank_hit] = 3
+                match[books_idx] = 3
+                rf.pairs.add_group(3, bank_hit, books_idx, bamt, aamt)
+            else:
+                mismatches.append({
+                    "אירוע": str(evt),
+                    "סכום בעזר (אחרי ניכוי)": evt_sum / 100,
+                    "סכום בספרים (סיכום)": books_sum / 100,
+                    "פער |ספרים|-|עזר|": abs(abs(books_sum) - abs(evt_sum)) / 100,
+                    "count_בנק": len(bank_idx),
+                    "count_ספרים": len(books_idx),
+                    "_books_rows": books_idx,
+                })
+        else:
+            mismatches.append({
+                "אירוע": str(evt),
+                "סכום בעזר (אחרי ניכוי)": evt_sum / 100,
+                "סכום בספרים (סיכום)": books_sum / 100 if len(books_idx) else np.nan,
+                "פער |ספרים|-|עזר|": np.nan,
+                "count_בנק": len(bank_idx),
+                "count_ספרים": len(books_idx),
+                "_books_rows": books_idx,
+            })
+
+    if max_group > 1 and len(cand_row):
+        if subset_sum_match(match, np.sort(bank_rows), np.unique(cand_row), bamt, aamt, rf.date, 3,
+                            max_group, window, ledger=rf.pairs):
+            mismatches = [m for m in mismatches
+                          if not (len(m["_books_rows"]) and (match[m["_books_rows"]] == 3).all())]
+
+    return mismatches
+
+# ---------------- Rules 5–10 (table) ----------------
+_RULE_KEYS  = {"match", "codes", "sign", "min_abs", "max_abs", "details", "details_match"}
+_RULE_SIGNS = {"positive", "negative", "nonzero"}
+_RULES_TABLE_CACHE = {}
+
+def _is_num(v, kind=numbers.Real) -> bool:
+    return isinstance(v, kind) and not isinstance(v, bool)
+
+def validate_simple_rules(rules) -> list:
+    """
+    בדיקת טבלת כללים (רשימת dict); מחזיר עותק מנורמל.
+    סוג שגוי (כולל bool במקום מספר) → TypeError; ערך לא חוקי → ValueError.
+    """
+    out = []
+    for n, r in enumerate(rules, start=1):
+        if not isinstance(r, dict):
+            raise TypeError(f"כלל {n}: נדרש אובייקט.")
+        bad = set(r) - _RULE_KEYS
+        if bad:
+            raise ValueError(f"כלל {n}: שדות לא מוכרים {sorted(bad)}.")
+        m = r.get("match")
+        if not _is_num(m, numbers.Integral):
+            raise TypeError(f"כלל {n}: 'match' חייב להיות מספר שלם חיובי.")
+        if m <= 0:
+            raise ValueError(f"כלל {n}: 'match' חייב להיות מספר שלם חיובי.")
+        codes = r.get("codes")
+        if not isinstance(codes, (list, tuple)) or not all(_is_num(c) for c in codes):
+            raise TypeError(f"כלל {n}: 'codes' חייב להיות רשימת קודים.")
+        if not codes:
+            raise ValueError(f"כלל {n}: 'codes' חייב להיות רשימת קודים.")
+        lo, hi = r.get("min_abs"), r.get("max_abs")
+        for name, v in (("min_abs", lo), ("max_abs", hi)):
+            if v is not None and not _is_num(v):
+                raise TypeError(f"כלל {n}: '{name}' חייב להיות מספר.")
+        if lo is not None and hi is not None and lo > hi:
+            raise ValueError(f"כלל {n}: 'min_abs' גדול מ-'max_abs'.")
+        if r.get("details") is not None and not isinstance(r["details"], str):
+            raise TypeError(f"כלל {n}: 'details' חייב להיות מחרוזת.")
+        if not isinstance(r.get("sign", "nonzero"), str) or r.get("sign", "nonzero") not in _RULE_SIGNS:
+            raise ValueError(f"כלל {n}: 'sign' חייב להיות אחד מ-{sorted(_RULE_SIGNS)}.")
+        if r.get("details_match", "exact") not in ("exact", "contains"):
+            raise ValueError(f"כלל {n}: 'details_match' חייב להיות exact או contains.")
+        out.append({"match": int(m), "codes": sorted({float(c) for c in codes}),
+                    "sign": r.get("sign", "nonzero"), "min_abs": lo, "max_abs": hi,
+                    "details": r.get("details"), "details_match": r.get("details_match", "exact")})
+    return out
+
+def load_simple_rules(path=None, rule5_max=None) -> list:
+    """
+    טבלת כללים 5–10: מ-RULES_TABLE_FILE אם קיים (רשימה או {"rules": [...]}),
+    אחרת default_simple_rules(). הקובץ נקרא מחדש רק כשהשתנה.
+    rule5_max (what-if) – תקרת כלל 5 מעל הטבלה (max_abs של שורות match=5), גם כשיש קובץ.
+    """
+    path = path or RULES_TABLE_FILE
+    try:
+        key = (os.path.abspath(path), os.stat(path).st_mtime_ns)
+    except OSError:
+        return validate_simple_rules(default_simple_rules(rule5_max))
+    if _RULES_TABLE_CACHE.get("key") != key:
+        with open(path, "r", encoding="utf-8") as f:
+            rules = json.load(f)
+        if isinstance(rules, dict):
+            rules = rules.get("rules", [])
+        _RULES_TABLE_CACHE.update(key=key, rules=validate_simple_rules(rules))
+    rules = _RULES_TABLE_CACHE["rules"]
+    if rule5_max is not None:
+        rules = [dict(r, max_abs=rule5_max) if r["match"] == 5 else r for r in rules]
+    return rules
+
+def rule5_cap(rules=None):
+    """תקרת כלל 5 בטבלה (max_abs של שורת match=5 הראשונה); None – אין כלל 5 או אין תקרה."""
+    rules = load_simple_rules() if rules is None else rules
+    return next((r["max_abs"] for r in rules if r["match"] == 5), None)
+
+def apply_simple_rules(rf: ReconFrame, rules=None):
+    """
+    מעבר אחד לכל הכללים הפשוטים: תנאי לכל שורת טבלה → np.select לפי עדיפות,
+    והשמה רק לשורות שמס' ההתאמה שלהן 0. 'פרטים' מושווים דרך קודים קטגוריאליים
+    (השוואת מחרוזות פעם אחת לכל ערך ייחודי, לא לכל שורה).
+    """
+    rules = load_simple_rules() if rules is None else rules
+    if not rules:
+        return
+    match, bamt, has = rf.match, rf.bamt_c, rf.has_bamt
+    det_codes, det_cats = pd.factorize(rf.det)
+    det_cats = pd.Index(det_cats, dtype=object)
+    code_codes, code_cats = pd.factorize(rf.code)       # NaN → -1
+    babs = np.abs(bamt)
+    sign_ok = {"positive": has & (bamt > 0), "negative": has & (bamt < 0), "nonzero": has & (bamt != 0)}
+
+    conds, targets = [], []
+    for r in rules:
+        code_lut = np.append(np.isin(code_cats, r["codes"]), False)
+        cond = code_lut[code_codes] & sign_ok[r["sign"]]
+        if r["min_abs"] is not None:
+            cond &= babs >= cents(r["min_abs"])
+        if r["max_abs"] is not None:
+            cond &= babs <= cents(r["max_abs"])
+        if r["details"] is not None:
+            if r["details_match"] == "contains":
+                det_lut = det_cats.str.contains(r["details"], regex=False, na=False)
+            else:
+                det_lut = det_cats == r["details"]
+            cond &= np.append(np.asarray(det_lut, dtype=bool), False)[det_codes]
+        conds.append(cond)
+        targets.append(r["match"])
+
+    sel = np.select(conds, targets, 0)
+    hit = (match == 0) & (sel != 0)
+    match[hit] = sel[hit]
+
+# ---------------- Open items (carry-forward) ----------------
+# שורות שנשארו 0 בכל הרצה נשמרות ב-OPEN_ITEMS_DB לפי חשבון/ישות (account) ומקור יציב
+# (source – תקופה או שם קובץ, לא hash התוכן: גרסה מתוקנת של אותו חודש מחליפה את הקודמת),
+# מאונדקסות לפי (חשבון, סוג, אגורות) ו-(חשבון, סוג, אסמכתא מנורמלת). ההרצה הבאה
+# מתאימה את השורות הפתוחות שלה מול הפריטים הפתוחים של אותו חשבון בלבד, בטווח
+# ±CARRY_FORWARD_DAYS ימים – בלי לקרוא שוב קבצים ישנים.
+#   cheque_bank / cheque_books – כלל 4 (אסמכתא + RULE4_EPS)
+#   transfer_bank / event       – כלל 3 (בנק 485 ↔ אירוע מקבץ-נט בלי צד בנק)
+#   transfer_bank / bt_books    – כלל 11 (BT לפי סכום מוחלט)
+#   other                       – שאר השורות הפתוחות (לתיעוד)
+_OI_SCHEMA = """
+CREATE TABLE IF NOT EXISTS open_items (
+    id          INTEGER PRIMARY KEY,
+    account     TEXT NOT NULL DEFAULT '',   -- חשבון/ישות – התאמה רק בתוכו
+    source      TEXT NOT NULL,              -- תקופה / שם קובץ (_oi_source)
+    source_name TEXT NOT NULL DEFAULT '',
+    row         INTEGER NOT NULL,           -- שורת Excel בקובץ המקור
+    kind        TEXT NOT NULL,
+    cents       INTEGER NOT NULL,           -- |סכום| באגורות
+    ref         TEXT NOT NULL DEFAULT '',   -- אסמכתא מנורמלת (ספרות)
+    amount      REAL,
+    date        TEXT,
+    details     TEXT,
+    rows        TEXT,                       -- אירוע: שורות הספרים (JSON)
+    consumed_by TEXT                        -- המקור שסגר את הפריט
+);
+"""
+# אחרי הוספת account לקובץ ישן (פריטים ישנים נשארים בחשבון '' – לא מותאמים)
+_OI_INDEXES = """
+DROP INDEX IF EXISTS open_items_cents;
+DROP INDEX IF EXISTS open_items_ref;
+DROP INDEX IF EXISTS open_items_open;
+CREATE INDEX IF NOT EXISTS open_items_acct_cents  ON open_items (account, kind, cents);
+CREATE INDEX IF NOT EXISTS open_items_acct_ref    ON open_items (account, kind, ref);
+CREATE INDEX IF NOT EXISTS open_items_acct_open   ON open_items (account, consumed_by, source);
+CREATE INDEX IF NOT EXISTS open_items_acct_source ON open_items (account, source);
+"""
+# קובץ ישן עם UNIQUE (account, source, kind, row): שורה שנסגרה חוסמת שורה חדשה באותו
+# מיקום בגרסה מתוקנת – בונים את הטבלה מחדש בלי האילוץ
+_OI_REBUILD = """
+ALTER TABLE open_items RENAME TO open_items_old;
+{schema}
+INSERT INTO open_items (id, account, source, source_name, row, kind, cents, ref, amount, date, details, rows,
+                        consumed_by)
+SELECT id, account, source, source_name, row, kind, cents, ref, amount, date, details, rows, consumed_by
+FROM open_items_old;
+DROP TABLE open_items_old;
+"""
+_OI_READY = set()
+
+def _oi_connect():
+    conn = sqlite3.connect(OPEN_ITEMS_DB, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout = 30000")
+    path = os.path.abspath(OPEN_ITEMS_DB)
+    if path not in _OI_READY:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.executescript(_OI_SCHEMA)
+        if "account" not in {r[1] for r in conn.execute("PRAGMA table_info(open_items)")}:
+            conn.execute("ALTER TABLE open_items ADD COLUMN account TEXT NOT NULL DEFAULT ''")
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'open_items'").fetchone()[0]
+        if "UNIQUE" in sql:
+            conn.executescript("BEGIN IMMEDIATE;" + _OI_REBUILD.format(schema=_OI_SCHEMA) + "COMMIT;")
+        conn.executescript(_OI_INDEXES)
+        _OI_READY.add(path)
+    return conn
+
+def _oi_account(account) -> str:
+    account = str(account or "").strip()
+    if not account:
+        raise ValueError("התאמה מול פריטים פתוחים דורשת חשבון/ישות (account).")
+    return account
+
+def _oi_source(period="", source_name="") -> str:
+    """מפתח המקור בפריטים הפתוחים: period אם ניתן, אחרת שם הקובץ – יציב בין גרסאות של אותו חודש."""
+    source = str(period or "").strip() or str(source_name or "").strip()
+    if not source:
+        raise ValueError("התאמה מול פריטים פתוחים דורשת תקופה או שם קובץ (period / source_name).")
+    return source
+
+def open_items_fingerprint(source: str, account: str) -> str:
+    """מצב הפריטים הזמינים לקובץ source בחשבון account (לא שלו; פתוחים או שהוא עצמו סגר)."""
+    conn = _oi_connect()
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0), COALESCE(SUM(id), 0) FROM open_items "
+            "WHERE account = ? AND source != ? AND (consumed_by IS NULL OR consumed_by = ?)",
+            (account, source, source)).fetchone()
+    finally:
+        conn.close()
+    return ":".join(map(str, row))
+
+def open_items_count(account=None) -> int:
+    """פריטים פתוחים – בחשבון account, או בכל החשבונות (None)."""
+    conn = _oi_connect()
+    try:
+        if account is None:
+            return conn.execute("SELECT COUNT(*) FROM open_items WHERE consumed_by IS NULL").fetchone()[0]
+        return conn.execute("SELECT COUNT(*) FROM open_items WHERE account = ? AND consumed_by IS NULL",
+                            (str(account).strip(),)).fetchone()[0]
+    finally:
+        conn.close()
+
+def _oi_fetch(conn, account, source, kind, col, keys, tol=0):
+    """פריטים פתוחים בחשבון account מסוג kind שהמפתח שלהם (cents/ref) במרחק ≤ tol מאחד מ-keys – דרך האינדקס."""
+    keys = pd.unique(np.asarray(list(keys), dtype=object)).tolist()      # ערכי Python (לא numpy → BLOB)
+    if not keys:
+        return pd.DataFrame(columns=["id", "source_name", "row", "cents", "ref", "amount", "date", "details", "rows"])
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS oi_keys (k PRIMARY KEY)")
+    conn.execute("DELETE FROM oi_keys")
+    conn.executemany("INSERT OR IGNORE INTO oi_keys VALUES (?)", ((k,) for k in keys))
+    on = f"o.{col} BETWEEN k.k - {int(tol)} AND k.k + {int(tol)}" if tol else f"o.{col} = k.k"
+    return pd.read_sql_query(
+        "SELECT DISTINCT o.id, o.source_name, o.row, o.cents, o.ref, o.amount, o.date, o.details, o.rows "
+        # CROSS JOIN: המפתחות בלולאה החיצונית → חיפוש באינדקס (account, kind, cents/ref) לכל מפתח
+        f"FROM oi_keys k CROSS JOIN open_items o ON o.account = ? AND o.kind = ? AND {on} "
+        "WHERE o.source != ? AND o.consumed_by IS NULL", conn, params=(account, kind, source))
+
+def _greedy_pairs(cur, items, key, tol=0, days=None):
+    """
+    cur(i, key, c, day) × items(id, key, cents, date) → זוגות 1:1 [(i, id)]: לכל שורה
+    (לפי סדר) הפריט הקרוב ביותר בסכום, ובשוויון – הוותיק. key=None → לפי אגורות (±tol).
+    רק פריטים שתאריכם במרחק ≤ days ימים מ-day (CARRY_FORWARD_DAYS; בלי תאריך – לא מותאם).
+    """
+    days = CARRY_FORWARD_DAYS if days is None else days
+    if cur.empty or items.empty:
+        return []
+    if key is None:
+        # דליים בגודל tol+1: כל פריט נכנס לדלי שלו ולשכנים
+        w = int(tol) + 1
+        cur = cur.assign(b=cur["c"] // w)
+        items = pd.concat([items.assign(b=items["cents"] // w + o) for o in (-1, 0, 1)] if tol else
+                          [items.assign(b=items["cents"])])
+        key = "b"
+    cand = cur.merge(items, on=key)
+    cand["d"] = (cand["cents"] - cand["c"]).abs()
+    gap = (pd.to_datetime(cand["date"], errors="coerce") - pd.to_datetime(cand["day"]).dt.normalize()).abs().dt.days
+    cand = cand[(cand["d"] <= tol) & (gap <= days)].sort_values(["i", "d", "id"], kind="stable")
+    used_i, used_id, out = set(), set(), []
+    for i, oid in zip(cand["i"].to_numpy(), cand["id"].to_numpy()):
+        if i not in used_i and oid not in used_id:
+            used_i.add(i)
+            used_id.add(oid)
+            out.append((int(i), int(oid)))
+    return out
+
+def _open_events(rf, mismatches, eps):
+    """אירועי כלל 3 בלי צד בנק, שסכום הספרים הפתוחים שלהם מאוזן → [(מיקום ברשימה, שורות, סכום)]."""
+    out = []
+    for k, m in enumerate(mismatches):
+        rows = m.get("_books_rows")
+        if m["count_בנק"] or rows is None or not len(rows) or (rf.match[rows] != 0).any():
+            continue
+        evt_sum = cents(m["סכום בעזר (אחרי ניכוי)"])
+        if abs(abs(int(rf.aamt_c[rows].sum())) - abs(evt_sum)) <= eps:
+            out.append((k, np.asarray(rows), abs(evt_sum)))
+    return out
+
+def carry_forward_open_items(rf: ReconFrame, mismatches: list, source: str, account: str,
+                             source_name: str = "", params=None):
+    """
+    התאמת השורות הפתוחות מול פריטים פתוחים מהרצות קודמות של אותו חשבון/ישות
+    (כללים 4, 3, 11 – באותו סדר כמו בקובץ; ±CARRY_FORWARD_DAYS ימים), ואז שמירת
+    הפתוחות של הקובץ הנוכחי במקום ההרצה הקודמת של אותו מקור. account – חובה;
+    source – _oi_source (תקופה / שם קובץ): הרצה חוזרת, גם של גרסה אחרת של הקובץ,
+    משחררת קודם את הפריטים שההרצה הקודמת סגרה.
+    מחזיר (זוגות לגיליון CARRY_SHEET, מיקומי אירועי כלל 3 שנסגרו).
+    """
+    account = _oi_account(account)
+    p = rule_params(params)
+    eps4, eps3 = cents(p["RULE4_EPS"]), cents(p["RULE3_AMOUNT_EPS"])
+    match, bamt, aamt = rf.match, rf.bamt_c, rf.aamt_c
+    pairs, closed, consumed = [], set(), []
+
+    def record(rows, rule, item):
+        for i in rows:
+            match[i] = rule
+        consumed.append(int(item["id"]))
+        pairs.append({"שורה": ", ".join(str(i + 2) for i in rows), "כלל": rule,
+                      "קובץ קודם": item["source_name"], "שורה בקובץ הקודם": item["rows"] or item["row"],
+                      "סכום קודם": item["amount"], "תאריך קודם": item["date"], "פרטים": item["details"]})
+
+    def run(conn, rule, cur_mask, cur_key, cur_c, kind, col, tol, item_filter=None):
+        rows = np.flatnonzero(cur_mask & (match == 0))
+        cur = pd.DataFrame({"i": rows, "c": cur_c[rows], "day": rf.date[rows]})
+        if cur_key is not None:
+            cur["key"] = cur_key[rows]
+        items = _oi_fetch(conn, account, source, kind, col, cur["key"] if cur_key is not None else cur["c"], tol)
+        if item_filter is not None and not items.empty:
+            items = items[item_filter(items)]
+        items = items.rename(columns={"ref": "key"}) if cur_key is not None else items
+        by_id = items.set_index("id")
+        for i, oid in _greedy_pairs(cur, items, "key" if cur_key is not None else None, tol):
+            record([i], rule, {"id": oid, **by_id.loc[oid].to_dict()})
+
+    def phrase_credit(items):
+        return items["details"].fillna("").str.contains(TRANSFER_PHRASE, regex=False) & (items["amount"] > 0)
+
+    def work(conn):
+        # הרצה חוזרת של אותו מקור – משחררים את מה שסגר בפעם הקודמת
+        conn.execute("UPDATE open_items SET consumed_by = NULL WHERE account = ? AND consumed_by = ?",
+                     (account, source))
+
+        # 4: שיקים – בנק 493 ↔ ספרי CH קודמים, ספרי CH ↔ בנק 493 קודם
+        cheque_bank = (rf.code_i == RULE4_CODE) & rf.ref1_ok & rf.has_bamt
+        cheque_books = (rf.ref1_pfx == "CH") & rf.ref2_ok & rf.has_aamt
+        run(conn, 4, cheque_bank, rf.ref1_d, np.abs(bamt), "cheque_books", "ref", eps4)
+        run(conn, 4, cheque_books, rf.ref2_d, np.abs(aamt), "cheque_bank", "ref", eps4)
+
+        # 3: בנק 485 (מקבץ-נט, זכות) ↔ אירוע קודם בלי צד בנק; אירוע נוכחי ↔ בנק 485 קודם
+        transfer_bank = (rf.code == TRANSFER_CODE) & rf.has_bamt & (bamt != 0)
+        phrase = pd.Series(rf.det).str.contains(TRANSFER_PHRASE, na=False, regex=False).to_numpy(dtype=bool)
+        run(conn, 3, transfer_bank & phrase & (bamt > 0), None, np.abs(bamt), "event", "cents", eps3)
+        events = _open_events(rf, mismatches, eps3)
+        if events:
+            items = _oi_fetch(conn, account, source, "transfer_bank", "cents", [e[2] for e in events], eps3)
+            items = items[phrase_credit(items)] if not items.empty else items
+            cur = pd.DataFrame({"i": range(len(events)), "c": [e[2] for e in events],
+                                "day": [rf.date[e[1].min()] for e in events]})
+            by_id = items.set_index("id")
+            for i, oid in _greedy_pairs(cur, items, None, eps3):
+                k, rows, _ = events[i]
+                record(rows, 3, {"id": oid, **by_id.loc[oid].to_dict()})
+                closed.add(k)
+
+        # 11: BT – בנק 485 ↔ ספרי BT קודמים, ספרי BT ↔ בנק 485 קודם
+        bt_books = (rf.ref1_s_pfx == "BT") & rf.has_aamt & (aamt != 0)
+        run(conn, 11, transfer_bank, None, np.abs(bamt), "bt_books", "cents", 0)
+        run(conn, 11, bt_books, None, np.abs(aamt), "transfer_bank", "cents", 0)
+
+        conn.executemany("UPDATE open_items SET consumed_by = ? WHERE id = ?", ((source, i) for i in consumed))
+        _oi_persist(conn, rf, mismatches, closed, source, account, source_name,
+                    cheque_bank, cheque_books, transfer_bank, bt_books, eps3)
+
+    conn = _oi_connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            work(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return pairs, closed
+
+def _oi_persist(conn, rf, mismatches, closed, source, account, source_name,
+                cheque_bank, cheque_books, transfer_bank, bt_books, eps3):
+    """
+    השורות הפתוחות של הקובץ (אחרי ההתאמה) מחליפות את אלה מההרצה הקודמת של אותו מקור
+    באותו חשבון. פריטים שלו שמקור אחר כבר סגר נשארים סגורים, ושורה חדשה זהה להם
+    (סוג, סכום, אסמכתא, תאריך) לא נכנסת שוב – אחרת אפשר היה לסגור אותה פעמיים.
+    """
+    conn.execute("DELETE FROM open_items WHERE account = ? AND source = ? AND consumed_by IS NULL",
+                 (account, source))
+    taken = Counter(conn.execute("SELECT kind, cents, ref, date FROM open_items "
+                                 "WHERE account = ? AND source = ? AND consumed_by IS NOT NULL",
+                                 (account, source)).fetchall())
+    open_ = rf.match == 0
+    bamt, aamt = rf.bamt_c, rf.aamt_c
+    has_b = rf.has_bamt
+    date = pd.Series(rf.date).dt.strftime("%Y-%m-%d").fillna("").to_numpy(dtype=object)
+
+    events = [e for e in _open_events(rf, mismatches, eps3) if e[0] not in closed]
+    in_event = np.zeros(len(rf), dtype=bool)
+    recs = []
+    for k, rows, evt_sum in events:
+        in_event[rows] = True
+        recs.append((account, source, source_name, int(rows.min()) + 2, "event", evt_sum, mismatches[k]["אירוע"],
+                     -evt_sum / 100, date[rows.min()], TRANSFER_PHRASE, json.dumps([int(r) + 2 for r in rows])))
+
+    kind = np.select([cheque_bank, cheque_books, transfer_bank, bt_books],
+                     ["cheque_bank", "cheque_books", "transfer_bank", "bt_books"], "other").astype(object)
+    ref = np.where(kind == "cheque_bank", rf.ref1_d, np.where(kind == "cheque_books", rf.ref2_d, ""))
+    amt = np.where(has_b, bamt, aamt)
+    for i in np.flatnonzero(open_ & ~in_event):
+        recs.append((account, source, source_name, int(i) + 2, kind[i], abs(int(amt[i])), str(ref[i]),
+                     amt[i] / 100, date[i], str(rf.det[i]), None))
+    keep = []
+    for r in recs:
+        ident = (r[4], r[5], r[6], r[8])
+        if taken[ident]:
+            taken[ident] -= 1
+        else:
+            keep.append(r)
+    conn.executemany(
+        "INSERT INTO open_items(account, source, source_name, row, kind, cents, ref, amount, date, "
+        "details, rows) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", keep)
+
+# ---------------- Styling & print / export ----------------
+VK_SHEET = "הוראת קבע ספקים"
+PERF_SHEET = "ביצועים"
+PARSE_ERRORS_SHEET = "שגיאות קליטה"
+CARRY_SHEET = "פריטים מתקופות קודמות"
+PAIRS_SHEET = "זוגות התאמה"
+PAIRS_FILE_EXT = ".parquet" if pa is not None else ".csv"
+ORANGE   = "#FFF2CC"
+
+def _sheet_setup(ws):
+    ws.right_to_left()
+    ws.set_paper(9)                  # A4
+    ws.set_landscape()
+    ws.fit_to_pages(1, 0)            # Fit-to-width=1
+    ws.set_margins(left=0.4, right=0.4, top=0.6, bottom=0.6)
+
+def _write_cell(ws, r, c, v, fmt, date_fmt):
+    if v is None:
+        if fmt is not None:
+            ws.write_blank(r, c, None, fmt)
+        return
+    if isinstance(v, (bool, np.bool_)):
+        ws.write_boolean(r, c, bool(v), fmt)
+    elif isinstance(v, (int, float, np.integer, np.floating)):
+        if np.isfinite(v):
+            ws.write_number(r, c, v, fmt)
+        elif fmt is not None:
+            ws.write_blank(r, c, None, fmt)
+    elif isinstance(v, datetime):
+        if pd.isna(v):
+            if fmt is not None:
+                ws.write_blank(r, c, None, fmt)
+        else:
+            ws.write_datetime(r, c, v.replace(tzinfo=None), date_fmt[fmt])
+    elif isinstance(v, date):
+        ws.write_datetime(r, c, datetime(v.year, v.month, v.day), date_fmt[fmt])
+    elif isinstance(v, str):
+        ws.write_string(r, c, v, fmt)
+    elif pd.isna(v):
+        if fmt is not None:
+            ws.write_blank(r, c, None, fmt)
+    else:
+        ws.write_string(r, c, str(v), fmt)
+
+def export_workbook(sheets, constant_memory=None, on_rows=None, out=None) -> bytes | None:
+    """
+    יצוא במעבר אחד ב-xlsxwriter: RTL, A4 לרוחב, Fit-to-width, שוליים,
+    שורות כתומות (בלי מס' ספק) ושורה אחרונה מודגשת בגיליון הוראת קבע.
+    sheets – רשימת (שם גיליון, DataFrame) – או כל אובייקט עם columns / len /
+    itertuples (למשל שורות שנקראות מהדיסק בחתיכות).
+    constant_memory – כתיבה זורמת לקובץ זמני; None = אוטומטי לפי גודל.
+    on_rows – on_rows(נכתבו, סה"כ) כל EXPORT_PROGRESS_ROWS שורות.
+    out – נתיב קובץ פלט; אז לא מחזיקים את הקובץ בזיכרון ומוחזר None.
+    """
+    import xlsxwriter
+
+    if constant_memory is None:
+        constant_memory = max((len(d) for _, d in sheets), default=0) > EXPORT_CONSTANT_MEMORY_ROWS
+
+    buffer = io.BytesIO() if out is None else out
+    opts = {"constant_memory": True} if constant_memory else {"in_memory": True}
+    wb = xlsxwriter.Workbook(buffer, opts)
+
+    header_fmt = wb.add_format({"bold": True, "border": 1, "align": "center", "valign": "top"})
+    orange_fmt = wb.add_format({"bg_color": ORANGE})
+    bold_fmt   = wb.add_format({"bold": True})
+    orange_bold_fmt = wb.add_format({"bg_color": ORANGE, "bold": True})
+    # פורמט תאריך לכל פורמט שורה
+    total_rows, written = sum(len(d) for _, d in sheets), 0
+    date_fmt = {
+        None: wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss"}),
+        orange_fmt: wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss", "bg_color": ORANGE}),
+        bold_fmt: wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss", "bold": True}),
+        orange_bold_fmt: wb.add_format({"num_format": "yyyy-mm-dd hh:mm:ss", "bg_color": ORANGE, "bold": True}),
+    }
+
+    for name, frame in sheets:
+        ws = wb.add_worksheet(name)
+        _sheet_setup(ws)
+
+        cols  = list(frame.columns)
+        width = len(cols)
+        is_vk = name == VK_SHEET
+        sup_i = cols.index("מס' ספק") if is_vk and "מס' ספק" in cols else None
+        last  = len(frame)
+
+        for c, h in enumerate(cols):
+            ws.write_string(0, c, str(h), header_fmt)
+
+        for r, row in enumerate(frame.itertuples(index=False, name=None), start=1):
+            fmt = None
+            if is_vk:
+                orange = False
+                if sup_i is not None:
+                    v = row[sup_i]
+                    orange = v is None or (isinstance(v, str) and v == "") or (not isinstance(v, str) and pd.isna(v))
+                if r == last:
+                    fmt = orange_bold_fmt if orange else bold_fmt
+                elif orange:
+                    fmt = orange_fmt
+            for c in range(width):
+                _write_cell(ws, r, c, row[c], fmt, date_fmt)
+            written += 1
+            if on_rows is not None and written % EXPORT_PROGRESS_ROWS == 0:
+                on_rows(written, total_rows)
+
+    wb.close()
+    return buffer.getvalue() if out is None else None
+
+# ---------------- Processing ----------------
+def rule_params(overrides=None) -> dict:
+    """
+    ערכי TUNABLE_PARAMS הנוכחיים, עם דריסות להרצה (dict). RULE5_MAX – התקרה
+    שבטבלת הכללים (rule5_cap; RULES_TABLE_FILE אם קיים), None אם אין בה תקרה.
+    """
+    p = {k: globals()[k] for k in TUNABLE_PARAMS}
+    p["RULE5_MAX"] = rule5_cap()
+    for k, v in (overrides or {}).items():
+        if k not in p:
+            raise ValueError(f"פרמטר לא מוכר: {k}")
+        p[k] = v
+    return p
+
+RULE_STEP_NAMES = ("כלל 1", "כלל 2", "כלל 4", "כלל 3", "כללים 5–10", "כלל 11", "כלל 12")
+
+class RunCancelled(Exception):
+    """ההרצה בוטלה (נזרק מתוך callback ההתקדמות)."""
+
+def _progress_ticker(progress, names):
+    """
+    tick(name, within=0) לפני/בתוך כל שלב → progress(name, חלק שהושלם);
+    שלבים שדולגו נספרים כהושלמו.
+    """
+    if progress is None:
+        return lambda name, within=0.0: None
+    weights = [PROGRESS_WEIGHTS.get(n, 1) for n in names]
+    total = sum(weights)
+    done = dict(zip(names, np.cumsum([0] + weights[:-1]) / total))
+    share = dict(zip(names, np.asarray(weights) / total))
+    return lambda name, within=0.0: progress(name, float(done.get(name, 0.0) + within * share.get(name, 0.0)))
+
+def _rule_steps(rf, a_df, p):
+    """
+    שלבי הכללים לפי סדר ההרצה: (שם, פרמטרים שמשפיעים על השלב, פעולה).
+    פעולה מחזירה רשימת פערים (כלל 3) או None.
+    """
+    rules = load_simple_rules(rule5_max=p["RULE5_MAX"])
+    subset = (p["SUBSET_MAX_GROUP"], p["SUBSET_DATE_WINDOW"])
+    subset_key = subset + (SUBSET_MAX_CANDIDATES, SUBSET_TIME_BUDGET) if subset[0] > 1 else ()
+    return [
+        ("כלל 1", sorted(OVRC_CODES) + ([p["RULE1_DATE_WINDOW"]] if p["RULE1_DATE_WINDOW"] else []),
+         lambda: _rule_1(rf, p["RULE1_DATE_WINDOW"])),
+        ("כלל 2", sorted(STANDING_CODES), lambda: _rule_2(rf)),
+        ("כלל 4", (RULE4_CODE, p["RULE4_EPS"]), lambda: _rule_4(rf, p["RULE4_EPS"])),
+        ("כלל 3", (TRANSFER_CODE, TRANSFER_PHRASE, p["RULE3_AMOUNT_EPS"]) + subset_key,
+         lambda: apply_rule_3(rf, a_df, p["RULE3_AMOUNT_EPS"], *subset) if a_df is not None else None),
+        ("כללים 5–10", rules, lambda: apply_simple_rules(rf, rules)),
+        ("כלל 11", subset_key, lambda: rule11_placeholder(rf, *subset)),
+        ("כלל 12", (), lambda: rule12_placeholder(rf)),
+    ]
+
+class RuleCheckpoints:
+    """
+    נקודות ביקורת להרצה חוזרת: לכל קלט (main+aux) – הקלט המפוענח, ולכל שלב
+    וקטור match (+ פערי כלל 3 ויומן הזוגות) לפי טביעת אצבע של פרמטרי כל השלבים עד אליו.
+    שינוי פרמטר → ממשיכים מהשלב הראשון שהושפע, בלי קריאה ובלי הכללים שלפניו.
+    """
+
+    def __init__(self, max_inputs=CHECKPOINT_INPUTS, max_points=CHECKPOINT_POINTS):
+        self.max_inputs, self.max_points = max_inputs, max_points
+        self._inputs = OrderedDict()    # key → {"rf", "a_df", "match0", "points": OrderedDict}
+        self._lock = threading.Lock()
+
+    def frame(self, key):
+        """(rf עם match מאופס, a_df) או None. ה-rf הוא עותק רדוד – match ויומן זוגות משלו."""
+        with self._lock:
+            e = self._inputs.get(key)
+            if e is None:
+                return None
+            self._inputs.move_to_end(key)
+            return replace(e["rf"], match=e["match0"].copy(), pairs=PairLedger()), e["a_df"]
+
+    def store_frame(self, key, rf, a_df):
+        with self._lock:
+            self._inputs[key] = {"rf": replace(rf, match=rf.match.copy(), pairs=PairLedger()), "a_df": a_df,
+                                 "match0": rf.match.copy(), "points": OrderedDict()}
+            while len(self._inputs) > self.max_inputs:
+                self._inputs.popitem(last=False)
+
+    def get(self, key, fp):
+        with self._lock:
+            e = self._inputs.get(key)
+            hit = e and e["points"].get(fp)
+            if hit:
+                e["points"].move_to_end(fp)
+            return hit
+
+    def put(self, key, fp, match, mismatches, pairs):
+        with self._lock:
+            e = self._inputs.get(key)
+            if e is None:
+                return
+            e["points"][fp] = (match.copy(), list(mismatches), pairs.snapshot())
+            while len(e["points"]) > self.max_points:
+                e["points"].popitem(last=False)
+
+CHECKPOINTS = RuleCheckpoints()
+
+def process_workbook(main_bytes: bytes, aux_bytes: bytes | None, report: RunReport | None = None,
+                     params: dict | None = None, checkpoints: RuleCheckpoints | None = None,
+                     progress=None, carry_forward: bool = False, source_name: str = "", account: str = "",
+                     snapshot: bool = False, output_format: str = "xlsx", pairs_out=None, period: str = ""):
+    """
+    הרצה מלאה: קריאה → כללים 1–12 → גיליון הוראת קבע → יצוא.
+    קלט: xlsx / CSV / Parquet (לפי התוכן); snapshot=True – xlsx דרך מטמון snapshots.
+    output_format="parquet" – פלט DataSheet (+ מס' התאמה) כ-Parquet, בלי Excel.
+    report – מדידת ביצועים לכל שלב; אם ניתן, נוסף גיליון 'ביצועים'.
+    params – דריסת TUNABLE_PARAMS להרצה זו.
+    checkpoints – RuleCheckpoints: ממשיכים מהשלב הראשון שהפרמטרים שלו (או של
+    שלב קודם) השתנו מאז ההרצה האחרונה על אותו קלט.
+    progress – progress(stage, fraction) לפני כל שלב; RunCancelled ממנו עוצר את ההרצה.
+    carry_forward – התאמה מול פריטים פתוחים מהרצות קודמות של אותו account
+    (OPEN_ITEMS_DB, חובה) ושמירת הפתוחים של קובץ זה. הפריטים נשמרים לפי period
+    (תקופה, למשל "2025-02") ואם אין – לפי source_name (שם הקובץ); הרצה חוזרת של אותו
+    מקור מחליפה את הקודמת.
+    pairs_out – נתיב/קובץ ליומן הזוגות כקובץ מכונה (PairLedger.write); בפלט xlsx
+    היומן נכתב גם לגיליון 'זוגות התאמה'.
+    """
+    p = rule_params(params)
+    tick = _progress_ticker(progress, ["קריאה", "מסגרת התאמה", "קריאת עזר", *RULE_STEP_NAMES,
+                                       "פריטים פתוחים", "גיליון הוראת קבע", "יצוא"])
+    try:
+        in_key = (_digest(main_bytes), _digest(aux_bytes)) if checkpoints is not None else None
+        cached = checkpoints.frame(in_key) if in_key else None
+        if cached is None:
+            # קריאה
+            tick("קריאה")
+            with _stage(report, "קריאה") as rec:
+                df = read_input_df(main_bytes, "DataSheet", snapshot)
+                rec["שורות שנבדקו"] = len(df)
+            if df.empty:
+                return None, None, None
+
+            tick("מסגרת התאמה")
+            with _stage(report, "מסגרת התאמה", rows=len(df)):
+                rf = build_recon_frame(df)
+
+            a_df = None
+            if aux_bytes is not None:
+                tick("קריאת עזר")
+                with _stage(report, "קריאת עזר") as rec:
+                    a_df = read_input_df(aux_bytes, snapshot=snapshot)
+                    rec["שורות שנבדקו"] = len(a_df)
+            if in_key:
+                checkpoints.store_frame(in_key, rf, a_df)
+        else:
+            rf, a_df = cached
+
+        # כללים 1–12 (3 – סכומים זהים בלבד, ללא דרישת תאריך; 5–12 רק על 0)
+        steps = _rule_steps(rf, a_df, p)
+        h, fps = hashlib.blake2b(digest_size=16), []
+        for name, prm, _ in steps:
+            h.update(repr((name, prm)).encode("utf-8"))
+            fps.append(h.hexdigest())
+
+        start, mismatches = 0, []
+        if in_key:
+            for k in range(len(steps) - 1, -1, -1):
+                hit = checkpoints.get(in_key, fps[k])
+                if hit:
+                    with _stage(report, f"נקודת ביקורת – אחרי {steps[k][0]}", rows=len(rf)):
+                        np.copyto(rf.match, hit[0])
+                        mismatches = list(hit[1])
+                        rf.pairs.restore(hit[2])
+                    start = k + 1
+                    break
+
+        for k in range(start, len(steps)):
+            name, _, run = steps[k]
+            tick(name)
+            with _stage(report, name, rf):
+                out = run()
+            if out is not None:
+                mismatches = out
+            if in_key:
+                checkpoints.put(in_key, fps[k], rf.match, mismatches, rf.pairs)
+
+        # פריטים פתוחים מתקופות קודמות (אחרי כל הכללים בתוך הקובץ)
+        carried, closed = [], set()
+        if carry_forward:
+            tick("פריטים פתוחים")
+            with _stage(report, "פריטים פתוחים", rf):
+                carried, closed = carry_forward_open_items(rf, mismatches, _oi_source(period, source_name),
+                                                           account, source_name, p)
+        mismatches = [{k: v for k, v in m.items() if not k.startswith("_")}
+                      for n, m in enumerate(mismatches) if n not in closed]
+
+        df = rf.df.copy(deep=False)
+        df[rf.col_match] = rf.match
+
+        # גיליון הוראת קבע ספקים
+        tick("גיליון הוראת קבע")
+        with _stage(report, "גיליון הוראת קבע") as rec:
+            vk_df = build_vlookup_sheet(rf)
+            rec["שורות שנבדקו"] = len(vk_df)
+        if pairs_out is not None:
+            rf.pairs.write(pairs_out)
+
+        if output_format == "parquet":
+            tick("יצוא")
+            with _stage(report, "יצוא", rows=len(df)):
+                out_bytes = to_parquet_bytes(df)
+            return df, vk_df, out_bytes
+
+        # יצוא עם עיצוב + גיליון בקרה לכלל 3 (אם יש) – מעבר אחד
+        counts = pd.Series(rf.match).value_counts().sort_index()
+        sheets = [("DataSheet", df),
+                  ("סיכום", pd.DataFrame({"מס": counts.index, "כמות": counts.values})),
+                  (VK_SHEET, vk_df)]
+        if mismatches:
+            sheets.append(("פערי סכומים – כלל 3", pd.DataFrame(mismatches)))
+        if len(rf.pairs):
+            sheets.append((PAIRS_SHEET, rf.pairs.to_frame()))
+        if len(rf.parse_errors):
+            sheets.append((PARSE_ERRORS_SHEET, rf.parse_errors))
+        if carried:
+            sheets.append((CARRY_SHEET, pd.DataFrame(carried)))
+        if report is not None:
+            # גיליון הביצועים נכתב לפני שלב היצוא עצמו – היצוא מופיע רק בדוח
+            sheets.append((PERF_SHEET, report.to_frame()))
+
+        tick("יצוא")
+        with _stage(report, "יצוא", rows=len(df)):
+            out_bytes = export_workbook(sheets, on_rows=lambda n, total: tick("יצוא", n / total))
+        return df, vk_df, out_bytes
+    finally:
+        if report is not None:
+            report.finish()
+
+# ---------------- Out-of-core (partitioned) ----------------
+# כל כלל מקומי למפתח, חוץ מהסדר בין הכללים:
+#   amount – |סכום| באגורות (כללים 1, 11) + כללים שורתיים (2, 5–10, 12)
+#   ref    – אסמכתא מנורמלת (כלל 4)
+#   rule3  – מועמדי כלל 3 (בנק 485 + ספרים שהאסמכתא שלהם מס' תשלום בעזר) – מחיצה אחת
+#   rule11 – מועמדי כלל 11 (בנק 485 + ספרים BT) לרבים-לאחד – מחיצה אחת
+# סכום 0 אינו מפתח (אף כלל זוגי לא מתאים 0) – שורה כזו בדלי לפי הצד השני או לפי שורה.
+# המעברים הגלובליים (rule3, rule11) טוענים רק שורות שעדיין פתוחות; מחיצה שחורגת
+# מהתקציב (קבוצת מפתחות מקושרת גדולה או מעבר גלובלי) – RuntimeWarning ועמודה בדוח.
+# הקלט נקרא בחתיכות; לכל חתיכה נשמרים לדיסק השורות המלאות (ליצוא) ועמודות
+# המפתחות של כל משפחה, ממוינות לפי דלי hash. וקטור match הגלובלי ממופה לזיכרון.
+# הכללים רצים במעברים לפי סדר העדיפות, מחיצה אחרי מחיצה (אופציונלית במקביל);
+# שורה שמקשרת שני דליים (צד בנק וצד ספרים במפתחות שונים) מאחדת אותם למחיצה אחת.
+_KEY_FIELDS = ("code", "bamt_c", "aamt_c", "has_bamt", "has_aamt", "date", "ref1_s", "ref1_pfx",
+               "ref1_s_pfx", "ref1_ok", "ref2_ok", "ref1_d", "ref2_d", "det")
+
+def iter_input_chunks(path, sheet_name=None, chunk_rows=None):
+    """חתיכות DataFrame מקובץ קלט (xlsx / CSV / Parquet) בלי לטעון את כולו."""
+    chunk_rows = chunk_rows or INGEST_CHUNK_ROWS
+    with open(path, "rb") as f:
+        head = f.read(1 << 20)
+    fmt = input_format(head)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif fmt == "csv":
+        try:
+            head.decode("utf-8-sig")
+            enc = "utf-8-sig"
+        except UnicodeDecodeError as e:
+            enc = "utf-8-sig" if e.start > len(head) - 4 else "cp1255"   # תו שנחתך בסוף הדגימה
+        yield from pd.read_csv(path, encoding=enc, dtype=dict.fromkeys(REF1S + REF2S + DETAILS, str),
+                               chunksize=chunk_rows)
+    elif fmt == "xlsx":
+        wb = load_workbook(path, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet_name] if sheet_name in wb.sheetnames else wb.worksheets[0]
+            if ws.max_row in (None, 1) and ws.max_column in (None, 1):
+                ws.reset_dimensions()
+            it = ws.iter_rows(values_only=True)
+            header = next(it, None)
+            while header is not None:
+                block = list(islice(it, chunk_rows))
+                if not block:
+                    break
+                yield rows_to_df(chain([header], block), chunk_rows)
+        finally:
+            wb.close()
+    else:
+        raise ValueError("מצב מחולק תומך בקלט xlsx / CSV / Parquet.")
+
+def _spill_keys(path, rf, rows, bucket, base, nb):
+    """עמודות המפתחות של rows (ממוינות לפי דלי) → Arrow IPC; מחזיר היסטים לכל דלי."""
+    order = np.argsort(bucket, kind="stable")
+    rows, bucket = rows[order], bucket[order]
+    cols = {"row": pa.array(rows + base)}
+    cols.update({k: pa.array(getattr(rf, k)[rows], from_pandas=True) for k in _KEY_FIELDS})
+    table = pa.table(cols)
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as w:
+        w.write_table(table)
+    return np.searchsorted(bucket, np.arange(nb + 1))
+
+def _load_keys(files, buckets, cols, match, open_only=False):
+    """
+    שורות הדליים buckets מכל החתיכות → ReconFrame קטן (ממוין לפי שורה גלובלית,
+    match מהוקטור הגלובלי). open_only – רק שורות שה-match שלהן 0. מחזיר (rows, rf).
+    """
+    parts = {k: [] for k in ("row",) + _KEY_FIELDS}
+    for path, off in files:
+        with pa.memory_map(path) as src:
+            table = pa.ipc.open_file(src).read_all()
+            for b in buckets:
+                if off[b + 1] > off[b]:
+                    t = table.slice(off[b], off[b + 1] - off[b])
+                    if open_only:
+                        t = t.filter(pa.array(np.asarray(match[t.column("row").to_numpy()]) == 0))
+                    for k in parts:
+                        parts[k].append(t.column(k).to_numpy(zero_copy_only=False))
+    if not sum(map(len, parts["row"])):
+        return None, None
+    a = {k: np.concatenate(v) for k, v in parts.items()}
+    order = np.argsort(a["row"], kind="stable")
+    a = {k: v[order] for k, v in a.items()}
+    rows = a.pop("row")
+    rf = ReconFrame(df=None, cols=cols, match=np.asarray(match[rows]), code_i=np.trunc(a["code"]), **a)
+    return rows, rf
+
+def _bucket_of(keys, nb):
+    return (pd.util.hash_array(np.asarray(keys)) % np.uint64(nb)).astype(np.int64)
+
+def _plan_partitions(counts, edges, max_rows):
+    """
+    דליים שמקושרים (edges) מאוחדים (union-find); הקבוצות נארזות למחיצות
+    של עד max_rows שורות (קבוצה גדולה מזה – מחיצה לבדה, והריצה מזהירה עליה בטעינה).
+    מחזיר רשימת רשימות דליים.
+    """
+    parent = list(range(len(counts)))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    for a, b in edges:
+        parent[find(a)] = find(b)
+    groups = OrderedDict()
+    for b in range(len(counts)):
+        if counts[b]:
+            groups.setdefault(find(b), []).append(b)
+
+    parts, cur, size = [], [], 0
+    for g in groups.values():
+        n = int(sum(counts[b] for b in g))
+        if cur and size + n > max_rows:
+            parts.append(cur)
+            cur, size = [], 0
+        cur += g
+        size += n
+    if cur:
+        parts.append(cur)
+    return parts
+
+class _SpilledRows:
+    """DataSheet מהדיסק ליצוא זורם: columns / len / itertuples, עם match מהוקטור הגלובלי."""
+
+    def __init__(self, paths, columns, match, match_pos):
+        self.paths, self.columns, self.match, self.match_pos = paths, columns, match, match_pos
+
+    def __len__(self):
+        return len(self.match)
+
+    def chunks(self):
+        base = 0
+        for path in self.paths:
+            df = _read_arrow_frame(path)
+            df.isetitem(self.match_pos, np.asarray(self.match[base:base + len(df)]))
+            base += len(df)
+            yield df
+
+    def itertuples(self, index=False, name=None):
+        for df in self.chunks():
+            yield from df.itertuples(index=index, name=name)
+
+def process_workbook_partitioned(main_path, aux_bytes: bytes | None, out_path, report: RunReport | None = None,
+                                 params: dict | None = None, progress=None, memory_budget=None, workers=1,
+                                 pairs_out=None):
+    """
+    כמו process_workbook, לקבצים שלא נכנסים לזיכרון: הקלט (נתיב xlsx/CSV/Parquet) נקרא
+    בחתיכות ונשפך לדיסק לפי מפתחות הכללים, הכללים רצים מחיצה אחרי מחיצה (workers
+    במקביל) באותו סדר עדיפות, וה-DataSheet נכתב בזרימה ל-out_path (xlsx).
+    memory_budget – בתים (ברירת מחדל PARTITION_MEMORY_BYTES); קובע את גודל החתיכות
+    והמחיצות. יומני הזוגות של המחיצות מאוחדים (שורות גלובליות) לגיליון 'זוגות התאמה'
+    ול-pairs_out. מחזיר counts {מס' התאמה: כמות} או None אם אין נתונים.
+    בלי פריטים פתוחים ונקודות ביקורת; דורש pyarrow.
+    """
+    if pa is None:
+        raise RuntimeError("מצב מחולק דורש pyarrow.")
+    p = rule_params(params)
+    budget = PARTITION_MEMORY_BYTES if memory_budget is None else memory_budget
+    workers = max(1, workers)
+    chunk_rows = max(1_000, budget // (4 * PARTITION_ROW_BYTES))
+    part_rows = max(1_000, budget // (2 * workers * PARTITION_KEY_ROW_BYTES))
+    nb = PARTITION_BUCKETS
+    passes = ("כללים 1–2", "כלל 4", "כלל 3", "כללים 5–12")
+    tick = _progress_ticker(progress, ["קריאה", *passes, "גיליון הוראת קבע", "יצוא"])
+
+    try:
+        with tempfile.TemporaryDirectory(prefix="recon-spill-", dir=PARTITION_SPILL_DIR) as spill:
+            a_df = read_input_df(aux_bytes) if aux_bytes is not None else None
+            pays = set()
+            if a_df is not None:
+                c_dt, c_amt, c_pay = (pick_col(a_df, AUX_DATE_KEYS), pick_col(a_df, AUX_AMT_KEYS),
+                                      pick_col(a_df, AUX_PAYNO_KEYS))
+                if c_dt and c_amt and c_pay:
+                    pay = a_df[c_pay].astype(str).str.strip()
+                    pays = set(pay[pd.to_datetime(a_df[c_dt], errors="coerce").notna() & pay.notna()])
+
+            # קריאה ושפיכה לדיסק
+            tick("קריאה")
+            row_files, errors, cols, columns = [], [], None, None
+            files = {"amount": [], "ref": [], "rule3": [], "rule11": []}
+            counts = {"amount": np.zeros(nb, np.int64), "ref": np.zeros(nb, np.int64)}
+            edges = {"amount": set(), "ref": set()}
+            match_path = os.path.join(spill, "match.i64")
+            n = 0
+            with _stage(report, "קריאה") as rec, open(match_path, "wb") as match_out:
+                for k, df in enumerate(iter_input_chunks(main_path, "DataSheet", chunk_rows)):
+                    rf = build_recon_frame(df)
+                    if cols is None:
+                        cols, columns = rf.cols, list(df.columns)
+                    if len(rf.parse_errors):
+                        errors.append(rf.parse_errors.assign(שורה=rf.parse_errors["שורה"] + n))
+                    match_out.write(rf.match.astype(np.int64).tobytes())
+                    row_files.append(os.path.join(spill, f"rows-{k}.arrow"))
+                    _write_arrow_frame(df, row_files[-1])
+
+                    rows = np.arange(len(rf))
+                    # amount: צד בנק לפי |סכום בדף|, צד ספרים לפי |סכום בספרים| (סכום 0 – אין
+                    # צד), אחרת לפי שורה; קובץ שממלא צד ריק ב-0 לא מרכז הכול בדלי של 0
+                    nz_b = rf.has_bamt & (rf.bamt_c != 0)
+                    nz_a = rf.has_aamt & (rf.aamt_c != 0)
+                    bb, ab = _bucket_of(np.abs(rf.bamt_c), nb), _bucket_of(np.abs(rf.aamt_c), nb)
+                    bucket = np.where(nz_b, bb, np.where(nz_a, ab, (rows + n) % nb))
+                    both = nz_b & nz_a & (bb != ab)
+                    edges["amount"].update(zip(bb[both].tolist(), ab[both].tolist()))
+                    counts["amount"] += np.bincount(bucket, minlength=nb)
+                    path = os.path.join(spill, f"amount-{k}.arrow")
+                    files["amount"].append((path, _spill_keys(path, rf, rows, bucket, n, nb)))
+
+                    # ref (כלל 4): בנק 493 לפי אסמכתא 1, ספרים CH לפי אסמכתא 2
+                    bank4 = (rf.code_i == RULE4_CODE) & rf.ref1_ok & rf.has_bamt
+                    books4 = (rf.ref1_pfx == "CH") & rf.ref2_ok & rf.has_aamt
+                    sel = np.flatnonzero(bank4 | books4)
+                    if len(sel):
+                        b1, b2 = _bucket_of(rf.ref1_d[sel], nb), _bucket_of(rf.ref2_d[sel], nb)
+                        both = bank4[sel] & books4[sel] & (b1 != b2)
+                        edges["ref"].update(zip(b1[both].tolist(), b2[both].tolist()))
+                        bucket = np.where(bank4[sel], b1, b2)
+                        counts["ref"] += np.bincount(bucket, minlength=nb)
+                        path = os.path.join(spill, f"ref-{k}.arrow")
+                        files["ref"].append((path, _spill_keys(path, rf, sel, bucket, n, nb)))
+
+                    # כלל 3: בנק 485 בזכות עם ביטוי ההעברה + ספרים לפי מס' תשלום
+                    if pays:
+                        bank3 = ((rf.code == TRANSFER_CODE) & rf.has_bamt & (rf.bamt_c > 0)
+                                 & pd.Series(rf.det).str.contains(TRANSFER_PHRASE, na=False).to_numpy(dtype=bool))
+                        sel = np.flatnonzero(bank3 | pd.Series(rf.ref1_s).isin(pays).to_numpy())
+                        if len(sel):
+                            path = os.path.join(spill, f"rule3-{k}.arrow")
+                            files["rule3"].append((path, _spill_keys(path, rf, sel, np.zeros(len(sel), np.int64), n, 1)))
+
+                    # כלל 11 רבים-לאחד: בנק 485 + ספרים BT (אותם תנאים כמו rule11_placeholder)
+                    if p["SUBSET_MAX_GROUP"] > 1:
+                        sel = np.flatnonzero(((rf.code_i == 485) & nz_b) | ((rf.ref1_s_pfx == "BT") & nz_a))
+                        if len(sel):
+                            path = os.path.join(spill, f"rule11-{k}.arrow")
+                            files["rule11"].append((path, _spill_keys(path, rf, sel, np.zeros(len(sel), np.int64), n, 1)))
+                    n += len(rf)
+                    del df, rf
+                rec["שורות שנבדקו"] = n
+            if not n:
+                return None
+            match = np.memmap(match_path, dtype=np.int64, mode="r+", shape=(n,))
+            pairs = PairLedger()
+
+            def one(family, buckets, run, open_only):
+                rows, rf = _load_keys(files[family], buckets, cols, match, open_only)
+                if rows is None:
+                    return 0, 0, None, None
+                before = rf.match.copy()
+                out = run(rf)
+                match[rows] = rf.match                  # מחיצות זרות – אין התנגשות בין עובדים
+                return int(np.count_nonzero(rf.match != before)), len(rows), out, (rf.pairs, rows)
+
+            def run_pass(name, family, buckets_list, run, open_only=False):
+                """מעבר אחד על כל המחיצות של family; מחזיר את תוצאות run לפי סדר המחיצות."""
+                tick(name)
+                outs = []
+                with _stage(report, name, rows=n) as rec, ThreadPoolExecutor(max_workers=workers) as ex:
+                    changed = largest = 0
+                    for done, (c, size, out, led) in enumerate(
+                            ex.map(lambda b: one(family, b, run, open_only), buckets_list), start=1):
+                        tick(name, done / len(buckets_list))
+                        changed += c
+                        largest = max(largest, size)
+                        outs.append(out)
+                        if led is not None:
+                            pairs.extend(*led)
+                    rec["הותאמו"] = changed
+                    if largest > part_rows:
+                        rec["מחיצה חורגת (שורות)"] = largest
+                        warnings.warn(f"{name}: מחיצה של {largest:,} שורות חורגת מתקציב הזיכרון "
+                                      f"({part_rows:,} שורות) – קבוצת מפתחות מקושרת אחת או מעבר גלובלי.",
+                                      RuntimeWarning, stacklevel=2)
+                return outs
+
+            amount_parts = _plan_partitions(counts["amount"], edges["amount"], part_rows)
+            ref_parts = _plan_partitions(counts["ref"], edges["ref"], part_rows)
+            subset = (p["SUBSET_MAX_GROUP"], p["SUBSET_DATE_WINDOW"])
+
+            def rules_1_2(rf):
+                _rule_1(rf, p["RULE1_DATE_WINDOW"])
+                _rule_2(rf)
+
+            rules = load_simple_rules(rule5_max=p["RULE5_MAX"])
+
+            def rules_5_12(rf):
+                apply_simple_rules(rf, rules)
+                rule11_placeholder(rf)                  # 1:1 – מקומי לסכום
+                rule12_placeholder(rf)
+
+            run_pass("כללים 1–2", "amount", amount_parts, rules_1_2)
+            run_pass("כלל 4", "ref", ref_parts, lambda rf: _rule_4(rf, p["RULE4_EPS"]))
+            mismatches = []
+            if files["rule3"]:
+                out = run_pass("כלל 3", "rule3", [[0]],
+                               lambda rf: apply_rule_3(rf, a_df, p["RULE3_AMOUNT_EPS"], *subset), open_only=True)
+                mismatches = [{k: v for k, v in m.items() if not k.startswith("_")} for m in (out[0] or [])]
+            run_pass("כללים 5–12", "amount", amount_parts, rules_5_12)
+            if files["rule11"]:
+                # רבים-לאחד בכלל 11 אינו מקומי לסכום – מחיצה אחת של מועמדי כלל 11 הפתוחים
+                def rule11_subset(rf):
+                    rule11_placeholder(rf, *subset)
+                run_pass("כלל 11 – רבים-לאחד", "rule11", [[0]], rule11_subset, open_only=True)
+
+            # גיליון הוראת קבע – רק שורות כלל 2, מקובצי השורות
+            tick("גיליון הוראת קבע")
+            with _stage(report, "גיליון הוראת קבע") as rec:
+                spilled = _SpilledRows(row_files, columns, match, columns.index(cols["match"]))
+                vk_rows = [df[df.iloc[:, spilled.match_pos].to_numpy() == 2] for df in spilled.chunks()]
+                vk_src = pd.concat(vk_rows, ignore_index=True) if vk_rows else pd.DataFrame(columns=columns)
+                vk_rf = build_recon_frame(vk_src)
+                vk_rf.match[:] = 2
+                vk_df = build_vlookup_sheet(vk_rf)
+                rec["שורות שנבדקו"] = len(vk_df)
+
+            totals = Counter()
+            for s in range(0, n, chunk_rows):
+                vals, cnt = np.unique(np.asarray(match[s:s + chunk_rows]), return_counts=True)
+                totals.update(dict(zip(vals.tolist(), cnt.tolist())))
+            counts_s = pd.Series(totals).sort_index()
+            sheets = [("DataSheet", spilled),
+                      ("סיכום", pd.DataFrame({"מס": counts_s.index, "כמות": counts_s.values})),
+                      (VK_SHEET, vk_df)]
+            if mismatches:
+                sheets.append(("פערי סכומים – כלל 3", pd.DataFrame(mismatches)))
+            if len(pairs):
+                sheets.append((PAIRS_SHEET, pairs.to_frame()))
+            if pairs_out is not None:
+                pairs.write(pairs_out)
+            if errors:
+                sheets.append((PARSE_ERRORS_SHEET, pd.concat(errors, ignore_index=True)))
+            if report is not None:
+                sheets.append((PERF_SHEET, report.to_frame()))
+
+            tick("יצוא")
+            with _stage(report, "יצוא", rows=n):
+                export_workbook(sheets, constant_memory=True, out=out_path,
+                                on_rows=lambda k, total: tick("יצוא", k / total))
+            del spilled, match
+            return {int(k): int(v) for k, v in totals.items()}
+    finally:
+        if report is not None:
+            report.finish()
+
+# ---------------- Result cache ----------------
+def rules_fingerprint(params=None) -> str:
+    """טביעת אצבע של כל קבועי הכללים (כולל דריסות params) ומפות העמודות."""
+    p = rule_params(params)
+    params = (STANDING_CODES, OVRC_CODES, TRANSFER_CODE, TRANSFER_PHRASE, RULE4_CODE, p["RULE4_EPS"],
+              p["RULE3_AMOUNT_EPS"], load_simple_rules(rule5_max=p["RULE5_MAX"]),
+              MATCH_COLS, BANK_CODES, BANK_AMTS, BOOKS_AMTS, REF1S, REF2S, DATES, DETAILS,
+              AUX_DATE_KEYS, AUX_AMT_KEYS, AUX_PAYNO_KEYS)
+    if p["RULE1_DATE_WINDOW"]:
+        params += (("RULE1_DATE_WINDOW", p["RULE1_DATE_WINDOW"]),)
+    if p["SUBSET_MAX_GROUP"] > 1:
+        params += (p["SUBSET_MAX_GROUP"], p["SUBSET_DATE_WINDOW"], SUBSET_MAX_CANDIDATES, SUBSET_TIME_BUDGET)
+    canon = repr([sorted(p) if isinstance(p, set) else p for p in params])
+    return hashlib.blake2b(canon.encode("utf-8"), digest_size=16).hexdigest()
+
+def _digest(b) -> str:
+    return hashlib.blake2b(b or b"", digest_size=16).hexdigest()
+
+class ResultCache:
+    """
+    מטמון LRU דו-שכבתי: זיכרון (OrderedDict) ודיסק (<key>.<ext> + <key>.json – counts
+    וסיומת הפלט, xlsx / parquet), כל שכבה חסומה בגודל בבתים. ערך = (counts, out_bytes).
+    לצדו – ה-DataSheet המעובד (frame): LRU בזיכרון חסום ב-frame_bytes (memory_usage deep),
+    ו-<key>.arrow בדיסק (עם pyarrow), לחקירת השורות בלי לפענח שוב את ה-xlsx.
+    """
+
+    def __init__(self, path, mem_bytes, disk_bytes, frame_bytes=RESULT_CACHE_FRAME_BYTES):
+        self.path, self.mem_bytes, self.disk_bytes, self.frame_bytes = path, mem_bytes, disk_bytes, frame_bytes
+        self._mem = OrderedDict()
+        self._mem_size = 0
+        self._frames = OrderedDict()               # key → (frame, bytes)
+        self._frames_size = 0
+        self._lock = threading.Lock()
+
+    def _files(self, key, ext="xlsx"):
+        return (os.path.join(self.path, f"{key}.{ext}"), os.path.join(self.path, key + ".json"),
+                os.path.join(self.path, key + ".arrow"))
+
+    def get(self, key):
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                return hit
+        try:
+            with open(self._files(key)[1], "r", encoding="utf-8") as f:
+                info = json.load(f)
+            counts = {int(k): v for k, v in info["counts"].items()}
+            out = self._files(key, info["ext"])[0]
+            with open(out, "rb") as f:
+                data = f.read()
+            os.utime(out)                          # LRU בדיסק לפי mtime
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        self._put_mem(key, (counts, data))
+        return counts, data
+
+    def put(self, key, counts, data, frame=None, ext="xlsx"):
+        """ext – סיומת הפלט בדיסק (output_format); ה-json נכתב אחרון ומצביע עליו."""
+        self._put_mem(key, (counts, data))
+        if frame is not None:
+            self.put_frame(key, frame, disk=False)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            out, meta, arrow = self._files(key, ext)
+            if frame is not None and pa is not None:
+                _write_arrow_frame(frame, arrow)
+            tmp = f"{out}.{uuid.uuid4().hex}.tmp"     # ייחודי – כמה תהליכים על אותו key
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, out)
+            with open(meta, "w", encoding="utf-8") as f:
+                json.dump({"ext": ext, "counts": counts}, f)
+            self._evict_disk()
+        except OSError:
+            pass                                   # דיסק לא זמין – נשארים עם הזיכרון
+
+    def put_frame(self, key, frame, disk=True):
+        """frame בזיכרון (LRU חסום ב-frame_bytes); disk=True – גם <key>.arrow."""
+        size = int(frame.memory_usage(deep=True).sum())
+        with self._lock:
+            if key in self._frames:
+                self._frames_size -= self._frames.pop(key)[1]
+            if size <= self.frame_bytes:
+                self._frames[key] = (frame, size)
+                self._frames_size += size
+                while self._frames_size > self.frame_bytes:
+                    self._frames_size -= self._frames.popitem(last=False)[1][1]
+        if disk and pa is not None:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                _write_arrow_frame(frame, self._files(key)[2])
+            except OSError:
+                pass
+
+    def frame(self, key):
+        """ה-DataSheet המעובד של key – מהזיכרון או מ-<key>.arrow; אחרת None."""
+        with self._lock:
+            hit = self._frames.get(key)
+            if hit is not None:
+                self._frames.move_to_end(key)
+                return hit[0]
+        if pa is None:
+            return None
+        try:
+            frame = _read_arrow_frame(self._files(key)[2])
+        except (OSError, pa.ArrowInvalid, KeyError, ValueError):
+            return None
+        self.put_frame(key, frame, disk=False)
+        return frame
+
+    def _put_mem(self, key, value):
+        size = len(value[1])
+        with self._lock:
+            if key in self._mem:
+                self._mem_size -= len(self._mem.pop(key)[1])
+            if size > self.mem_bytes:
+                return
+            self._mem[key] = value
+            self._mem_size += size
+            while self._mem_size > self.mem_bytes:
+                _, (_, old) = self._mem.popitem(last=False)
+                self._mem_size -= len(old)
+
+    def _evict_disk(self):
+        # רשומה = כל הקבצים <key>.* (פלט, json, arrow); LRU לפי ה-mtime האחרון שלהם
+        entries = {}
+        for e in os.scandir(self.path):
+            if e.is_file():
+                info = e.stat()
+                rec = entries.setdefault(e.name.split(".", 1)[0], [0.0, 0, []])
+                rec[0] = max(rec[0], info.st_mtime)
+                rec[1] += info.st_size
+                rec[2].append(e.path)
+        total = sum(e[1] for e in entries.values())
+        for _, size, paths in sorted(entries.values(), key=lambda e: e[0]):
+            if total <= self.disk_bytes:
+                break
+            for f in paths:
+                try:
+                    os.remove(f)
+                except OSError:
+                    pass
+            total -= size
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MEM_BYTES, RESULT_CACHE_DISK_BYTES)
+
+def _match_counts(df) -> dict:
+    cnt = pd.to_numeric(df[pick_col(df, MATCH_COLS) or df.columns[0]],
+                        errors="coerce").fillna(0).astype(int).value_counts().sort_index()
+    return {int(k): int(v) for k, v in cnt.items()}
+
+def process_workbook_cached(main_bytes: bytes, aux_bytes: bytes | None, report: RunReport | None = None,
+                            params: dict | None = None, progress=None, carry_forward: bool = False,
+                            source_name: str = "", account: str = "", output_format: str = "xlsx", pairs_out=None,
+                            with_key: bool = False, period: str = ""):
+    """
+    process_workbook עם מטמון לפי תוכן: אותם קבצים, אותם פרמטרים, אותה גרסת מאגר
+    ספקים ואותה RESULT_CACHE_VERSION → התוצאה מהמטמון; אחרת הרצה מנקודות הביקורת (CHECKPOINTS).
+    מחזיר (counts {מס' התאמה: כמות}, out_bytes) או (None, None) אם אין נתונים.
+    עם report – הרצה מלאה ומדודה, בלי מטמון ובלי נקודות ביקורת.
+    carry_forward / account / period – ראו process_workbook; מצב הפריטים הפתוחים של החשבון נכלל במפתח המטמון.
+    output_format – xlsx / parquet. קלט xlsx נקרא דרך מטמון ה-snapshots (גם בהרצה מדודה).
+    pairs_out – קובץ יומן הזוגות (ראו process_workbook); המטמון שומר רק את הפלט,
+    לכן עם pairs_out מריצים (מנקודות הביקורת) בלי מטמון התוצאות.
+    with_key=True – מחזיר (counts, out_bytes, key): key מזהה את ה-DataSheet המעובד
+    ב-RESULT_CACHE.frame / get_explorer (הרצה בלי מטמון – בזיכרון בלבד).
+    """
+    opts = dict(progress=progress, carry_forward=carry_forward, source_name=source_name, account=account,
+                period=period, snapshot=True, output_format=output_format)
+    if report is not None or pairs_out is not None:
+        df, _, out_bytes = process_workbook(main_bytes, aux_bytes, report, params, pairs_out=pairs_out,
+                                            checkpoints=CHECKPOINTS if report is None else None, **opts)
+        if df is None:
+            return (None, None, None) if with_key else (None, None)
+        if not with_key:
+            return _match_counts(df), out_bytes
+        key = uuid.uuid4().hex
+        RESULT_CACHE.put_frame(key, df, disk=False)
+        return _match_counts(df), out_bytes, key
+
+    main_key = _digest(main_bytes)
+    parts = [str(RESULT_CACHE_VERSION), main_key, _digest(aux_bytes), rules_fingerprint(params), str(vk_version())]
+    if carry_forward:
+        account, source = _oi_account(account), _oi_source(period, source_name)
+        parts += ["carry", account, source, open_items_fingerprint(source, account), source_name]
+    if output_format != "xlsx":
+        parts.append(output_format)
+    key = _digest("|".join(parts).encode())
+    hit = RESULT_CACHE.get(key)
+    if hit is not None:
+        return (*hit, key) if with_key else hit
+
+    df, _, out_bytes = process_workbook(main_bytes, aux_bytes, params=params, checkpoints=CHECKPOINTS, **opts)
+    if df is None:
+        return (None, None, None) if with_key else (None, None)
+    counts = _match_counts(df)
+    RESULT_CACHE.put(key, counts, out_bytes, frame=df, ext=output_format)
+    return (counts, out_bytes, key) if with_key else (counts, out_bytes)
+
+# ---------------- Result explorer ----------------
+class ResultExplorer:
+    """
+    חקירת שורות התוצאה בצד השרת – רק העמוד המבוקש יוצא מכאן (iloc).
+    האינדקסים נבנים פעם אחת לכל תוצאה:
+    • מס' התאמה וקוד פעולה – factorize → טבלת חיפוש לערכים הייחודיים.
+    • סכום – |סכום בדף| (אחרת |סכום בספרים|) + סדר ממוין → טווח ב-searchsorted.
+    • טקסט (פרטים, אסמכתאות) – ערכים ייחודיים באותיות קטנות; החיפוש רץ על הייחודיים בלבד.
+    • מיון – סדר מלא לכל עמודה (ערכים חסרים בסוף).
+    כל אינטראקציה = מסכות וקטוריות + gather, בלי מיון ובלי מעבר על מחרוזות כל השורות.
+    עמודות לפי מיקום (כותרות Excel יכולות לחזור או להיות ריקות): sort הוא מס' עמודה,
+    labels – כותרות ייחודיות לתצוגה (unique_columns).
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.labels = unique_columns(df.columns)
+        n = len(df)
+        names = list(df.columns)
+
+        def pos(c):
+            return None if c is None else names.index(c)
+
+        cols = {k: pos(pick_col(df, keys)) for k, keys in (("match", MATCH_COLS), ("code", BANK_CODES),
+                                                          ("bamt", BANK_AMTS), ("aamt", BOOKS_AMTS))}
+
+        def num(c):
+            return parse_amounts(df.iloc[:, c])[0] if c is not None else np.full(n, np.nan)
+
+        match = df.iloc[:, cols["match"]] if cols["match"] is not None else pd.Series(np.zeros(n))
+        match = pd.to_numeric(match, errors="coerce").fillna(0).astype(np.int64)
+        self._match_codes, self.match_values = pd.factorize(match.to_numpy(), sort=True)
+        self._code_codes, self.code_values = pd.factorize(num(cols["code"]), sort=True)   # NaN → -1
+        bamt, aamt = num(cols["bamt"]), num(cols["aamt"])
+        amount = np.abs(np.where(np.isfinite(bamt), bamt, aamt))
+        self._amount_order = np.argsort(amount, kind="stable")                             # NaN בסוף
+        self._amount_sorted = amount[self._amount_order]
+        self._text = []
+        for c in dict.fromkeys(filter(lambda c: c is not None,
+                                      (pos(pick_col(df, DETAILS)), pos(pick_col(df, REF1S)), pos(pick_col(df, REF2S))))):
+            s = df.iloc[:, c]
+            codes, uniq = pd.factorize(s.astype(str).where(s.notna()))
+            self._text.append((codes, pd.Series(uniq, dtype="str").str.lower()))
+        self._orders = []
+        for c in range(df.shape[1]):
+            s = df.iloc[:, c]
+            codes, _ = pd.factorize(s.astype(str).where(s.notna()) if s.dtype == object else s, sort=True)
+            order = np.argsort(np.where(codes < 0, len(df), codes), kind="stable")
+            self._orders.append((order, int(np.count_nonzero(codes >= 0))))
+
+    def _lut_mask(self, codes, values, wanted):
+        return np.append(np.isin(values, list(wanted)), False)[codes]
+
+    def mask(self, rules=(0,), codes=None, amount_min=None, amount_max=None, text="") -> np.ndarray:
+        """מסכת השורות שעומדות בכל המסננים (None / ריק = בלי סינון)."""
+        m = np.ones(len(self.df), dtype=bool)
+        if rules:
+            m &= self._lut_mask(self._match_codes, self.match_values, rules)
+        if codes:
+            m &= self._lut_mask(self._code_codes, self.code_values, codes)
+        if amount_min is not None or amount_max is not None:
+            lo = 0 if amount_min is None else np.searchsorted(self._amount_sorted, amount_min - 0.005, "left")
+            hi = (np.searchsorted(self._amount_sorted, np.inf, "right") if amount_max is None
+                  else np.searchsorted(self._amount_sorted, amount_max + 0.005, "right"))
+            in_range = np.zeros(len(self.df), dtype=bool)
+            in_range[self._amount_order[lo:hi]] = True
+            m &= in_range
+        text = (text or "").strip().lower()
+        if text:
+            hit = np.zeros(len(self.df), dtype=bool)
+            for codes_, uniq in self._text:
+                hit |= np.append(uniq.str.contains(text, regex=False).to_numpy(dtype=bool, na_value=False),
+                                 False)[codes_]
+            m &= hit
+        return m
+
+    def query(self, rules=(0,), codes=None, amount_min=None, amount_max=None, text="",
+              sort=None, descending=False, page=1, page_rows=None):
+        """
+        (עמוד כ-DataFrame – אינדקס 'שורה' = שורת Excel, סה"כ שורות, מס' העמוד בפועל).
+        sort – מס' עמודה (None = סדר הקובץ); עמוד מחוץ לטווח – העמוד האחרון.
+        """
+        page_rows = page_rows or EXPLORER_PAGE_ROWS
+        m = self.mask(rules, codes, amount_min, amount_max, text)
+        if sort is None:
+            rows = np.flatnonzero(m)
+            rows = rows[::-1] if descending else rows
+        else:
+            order, valid = self._orders[sort]
+            if descending:
+                order = np.concatenate([order[:valid][::-1], order[valid:]])
+            rows = order[m[order]]
+        total = len(rows)
+        page = min(max(1, int(page)), max(1, -(-total // page_rows)))
+        rows = rows[(page - 1) * page_rows:page * page_rows]
+        out = self.df.iloc[rows]
+        out.index = pd.Index(rows + 2, name="שורה")
+        return out, total, page
+
+_EXPLORERS = OrderedDict()
+_EXPLORERS_LOCK = threading.Lock()
+
+def get_explorer(key) -> ResultExplorer | None:
+    """ResultExplorer לתוצאה key (RESULT_CACHE.frame), נשמרים EXPLORER_KEEP אחרונים; None אם אין."""
+    with _EXPLORERS_LOCK:
+        ex = _EXPLORERS.get(key)
+        if ex is not None:
+            _EXPLORERS.move_to_end(key)
+            return ex
+    frame = RESULT_CACHE.frame(key) if key else None
+    if frame is None:
+        return None
+    ex = ResultExplorer(frame)
+    with _EXPLORERS_LOCK:
+        _EXPLORERS[key] = ex
+        while len(_EXPLORERS) > EXPLORER_KEEP:
+            _EXPLORERS.popitem(last=False)
+    return ex
+
+# ---------------- Background jobs ----------------
+@dataclass
+class Job:
+    id: str
+    status: str = "queued"          # queued / running / done / error / cancelled
+    stage: str = ""
+    progress: float = 0.0
+    counts: dict | None = None
+    out_bytes: bytes | None = None
+    out_path: str | None = None     # מצב מחולק – הפלט בקובץ זמני
+    result_key: str | None = None   # DataSheet המעובד ב-RESULT_CACHE (get_explorer); לא במצב מחולק
+    report: RunReport | None = None
+    error: str | None = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    _vk_rows: pd.DataFrame | None = field(default=None, repr=False)     # unmapped_standing_orders של הפלט
+    _suggestions: tuple | None = field(default=None, repr=False)        # (גרסת מאגר, limit, הצעות)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("done", "error", "cancelled")
+
+    def supplier_suggestions(self, limit=None) -> pd.DataFrame:
+        """
+        supplier_suggestions לפלט המשימה: גיליון הוראת קבע נקרא מהפלט פעם אחת,
+        וההצעות מחושבות מחדש רק כשמאגר הספקים משתנה (vk_version).
+        """
+        version = vk_version()
+        if self._suggestions is None or self._suggestions[:2] != (version, limit):
+            if self._vk_rows is None:
+                self._vk_rows = unmapped_standing_orders(self.out_bytes if self.out_path is None else self.out_path)
+            self._suggestions = (version, limit, supplier_suggestions(self._vk_rows, limit))
+        return self._suggestions[2]
+
+class JobManager:
+    """
+    הרצות process_workbook_cached ב-ThreadPoolExecutor (JOB_WORKERS במקביל, השאר בתור),
+    עם מזהה משימה, התקדמות לפי שלבים וביטול (בין שלבים).
+    משימה עם מדידת זיכרון (RunReport עם trace_memory) רצה לבד – tracemalloc סופר
+    הקצאות של כל התהליך; היא ממתינה לסיום הרצות פעילות, ומשימות אחרות ממתינות לה.
+    משימות שהסתיימו נשמרות (JOB_KEEP האחרונות) – אפשר לשלוף אחרי rerun.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, keep=JOB_KEEP):
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="recon-job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._gate = threading.Condition()
+        self._active = 0            # הרצות פעילות
+        self._measuring = False     # משימה מדודה רצה / ממתינה לריצה לבד
+
+    def submit(self, main_bytes, aux_bytes: bytes | None, params=None, report=None, **opts) -> str:
+        """
+        opts – carry_forward / account / period / source_name / output_format של process_workbook_cached.
+        partitioned=True – main_bytes הוא נתיב לקובץ, והפלט נכתב ל-Job.out_path
+        (process_workbook_partitioned; memory_budget אופציונלי; delete_input=True –
+        מחיקת קובץ הקלט בסוף, למשל העלאה שנשמרה לקובץ זמני).
+        """
+        job = Job(id=uuid.uuid4().hex[:12], report=report)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [k for k, j in self._jobs.items() if j.done]
+            for k in finished[:max(0, len(self._jobs) - self.keep)]:
+                old = self._jobs.pop(k)
+                if old.out_path:
+                    try:
+                        os.remove(old.out_path)
+                    except OSError:
+                        pass
+        self._pool.submit(self._run, job, main_bytes, aux_bytes, params, opts)
+        return job.id
+
+    def get(self, job_id) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and not job.done:
+                job.cancel_event.set()
+                if job.status == "queued":
+                    job.status = "cancelled"
+
+    def _set_status(self, job, status) -> bool:
+        """מעבר סטטוס תחת self._lock; ביטול שכבר התבקש גובר (→ cancelled, False)."""
+        with self._lock:
+            if job.cancel_event.is_set():
+                job.status = "cancelled"
+                return False
+            job.status = status
+            return True
+
+    def _run(self, job, main_bytes, aux_bytes, params, opts):
+        exclusive = job.report is not None and job.report.trace_memory
+        with self._gate:
+            self._gate.wait_for(lambda: not self._measuring)
+            if not self._set_status(job, "queued"):
+                return
+            if exclusive:
+                self._measuring = True
+                self._gate.wait_for(lambda: self._active == 0)
+            self._active += 1
+        try:
+            self._execute(job, main_bytes, aux_bytes, params, opts)
+        finally:
+            with self._gate:
+                self._active -= 1
+                if exclusive:
+                    self._measuring = False
+                self._gate.notify_all()
+
+    def _execute(self, job, main_bytes, aux_bytes, params, opts):
+        if not self._set_status(job, "running"):
+            return
+
+        def progress(stage, fraction):
+            if job.cancel_event.is_set():
+                raise RunCancelled()
+            job.stage, job.progress = stage, fraction
+
+        try:
+            if opts.pop("partitioned", False):
+                delete_input = opts.pop("delete_input", False)
+                fd, job.out_path = tempfile.mkstemp(prefix="recon-out-", suffix=".xlsx", dir=PARTITION_SPILL_DIR)
+                os.close(fd)
+                try:
+                    job.counts = process_workbook_partitioned(main_bytes, aux_bytes, job.out_path, job.report,
+                                                              params, progress=progress, **opts)
+                finally:
+                    if delete_input:
+                        os.remove(main_bytes)
+            else:
+                job.counts, job.out_bytes, job.result_key = process_workbook_cached(
+                    main_bytes, aux_bytes, job.report, params, progress=progress, with_key=True, **opts)
+            job.progress = 1.0
+            self._set_status(job, "done")
+        except RunCancelled:
+            self._set_status(job, "cancelled")
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            self._set_status(job, "error")
+
+JOBS = JobManager()
@@ -1,28 +1,17 @@
 # -*- coding: utf-8 -*-
 """
-התאמות בנק – 1 עד 12 (גרסת סכומים קשיחה לכלל 3)
-- כלל 1: OV/RC 1:1 (תאריך+סכום)
-- כלל 2: הוראות קבע (469/515) + 'הוראת קבע ספקים':
-    כל השורות בחובה; שורת סיכום 20001 בזכות = סה״כ חובה
-    של שורות עם מס’ ספק. שורות בלי מס’ ספק צבועות כתום.
-- כלל 3: העברות (485, 'העב' במקבץ-נט') – מסמן רק אם קיים
-    צד בנק וגם צד ספרים ושוויי־סכום (במונחי ערך מוחלט).
-    אין דרישת התאמת תאריך. אם אין התאמה → גיליון 'פערי סכומים – כלל 3'.
-- כלל 4: שיקים ספקים (493) עם טולרנס סכום על התאמת אסמכתאות (Ref1 בנק ↔ Ref2 ספרים).
-- כללים 5–10: לפי הלוגיקה שאישרת.
-- כלל 11: התאמות BT (קוד 485 מול אסמכתא BT) – לפי סכום מוחלט.
-- 12: placeholder.
-- עיצוב: RTL, A4 לרוחב, Fit-to-width=1, שוליים נוחים.
+התאמות בנק – 1 עד 12 – ממשק Streamlit.
+הלוגיקה (קריאה, כללים, יצוא) נמצאת ב-recon_engine.py.
 """
 
-import io, os, re, json
-from datetime import datetime
-import numpy as np
+import pathlib, shutil, tempfile
+
 import pandas as pd
 import streamlit as st
-from openpyxl import load_workbook
-from openpyxl.styles import PatternFill, Font
-from openpyxl.worksheet.page import PageMargins
+
+from recon_engine import (JOBS, RunReport, vk_upsert_names, vk_upsert_amounts,
+                          import_name_map_from_excel, rule_params, open_items_count,
+                          get_explorer, EXPLORER_PAGE_ROWS, PARTITION_AUTO_BYTES, PARTITION_SPILL_DIR)
 
 # ---------------- UI ----------------
 st.set_page_config(page_title="התאמות בנק – 1 עד 12", page_icon="✅", layout="centered")
@@ -34,635 +23,176 @@ html, body, [class*="css"] { direction: rtl; text-align: right; }
 """, unsafe_allow_html=True)
 st.title("התאמות בנק – 1 עד 12")
 
-# ---------------- Constants ----------------
-STANDING_CODES = {469, 515}         # כלל 2
-OVRC_CODES     = {120, 175}         # כלל 1
-TRANSFER_CODE  = 485                # כלל 3
-TRANSFER_PHRASE = "העב' במקבץ-נט"
-RULE4_CODE     = 493                # כלל 4
-RULE4_EPS      = 0.50               # טולרנס כלל 4
-
-# כלל 3 – התאמת סכומים (0.00 = חייב זהות מוחלטת בערך מוחלט)
-RULE3_AMOUNT_EPS = 0.00
-
-# כללים 5–10
-RULE5_CODES = {453, 472, 473, 124}  # עמלות – חיובי ועד 1000
-RULE6_COMPANY = 'פאיימי בע"מ'       # קוד 175, שלילי, פרטים בדיוק
-RULE7_CODE = 143; RULE7_PHRASE = "שיקים ממשמרת"
-RULE8_CODE = 191; RULE8_PHRASE = "הפק' שיק-שידור"
-RULE9_CODE = 205; RULE9_PHRASE = "הפק.שיק במכונה"
-RULE10_CODES = {191, 132, 396}
-
-# ---------------- VLOOKUP default mappings ----------------
-VK_FILE = "rules_store.json"
-
-DEFAULT_NAME_MAP = {
-    "בזק בינלאומי ב": "30006",
-    "פרי ירוחם חב'": "34714",
-    "סלקום ישראל בע": "30055",
-    "בזק-הוראות קבע": "34746",
-    "דרך ארץ הייווי": "34602",
-    "גלובס פבלישר ע": "30067",
-    "פלאפון תקשורת": "30030",
-    "מרכז הכוכביות": "30002",
-    "ע.אשדוד-מסים": "30056",
-    "א.ש.א(בס\"ד)אחז": "30050",
-    "או.פי.ג'י(מ.כ)": "30047",
-    "רשות האכיפה וה": "67-1",
-    "קול ביז מילניו": "30053",
-    "פריוריטי סופטו": "30097",
-    "אינטרנט רימון": "34636",
-    "עו\"דכנית בע\"מ": "30018",
-    "עיריית רמת גן": "30065",
-    "פז חברת נפט בע": "34811",
-    "ישראכרט": "28002",
-    "חברת החשמל ליש": "30015",
-    "הפניקס ביטוח": "34686",
-    "מימון ישיר מקב": "34002",
-    "שלמה טפר": "30247",
-    "נמרוד תבור עורך-דין": "30038",
-    "עיריית בית שמש": "34805",
-    "פז קמעונאות וא": "34811",
-    "הו\"ק הלו' רבית": "8004",
-}
-
-# placeholders 11–12 (rule 11 overridden below)
-def rule11_placeholder(df, match_col, code_col, bamt_col, details_col):
-    """
-    כלל 11 – התאמות BT:
-    • צד בנק: קוד פעולת בנק = 485 וסכום בבנק ≠ 0.
-    • צד ספרים: אסמכתא 1 מתחילה ב-"BT" וסכום בספרים ≠ 0.
-    • התאמה היא 1:1 לפי סכום מוחלט (|סכום בנק| = |סכום ספרים|).
-    • אין דריסה של כללים – עובדים רק על שורות שמס' ההתאמה שלהן עדיין 0.
-    """
-
-    # אם אין עמודת מס' התאמה בכלל – לא נוגעים
-    if match_col not in df.columns:
-        return df.get(match_col, pd.Series([0] * len(df)))
-
-    # לנסות להשלים עמודות חסרות אם לא הגיעו מבחוץ
-    if not code_col:
-        code_col = pick_col(df, BANK_CODES)
-    if not bamt_col:
-        bamt_col = pick_col(df, BANK_AMTS)
-    ref1_col = pick_col(df, REF1S)
-    aamt_col = pick_col(df, BOOKS_AMTS)
-
-    # אם חסרה עמודת קוד / סכום / אסמכתא / סכום ספרים – אי אפשר להריץ את הכלל
-    if not code_col or not bamt_col or not ref1_col or not aamt_col:
-        return df[match_col]
-
-    # המרות בסיסיות
-    match = pd.to_numeric(df[match_col], errors="coerce").fillna(0).astype(int)
-    code  = to_num(df[code_col])
-    bamt  = to_num(df[bamt_col])
-    aamt  = to_num(df[aamt_col])
-    ref1  = df[ref1_col].astype(str).fillna("").str.strip()
-
-    # מילונים: סכום מוחלט -> רשימת אינדקסים
-    bank_by_amt  = {}
-    books_by_amt = {}
-
-    # צד בנק – קוד 485
-    for i in range(len(df)):
-        if match.iat[i] != 0:
-            continue
-        if pd.isna(code.iat[i]) or pd.isna(bamt.iat[i]) or bamt.iat[i] == 0:
-            continue
-        try:
-            if int(code.iat[i]) != 485:
-                continue
-        except Exception:
-            continue
-
-        key = round(abs(float(bamt.iat[i])), 2)
-        bank_by_amt.setdefault(key, []).append(i)
-
-    # צד ספרים – אסמכתא 1 מתחילה ב-BT
-    for j in range(len(df)):
-        if match.iat[j] != 0:
-            continue
-        if pd.isna(aamt.iat[j]) or aamt.iat[j] == 0:
-            continue
-        if not str(ref1.iat[j]).upper().startswith("BT"):
-            continue
-
-        key = round(abs(float(aamt.iat[j])), 2)
-        books_by_amt.setdefault(key, []).append(j)
-
-    # התאמות 1:1 לפי סכום מוחלט
-    for key, bank_idx_list in bank_by_amt.items():
-        books_idx_list = books_by_amt.get(key, [])
-        if not books_idx_list:
-            continue
-
-        pair_count = min(len(bank_idx_list), len(books_idx_list))
-        for k in range(pair_count):
-            i = bank_idx_list[k]
-            j = books_idx_list[k]
-            if match.iat[i] == 0 and match.iat[j] == 0:
-                match.iat[i] = 11
-                match.iat[j] = 11
-
-    return match
-
-
-def rule12_placeholder(df, match_col, code_col, bamt_col, details_col):
-    return df[match_col]
-
-# ---------------- Column maps ----------------
-MATCH_COLS = ["מס.התאמה","מס. התאמה","מס התאמה","מספר התאמה","התאמה"]
-BANK_CODES = ["קוד פעולת בנק","קוד פעולה","קוד פעולת","Bank Code"]
-BANK_AMTS  = ["סכום בדף","סכום דף","סכום בבנק","סכום תנועת בנק","Bank Amount"]
-BOOKS_AMTS = ["סכום בספרים","סכום בספר","סכום ספרים","Books Amount"]
-REF1S      = ["אסמכתא 1","אסמכתא1","אסמכתא","אסמכתה","Ref1"]
-REF2S      = ["אסמכתא 2","אסמכתא2","אסמכתא-2","אסמכתה 2","Ref2"]
-DATES      = ["תאריך מאזן","תאריך ערך","תאריך","Date"]
-DETAILS    = ["פרטים","תיאור","שם ספק","Details","תאור"]
-
-# aux (עזר להעברות/כלל 3)
-AUX_DATE_KEYS = ["תאריך פריקה","תאריך","פריקה"]   # כולל שעה/חותמת אירוע
-AUX_AMT_KEYS  = ["אחרי ניכוי","אחרי","סכום"]
-AUX_PAYNO_KEYS= ["מס' תשלום","מס תשלום","מספר תשלום"]
-
-# ---------------- Helpers ----------------
-def pick_col(df, names):
-    for n in names:
-        if n in df.columns:
-            return n
-    for n in names:
-        for c in df.columns:
-            if isinstance(c, str) and n in c:
-                return c
-    return None
-
-def to_num(s):
-    s = (s.astype(str)
-         .str.replace(",","",regex=False)
-         .str.replace("₪","",regex=False)
-         .str.replace("\u200f","",regex=False)
-         .str.replace("\u200e","",regex=False)
-         .str.strip())
-    return pd.to_numeric(s, errors="coerce")
-
-def norm_date(series):
-    def f(x):
-        if pd.isna(x):
-            return pd.NaT
-        if isinstance(x, (pd.Timestamp, datetime)):
-            return pd.Timestamp(x.date())
-        return pd.to_datetime(x, dayfirst=True, errors="coerce").normalize()
-    return series.apply(f)
-
-def ws_to_df(ws):
-    rows = list(ws.iter_rows(values_only=True))
-    if not rows:
-        return pd.DataFrame()
-    header = [str(x) if x is not None else "" for x in rows[0]]
-    data   = [list(r[:len(header)]) for r in rows[1:]]
-    return pd.DataFrame(data, columns=header)
-
-def only_digits(s):
-    return re.sub(r"\D","", str(s)).lstrip("0") or "0"
-
-# ---------------- VLOOKUP store ----------------
-def vk_load():
-    """טוען את rules_store.json וממזג את רשימת ברירת המחדל."""
-    if os.path.exists(VK_FILE):
-        try:
-            with open(VK_FILE, "r", encoding="utf-8") as f:
-                store = json.load(f)
-        except Exception:
-            store = {"name_map": {}, "amount_map": {}}
-    else:
-        store = {"name_map": {}, "amount_map": {}}
-
-    # ודא שמפתחות קיימים
-    store.setdefault("name_map", {})
-    store.setdefault("amount_map", {})
-
-    # מיזוג מיפוי ברירת מחדל – לא לדרוס מה שכבר קיים
-    for k, v in DEFAULT_NAME_MAP.items():
-        store["name_map"].setdefault(k, v)
-
-    return store
-
-def vk_save(store):
-    with open(VK_FILE, "w", encoding="utf-8") as f:
-        json.dump(store, f, ensure_ascii=False, indent=2)
-
-def import_name_map_from_excel(file, store):
-    """
-    ייבוא מיפוי ספקים מאקסל:
-    עמודה 1 – 'פרטים' (או כותרת דומה),
-    עמודה 2 – 'מס' ספק'.
-    """
-    df = pd.read_excel(file)
-
-    col_det = pick_col(df, DETAILS) or df.columns[0]
-    col_sup = pick_col(df, ["מס' ספק", "מס ספק", "מספר ספק", "ספק", "Supplier", "Supplier No"])
-    if col_sup is None:
-        if len(df.columns) < 2:
-            raise ValueError("הקובץ חייב לפחות שתי עמודות: פרטים ומס' ספק.")
-        col_sup = df.columns[1]
-
-    df_sub = df[[col_det, col_sup]].dropna(how="all")
-    added = 0
-
-    for _, row in df_sub.iterrows():
-        name = str(row[col_det]).strip()
-        sup  = str(row[col_sup]).strip()
-        if not name or not sup:
-            continue
-        # אם הערך השתנה – נעדכן
-        if store["name_map"].get(name) != sup:
-            store["name_map"][name] = sup
-            added += 1
-
-    if added:
-        vk_save(store)
-    return added
-
-def build_vlookup_sheet(datasheet_df: pd.DataFrame) -> pd.DataFrame:
-    """
-    כל שורה כלל 2 → 'סכום חובה' = |סכום|.
-    שורת סיכום 20001 בזכות = סה״כ חובה של השורות שיש להן 'מס' ספק'.
-    שורות בלי 'מס' ספק' – יצבעו בכתום בשלב העיצוב.
-    """
-    store = vk_load()
-    name_map   = {str(k): v for k, v in store.get("name_map", {}).items()}
-    amount_map = {float(k): v for k, v in store.get("amount_map", {}).items()}
-
-    col_match = pick_col(datasheet_df, MATCH_COLS) or datasheet_df.columns[0]
-    col_bamt  = pick_col(datasheet_df, BANK_AMTS)
-    col_det   = pick_col(datasheet_df, DETAILS)
-
-    match = pd.to_numeric(datasheet_df[col_match], errors="coerce").fillna(0).astype(int)
-    bamt  = to_num(datasheet_df[col_bamt]) if col_bamt else pd.Series([np.nan] * len(datasheet_df))
-    det   = datasheet_df[col_det].astype(str).fillna("") if col_det else pd.Series([""] * len(datasheet_df))
-
-    vk = datasheet_df.loc[match == 2, [col_det, col_bamt]].rename(columns={col_det: "פרטים", col_bamt: "סכום"}).copy()
-    if vk.empty:
-        return pd.DataFrame(columns=["פרטים", "סכום", "מס' ספק", "סכום חובה", "סכום זכות"])
-
-    def pick_supplier(row):
-        s = str(row["פרטים"])
-        for k, v in name_map.items():
-            if k and k in s:
-                return v
-        try:
-            key = round(abs(float(row["סכום"])), 2)
-            return amount_map.get(key, "")
-        except Exception:
-            return ""
-
-    vk["מס' ספק"]   = vk.apply(pick_supplier, axis=1)
-    vk["סכום חובה"] = vk["סכום"].apply(lambda x: abs(x) if pd.notna(x) else 0.0)
-    vk["סכום זכות"] = 0.0
-
-    total_hova_with_supplier = vk.loc[vk["מס' ספק"].astype(str).str.len() > 0, "סכום חובה"].sum()
-    if total_hova_with_supplier and total_hova_with_supplier != 0:
-        vk = pd.concat([vk, pd.DataFrame([{
-            "פרטים": "סה\"כ זכות – עם מס' ספק",
-            "סכום": 0.0,
-            "מס' ספק": 20001,
-            "סכום חובה": 0.0,
-            "סכום זכות": round(float(total_hova_with_supplier), 2)
-        }])], ignore_index=True)
-
-    return vk
-
-# ---------------- Rules 1–4 ----------------
-def apply_rules_1_4(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    col_match = pick_col(out, MATCH_COLS) or out.columns[0]
-    col_code  = pick_col(out, BANK_CODES)
-    col_bamt  = pick_col(out, BANK_AMTS)
-    col_aamt  = pick_col(out, BOOKS_AMTS)
-    col_ref1  = pick_col(out, REF1S)
-    col_ref2  = pick_col(out, REF2S)
-    col_date  = pick_col(out, DATES)
-    col_det   = pick_col(out, DETAILS)
-
-    if col_match not in out.columns:
-        out[col_match] = 0
-
-    match = pd.to_numeric(out[col_match], errors="coerce").fillna(0).astype(int)
-    code  = to_num(out[col_code]) if col_code else pd.Series([np.nan] * len(out))
-    bamt  = to_num(out[col_bamt]) if col_bamt else pd.Series([np.nan] * len(out))
-    aamt  = to_num(out[col_aamt]) if col_aamt else pd.Series([np.nan] * len(out))
-    datev = norm_date(pd.to_datetime(out[col_date], errors="coerce")) if col_date else pd.Series([pd.NaT] * len(out))
-    det   = out[col_det].astype(str).fillna("") if col_det else pd.Series([""] * len(out))
-    ref1  = out[col_ref1].astype(str).fillna("") if col_ref1 else pd.Series([""] * len(out))
-    ref2  = out[col_ref2].astype(str).fillna("") if col_ref2 else pd.Series([""] * len(out))
-
-    # 1: OV/RC 1:1
-    bank_keys, books_keys = {}, {}
-    for i in range(len(out)):
-        if match.iat[i] != 0:
-            continue
-        if pd.notna(code.iat[i]) and int(code.iat[i]) in OVRC_CODES and pd.notna(bamt.iat[i]) and bamt.iat[i] < 0 and pd.notna(datev.iat[i]):
-            k = (round(abs(float(bamt.iat[i])), 2), datev.iat[i])
-            bank_keys.setdefault(k, []).append(i)
-    for j in range(len(out)):
-        if match.iat[j] != 0:
-            continue
-        if pd.notna(aamt.iat[j]) and aamt.iat[j] > 0 and pd.notna(datev.iat[j]) and str(ref1.iat[j]).upper().startswith(("OV", "RC")):
-            k = (round(abs(float(aamt.iat[j])), 2), datev.iat[j])
-            books_keys.setdefault(k, []).append(j)
-    for k, bidx in bank_keys.items():
-        if len(bidx) == 1 and len(books_keys.get(k, [])) == 1:
-            i = bidx[0]
-            j = books_keys[k][0]
-            if match.iat[i] == 0 and match.iat[j] == 0:
-                match.iat[i] = 1
-                match.iat[j] = 1
-
-    # 2: Standing orders (סימון בלבד)
-    for i in range(len(out)):
-        if match.iat[i] == 0 and pd.notna(code.iat[i]) and int(code.iat[i]) in STANDING_CODES:
-            match.iat[i] = 2
-
-    # 3: יסומן בשלב process_workbook (תלוי עזר; ללא בדיקת תאריך)
-
-    # 4: שיקים ספקים (Ref1 בנק ↔ Ref2 ספרים) + טולרנס
-    bank_idx = [i for i in range(len(out))
-                if match.iat[i] == 0 and pd.notna(code.iat[i]) and int(code.iat[i]) == RULE4_CODE
-                and str(ref1.iat[i]).strip() and pd.notna(bamt.iat[i])]
-    books_idx = [j for j in range(len(out))
-                 if match.iat[j] == 0 and str(ref1.iat[j]).upper().startswith("CH")
-                 and str(ref2.iat[j]).strip() and pd.notna(aamt.iat[j])]
-    used = set()
-    for i in bank_idx:
-        ref_b = only_digits(ref1.iat[i])
-        ab = abs(float(bamt.iat[i]))
-        for j in books_idx:
-            if j in used or match.iat[j] != 0:
-                continue
-            if only_digits(ref2.iat[j]) != ref_b:
-                continue
-            aj = abs(float(aamt.iat[j]))
-            if abs(aj - ab) <= RULE4_EPS:
-                match.iat[i] = 4
-                match.iat[j] = 4
-                used.add(j)
-                break
-
-    out[col_match] = match
-    return out
-
-# ---------------- Rules 5–12 ----------------
-def apply_rules_5_12(df: pd.DataFrame) -> pd.DataFrame:
-    out = df.copy()
-    col_match = pick_col(out, MATCH_COLS) or out.columns[0]
-    col_code  = pick_col(out, BANK_CODES)
-    col_bamt  = pick_col(out, BANK_AMTS)
-    col_det   = pick_col(out, DETAILS)
-
-    if col_match not in out.columns:
-        out[col_match] = 0
-    match = pd.to_numeric(out[col_match], errors="coerce").fillna(0).astype(int)
-    code  = to_num(out[col_code]) if col_code else pd.Series([np.nan]*len(out))
-    bamt  = to_num(out[col_bamt]) if col_bamt else pd.Series([np.nan]*len(out))
-    det   = out[col_det].astype(str).fillna("") if col_det else pd.Series([""]*len(out))
-
-    m5  = (match == 0) & (code.isin(list(RULE5_CODES))) & (bamt > 0) & (bamt <= 1000)
-    match.loc[m5] = 5
-
-    m6  = (match == 0) & (code == 175) & (bamt < 0) & (det == RULE6_COMPANY)
-    match.loc[m6] = 6
-
-    m7  = (match == 0) & (code == RULE7_CODE) & (bamt < 0) & (det == RULE7_PHRASE)
-    match.loc[m7] = 7
-
-    m8  = (match == 0) & (code == RULE8_CODE) & (bamt < 0) & (det == RULE8_PHRASE)
-    match.loc[m8] = 8
-
-    m9  = (match == 0) & (code == RULE9_CODE) & (bamt < 0) & (det == RULE9_PHRASE)
-    match.loc[m9] = 9
-
-    m10 = (match == 0) & (code.isin(list(RULE10_CODES))) & (bamt.notna()) & (bamt != 0)
-    match.loc[m10] = 10
-
-    # כלל 11 – אחרי 5–10, רק על שורות שמס. התאמה עדיין 0
-    match = rule11_placeholder(out.assign(**{col_match: match}),
-                               col_match,
-                               pick_col(out, BANK_CODES),
-                               pick_col(out, BANK_AMTS),
-                               pick_col(out, DETAILS))
-
-    # כלל 12 – כרגע placeholder
-    match = rule12_placeholder(out.assign(**{col_match: match}),
-                               col_match,
-                               pick_col(out, BANK_CODES),
-                               pick_col(out, BANK_AMTS),
-                               pick_col(out, DETAILS))
-
-    out[col_match] = match
-    return out
-
-# ---------------- Styling & print ----------------
-def style_and_print(wb):
-    for ws in wb.worksheets:
-        ws.sheet_view.rightToLeft = True
-        ws.page_setup.paperSize = 9      # A4
-        ws.page_setup.orientation = 'landscape'
-        ws.page_setup.fitToWidth = 1
-        ws.page_setup.fitToHeight = 0
-        ws.page_margins = PageMargins(left=0.4, right=0.4, top=0.6, bottom=0.6)
-
-    # צביעה כתומה לשורות ללא 'מס' ספק' בגיליון הוראת קבע
-    if "הוראת קבע ספקים" in wb.sheetnames:
-        ws = wb["הוראת קבע ספקים"]
-        header = {cell.value: idx for idx, cell in enumerate(ws[1], start=1)}
-        col_supplier = header.get("מס' ספק")
-        if col_supplier:
-            orange = PatternFill(start_color="FFF2CC", end_color="FFF2CC", fill_type="solid")
-            for r in range(2, ws.max_row + 1):
-                v = ws.cell(row=r, column=col_supplier).value
-                if v in ("", None):
-                    for c in range(1, ws.max_column + 1):
-                        ws.cell(row=r, column=c).fill = orange
-        for cell in ws[ws.max_row]:
-            cell.font = Font(bold=True)
-
-# ---------------- Processing ----------------
-def process_workbook(main_bytes: bytes, aux_bytes: bytes | None):
-    # קריאה
-    wb = load_workbook(io.BytesIO(main_bytes), data_only=True)
-    ws = wb["DataSheet"] if "DataSheet" in wb.sheetnames else wb.worksheets[0]
-    df = ws_to_df(ws)
-    if df.empty:
-        return None, None, None
-
-    # 1–4
-    df = apply_rules_1_4(df)
-
-    # === כלל 3 – סכומים זהים בלבד (ללא דרישת תאריך) ===
-    st.session_state["_rule3_mismatches_df"] = None
-    if aux_bytes is not None:
-        aux_wb = load_workbook(io.BytesIO(aux_bytes), data_only=True)
-        a_ws   = aux_wb.worksheets[0]
-        a_df   = ws_to_df(a_ws)
-
-        c_dt   = pick_col(a_df, AUX_DATE_KEYS)   # תאריך/חותמת אירוע
-        c_amt  = pick_col(a_df, AUX_AMT_KEYS)    # אחרי ניכוי
-        c_pay  = pick_col(a_df, AUX_PAYNO_KEYS)  # מס' תשלום
-
-        if c_dt and c_amt:
-            a_dt  = pd.to_datetime(a_df[c_dt], errors="coerce")               # אירוע
-            a_amt = pd.to_numeric(a_df[c_amt], errors="coerce").round(2)
-            groups = (pd.DataFrame({"evt": a_dt, "amt": a_amt})
-                        .dropna(subset=["evt"])
-                        .groupby("evt")["amt"].sum().round(2).to_dict())
-
-            pays_by_evt = {}
-            if c_pay:
-                pays_by_evt = (pd.DataFrame({"evt": a_dt, "pay": a_df[c_pay].astype(str).str.strip()})
-                                 .groupby("evt")["pay"]
-                                 .apply(lambda s: set(s.dropna().astype(str)))
-                                 .to_dict())
-
-            col_match = pick_col(df, MATCH_COLS) or df.columns[0]
-            col_code  = pick_col(df, BANK_CODES)
-            col_bamt  = pick_col(df, BANK_AMTS)
-            col_det   = pick_col(df, DETAILS)
-            col_ref1  = pick_col(df, REF1S)
-            col_aamt  = pick_col(df, BOOKS_AMTS)
-
-            match = pd.to_numeric(df[col_match], errors="coerce").fillna(0).astype(int)
-            code  = to_num(df[col_code]) if col_code else pd.Series([np.nan]*len(df))
-            bamt  = to_num(df[col_bamt]).round(2) if col_bamt else pd.Series([np.nan]*len(df))
-            det   = df[col_det].astype(str).fillna("") if col_det else pd.Series([""]*len(df))
-            ref1  = df[col_ref1].astype(str).str.strip() if col_ref1 else pd.Series([""]*len(df))
-            aamt  = to_num(df[col_aamt]).round(2) if col_aamt else pd.Series([np.nan]*len(df))
-
-            bank_mask = (match == 0) & (code == TRANSFER_CODE) & (bamt > 0) & (det.str.contains(TRANSFER_PHRASE, na=False))
-            mismatches = []
-
-            for evt, evt_sum in groups.items():
-                # ספרים לפי payset של האירוע
-                payset = pays_by_evt.get(evt, set())
-                books_idx = []
-                books_sum = 0.0
-                if payset is not None and len(payset) > 0 and col_ref1 and col_aamt:
-                    books_idx = df.index[(match == 0) & (ref1.astype(str).isin(payset))].tolist()
-                    if books_idx:
-                        books_sum = float(pd.to_numeric(aamt.iloc[books_idx], errors="coerce").fillna(0).sum().round(2))
-
-                # בנק – כל השורות שסכומן |bamt| == |evt_sum|
-                bank_idx = df.index[bank_mask & (bamt.abs().sub(abs(evt_sum)).abs() <= RULE3_AMOUNT_EPS)].tolist()
-
-                if bank_idx and books_idx:
-                    # התאמה חייבת להיות שוויון בערך מוחלט
-                    if abs(abs(books_sum) - abs(evt_sum)) <= RULE3_AMOUNT_EPS:
-                        for i in bank_idx:
-                            if match.iat[i] in (0, 2):
-                                match.iat[i] = 3
-                        for j in books_idx:
-                            if match.iat[j] in (0, 2):
-                                match.iat[j] = 3
-                    else:
-                        mismatches.append({
-                            "אירוע": str(evt),
-                            "סכום בעזר (אחרי ניכוי)": float(evt_sum),
-                            "סכום בספרים (סיכום)": float(books_sum),
-                            "פער |ספרים|-|עזר|": float(round(abs(abs(books_sum) - abs(evt_sum)), 2)),
-                            "count_בנק": len(bank_idx),
-                            "count_ספרים": len(books_idx)
-                        })
-                else:
-                    mismatches.append({
-                        "אירוע": str(evt),
-                        "סכום בעזר (אחרי ניכוי)": float(evt_sum),
-                        "סכום בספרים (סיכום)": float(books_sum) if books_idx else np.nan,
-                        "פער |ספרים|-|עזר|": np.nan,
-                        "count_בנק": len(bank_idx),
-                        "count_ספרים": len(books_idx)
-                    })
-
-            df[col_match] = match
-            if mismatches:
-                st.session_state["_rule3_mismatches_df"] = pd.DataFrame(mismatches)
-
-    # 5–12 (רק על 0)
-    df = apply_rules_5_12(df)
-
-    # גיליון הוראת קבע ספקים
-    vk_df = build_vlookup_sheet(df)
-
-    # יצוא עם עיצוב + גיליון בקרה לכלל 3 (אם יש)
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="xlsxwriter") as wr:
-        df.to_excel(wr, index=False, sheet_name="DataSheet")
-        counts = pd.to_numeric(df[pick_col(df, MATCH_COLS) or df.columns[0]],
-                               errors="coerce").fillna(0).astype(int).value_counts().sort_index()
-        pd.DataFrame({"מס": counts.index, "כמות": counts.values}).to_excel(wr, index=False, sheet_name="סיכום")
-        vk_df.to_excel(wr, index=False, sheet_name="הוראת קבע ספקים")
-
-        misdf = st.session_state.get("_rule3_mismatches_df", None)
-        if misdf is not None and not misdf.empty:
-            misdf.to_excel(wr, index=False, sheet_name="פערי סכומים – כלל 3")
-
-    wb_out = load_workbook(io.BytesIO(buffer.getvalue()))
-    style_and_print(wb_out)
-    final = io.BytesIO()
-    wb_out.save(final)
-    return df, vk_df, final.getvalue()
-
 # ---------------- UI ----------------
 c1, c2 = st.columns([2, 2])
-main_file = c1.file_uploader("בחרי קובץ מקור – DataSheet בלבד", type=["xlsx"])
-aux_file  = c2.file_uploader("⬆️ קובץ עזר להעברות (לכלל 3)", type=["xlsx"])
-st.caption("VLOOKUP שומר מפות ב-rules_store.json (שם/סכום → מס' ספק).")
+main_file = c1.file_uploader("בחרי קובץ מקור – DataSheet בלבד", type=["xlsx", "csv", "parquet"])
+aux_file  = c2.file_uploader("⬆️ קובץ עזר להעברות (לכלל 3)", type=["xlsx", "csv", "parquet"])
+st.caption("VLOOKUP שומר מפות ב-rules_store.db (שם/סכום → מס' ספק).")
+measure = st.checkbox("📊 מדידת ביצועים (זמן/זיכרון לכל כלל, ללא מטמון)")
+k1, k2, k3 = st.columns([3, 2, 2])
+carry = k1.checkbox("🔁 התאמה מול פריטים פתוחים מחודשים קודמים (open_items.db)", value=False)
+account = k2.text_input("חשבון / חברה (חובה להתאמה מול פריטים פתוחים)", disabled=not carry).strip()
+period = k3.text_input("תקופה (למשל 2025-02; ריק = שם הקובץ)", disabled=not carry,
+                       help="הרצה חוזרת של אותה תקופה – גם קובץ מתוקן – מחליפה את הקודמת.").strip()
+if carry and account:
+    st.caption(f"{open_items_count(account)} פריטים פתוחים בחשבון {account}.")
+
+# פרמטרים להרצה (what-if) – הרצה חוזרת ממשיכה מהכלל הראשון שהושפע
+defaults = rule_params()
+with st.expander("⚙️ פרמטרים (what-if)", expanded=False):
+    p1, p2, p3 = st.columns(3)
+    params = {
+        "RULE4_EPS": p1.number_input("טולרנס כלל 4 (₪)", min_value=0.0, value=float(defaults["RULE4_EPS"]),
+                                     step=0.1, format="%.2f"),
+        "RULE3_AMOUNT_EPS": p2.number_input("טולרנס כלל 3 (₪)", min_value=0.0,
+                                            value=float(defaults["RULE3_AMOUNT_EPS"]), step=0.1, format="%.2f"),
+    }
+    if defaults["RULE5_MAX"] is not None:
+        params["RULE5_MAX"] = p3.number_input("תקרת כלל 5 (₪)", min_value=0.0, value=float(defaults["RULE5_MAX"]),
+                                              step=100.0, format="%.2f",
+                                              help="ברירת המחדל – התקרה בטבלת הכללים (rules_table.json אם קיים).")
+    else:
+        p3.caption("בטבלת הכללים אין תקרה לכלל 5 – אין what-if לתקרה.")
+    q0, q1, q2 = st.columns(3)
+    params["RULE1_DATE_WINDOW"] = q0.number_input("כלל 1: טווח תאריכים (± ימים, 0 = זהה)", min_value=0,
+                                                  max_value=31, value=int(defaults["RULE1_DATE_WINDOW"]))
+    params["SUBSET_MAX_GROUP"] = q1.number_input("רבים-לאחד (כללים 3, 11): מקס' שורות בקבוצה (1 = כבוי)",
+                                                 min_value=1, max_value=8, value=int(defaults["SUBSET_MAX_GROUP"]))
+    params["SUBSET_DATE_WINDOW"] = q2.number_input("רבים-לאחד: טווח תאריכים (± ימים)", min_value=0,
+                                                   value=int(defaults["SUBSET_DATE_WINDOW"]))
+
+# הרצה ברקע: מזהה המשימה נשמר ב-session וב-URL – התוצאה זמינה גם אחרי רענון
+JOB_POLL_SECONDS = 1.0
+SUGGEST_UI_ROWS  = 20
 
 if st.button("הרצה 1–12"):
     if not main_file:
         st.error("נא להעלות קובץ מקור.")
+    elif carry and not account:
+        st.error("נא להזין חשבון / חברה – פריטים פתוחים מותאמים רק בתוך אותו חשבון.")
+    elif main_file.size > PARTITION_AUTO_BYTES:
+        # קובץ גדול – מצב מחולק: הקובץ נשמר לדיסק ומעובד בחתיכות (בלי פריטים פתוחים)
+        with tempfile.NamedTemporaryFile(prefix="recon-in-", suffix=pathlib.Path(main_file.name).suffix,
+                                         dir=PARTITION_SPILL_DIR, delete=False) as tmp:
+            main_file.seek(0)
+            shutil.copyfileobj(main_file, tmp)
+        job_id = JOBS.submit(tmp.name, aux_file.getvalue() if aux_file else None,
+                             params=params, report=RunReport() if measure else None,
+                             partitioned=True, delete_input=True)
+        st.info("קובץ גדול – עיבוד במצב מחולק (בלי התאמה מול פריטים פתוחים).")
+    else:
+        job_id = JOBS.submit(main_file.getvalue(), aux_file.getvalue() if aux_file else None,
+                             params=params, report=RunReport() if measure else None,
+                             carry_forward=carry, account=account, period=period, source_name=main_file.name)
+    if main_file and (account or not carry):
+        st.session_state["job_id"] = job_id
+        st.query_params["job"] = job_id
+
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def job_progress(job_id):
+    job = JOBS.get(job_id)
+    if job is None or job.done:
+        st.rerun()
+    label = "ממתין בתור..." if job.status == "queued" else f"מעבד – {job.stage}"
+    st.progress(job.progress, text=label)
+    if st.button("⏹️ ביטול"):
+        JOBS.cancel(job_id)
+
+@st.fragment
+def unmatched_explorer(result_key):
+    """חקירת שורות בצד השרת – כל שינוי מריץ רק את הקטע הזה ושולח לדפדפן עמוד אחד."""
+    with st.spinner("בונה אינדקסים..."):
+        ex = get_explorer(result_key)
+    if ex is None:
+        st.caption("התוצאה אינה זמינה עוד לחקירה – נא להריץ שוב.")
+        return
+    f1, f2 = st.columns(2)
+    rules = f1.multiselect("מס' התאמה (ריק = הכל)", [int(v) for v in ex.match_values],
+                           default=[0] if 0 in ex.match_values else None)
+    codes = f2.multiselect("קוד פעולת בנק", [float(v) for v in ex.code_values], format_func=lambda v: f"{v:g}")
+    a1, a2, a3 = st.columns(3)
+    amin = a1.number_input("סכום מ- (ערך מוחלט)", min_value=0.0, value=0.0, step=100.0, format="%.2f")
+    amax = a2.number_input("סכום עד (0 = ללא)", min_value=0.0, value=0.0, step=100.0, format="%.2f")
+    text = a3.text_input("חיפוש בפרטים / אסמכתאות")
+    s1, s2, s3 = st.columns([2, 1, 1])
+    sort = s1.selectbox("מיון", [None, *range(len(ex.labels))],
+                        format_func=lambda c: "סדר הקובץ" if c is None else ex.labels[c])
+    desc = s2.checkbox("סדר יורד")
+    page = s3.number_input("עמוד", min_value=1, value=1)
+    rows, total, page = ex.query(rules, codes, amin or None, amax or None, text, sort, desc, page)
+    st.dataframe(rows.set_axis(ex.labels, axis=1), use_container_width=True)
+    st.caption(f"{total:,} שורות · עמוד {page} מתוך {max(1, -(-total // EXPLORER_PAGE_ROWS))}")
+
+job_id = st.session_state.get("job_id") or st.query_params.get("job")
+if job_id:
+    job = JOBS.get(job_id)
+    if job is None:
+        st.warning("ההרצה אינה זמינה עוד – נא להריץ שוב.")
+    elif not job.done:
+        job_progress(job_id)
+    elif job.status == "cancelled":
+        st.info("ההרצה בוטלה.")
+    elif job.status == "error":
+        st.error(f"שגיאה בעיבוד: {job.error}")
+    elif job.counts is None:
+        st.error("לא נמצאו נתונים.")
     else:
-        with st.spinner("מעבד..."):
-            df_out, vk_out, out_bytes = process_workbook(main_file.read(), aux_file.read() if aux_file else None)
-        if df_out is None:
-            st.error("לא נמצאו נתונים.")
-        else:
-            st.success("מוכן!")
-            col_match = pick_col(df_out, MATCH_COLS) or df_out.columns[0]
-            cnt = pd.to_numeric(df_out[col_match], errors="coerce").fillna(0).astype(int).value_counts().sort_index()
-            st.dataframe(pd.DataFrame({"מס": cnt.index, "כמות": cnt.values}), use_container_width=True)
-            st.download_button("📥 הורד קובץ מעודכן",
-                               data=out_bytes,
-                               file_name="התאמות_1_עד_12.xlsx",
-                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        counts, report = job.counts, job.report
+        st.success("מוכן!")
+        st.dataframe(pd.DataFrame({"מס": list(counts), "כמות": list(counts.values())}), use_container_width=True)
+        if report is not None:
+            with st.expander("📊 ביצועים", expanded=True):
+                st.dataframe(report.to_frame(), use_container_width=True, hide_index=True)
+        st.download_button("📥 הורד קובץ מעודכן",
+                           data=job.out_bytes if job.out_path is None else pathlib.Path(job.out_path).read_bytes,
+                           file_name="התאמות_1_עד_12.xlsx",
+                           mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+
+        if job.result_key:
+            with st.expander("🔍 שורות פתוחות וחקירת תוצאות", expanded=False):
+                unmatched_explorer(job.result_key)
+
+        # הצעות ספק לשורות הוראת קבע בלי מס' ספק – לחיצה שומרת 'פרטים' → ספק במאגר
+        sugg = job.supplier_suggestions(limit=SUGGEST_UI_ROWS)      # הפלט נקרא פעם אחת למשימה
+        sugg = sugg[sugg["הצעות"].str.len() > 0]
+        if len(sugg):
+            with st.expander(f"💡 הצעות ספק לשורות בלי מס' ספק ({len(sugg)})", expanded=False):
+                st.caption("המיפוי נשמר ל-rules_store.db ויחול בהרצה הבאה.")
+                for n, row in sugg.iterrows():
+                    cols = st.columns([3] + [2] * len(row["הצעות"]))
+                    cols[0].write(f"**{row['פרטים']}** · {row['שורות']} שורות · ₪{row['סכום חובה']:,.2f}")
+                    for c, (sup, key, score) in zip(cols[1:], row["הצעות"]):
+                        if c.button(f"{sup} – {key} ({score:.0%})", key=f"sugg-{n}-{sup}"):
+                            vk_upsert_names([(row["פרטים"], sup)])
+                            st.rerun()
 
 # ניהול מפות ל-VLOOKUP
 st.divider()
 st.subheader("🔎 VLOOKUP – הוראת קבע ספקים (עריכה ושמירה)")
-store = vk_load()
-with st.expander("מפות מיפוי (נשמר ל-rules_store.json)", expanded=False):
+with st.expander("מפות מיפוי (נשמר ל-rules_store.db)", expanded=False):
     t1, t2 = st.columns([2, 1])
     nm = t1.text_input("מיפוי לפי 'פרטים' (contains)")
     sp = t2.text_input("מס' ספק")
     if st.button("➕ הוסף/עדכן לפי שם"):
         if nm and sp:
-            store["name_map"][nm] = sp
-            vk_save(store)
+            vk_upsert_names([(nm, sp)])
             st.success("נשמר לפי שם.")
     t3, t4 = st.columns([1, 1])
     amt = t3.number_input("מיפוי לפי סכום (ערך מוחלט)", step=0.01, format="%.2f")
     sp2 = t4.text_input("מס' ספק", key="vk2")
     if st.button("➕ הוסף/עדכן לפי סכום"):
         try:
-            store["amount_map"][str(round(abs(float(amt)), 2))] = sp2
-            vk_save(store)
+            vk_upsert_amounts([(amt, sp2)])
             st.success("נשמר לפי סכום.")
         except Exception as e:
             st.error(str(e))
 
     st.markdown("**ייבוא מאקסל – רשימת ספקים (פרטים + מס' ספק):**")
-    upload_excel = st.file_uploader("טעינת קובץ מיפוי ספקים מאקסל", type=["xlsx", "xls"], key="vk_excel")
+    upload_excel = st.file_uploader("טעינת קובץ מיפוי ספקים מאקסל", type=["xlsx", "xls", "csv", "parquet"],
+                                    key="vk_excel")
     if upload_excel is not None:
         try:
-            added = import_name_map_from_excel(upload_excel, store)
+            added = import_name_map_from_excel(upload_excel)
             st.success(f"הייבוא הסתיים. נוספו/עודכנו {added} רשומות.")
         except Exception as e:
             st.error(f"שגיאה בייבוא: {e}")
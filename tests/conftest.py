@@ -0,0 +1,4 @@
+import os, sys
+
+# המודולים יושבים בשורש המאגר (בלי חבילה)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
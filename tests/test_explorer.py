@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import recon_engine as E
+
+COLS = ["מס.התאמה", "קוד פעולת בנק", "סכום בדף", "סכום בספרים", "פרטים", "אסמכתא 1", "פרטים"]
+
+
+@pytest.fixture
+def explorer():
+    rows = [
+        [0, 485, -100.0, np.nan, "העברה לספק", "OV1", "x"],
+        [1, 120, np.nan, 50.0, "עמלה", 777, "y"],
+        [0, np.nan, np.nan, 100.005, "העברה בנקאית", None, "z"],
+        [4, 485, 250.0, np.nan, None, "OV2", "w"],
+        [0, 469, -49.995, np.nan, "הוראת קבע", "ov3", "v"],
+        [0, 485, np.nan, np.nan, "ללא סכום", "", "u"],
+    ]
+    return E.ResultExplorer(pd.DataFrame(rows, columns=COLS))
+
+
+def _rows(explorer, **kw):
+    page, total, _ = explorer.query(page_rows=100, **kw)
+    assert total == len(page)
+    return page.index.tolist()
+
+
+def test_labels_are_unique(explorer):
+    assert explorer.labels == ["מס.התאמה", "קוד פעולת בנק", "סכום בדף", "סכום בספרים", "פרטים", "אסמכתא 1", "פרטים.1"]
+
+
+def test_rule_and_code_filters(explorer):
+    assert _rows(explorer) == [2, 4, 6, 7]                       # ברירת מחדל – לא מותאמות
+    assert _rows(explorer, rules=(1, 4)) == [3, 5]
+    assert _rows(explorer, rules=()) == [2, 3, 4, 5, 6, 7]
+    assert _rows(explorer, rules=(), codes=[485.0]) == [2, 5, 7]
+    assert _rows(explorer, rules=(9,)) == []
+
+
+def test_amount_filter_uses_abs_bank_then_books_and_cents_tolerance(explorer):
+    assert _rows(explorer, rules=(), amount_min=100, amount_max=100) == [2, 4]
+    assert _rows(explorer, rules=(), amount_min=50, amount_max=50) == [3, 6]
+    assert _rows(explorer, rules=(), amount_min=200) == [5]           # בלי סכום – לא בטווח
+    assert _rows(explorer, rules=(), amount_max=60) == [3, 6]
+
+
+def test_text_filter_is_case_insensitive_over_details_and_refs(explorer):
+    assert _rows(explorer, rules=(), text="העברה") == [2, 4]
+    assert _rows(explorer, rules=(), text="OV") == [2, 5, 6]
+    assert _rows(explorer, rules=(), text="777") == [3]
+
+
+def test_sort_by_position_keeps_missing_last(explorer):
+    amt = COLS.index("סכום בדף")
+    assert _rows(explorer, rules=(), sort=amt) == [2, 6, 5, 3, 4, 7]
+    assert _rows(explorer, rules=(), sort=amt, descending=True) == [5, 6, 2, 3, 4, 7]
+    assert _rows(explorer, rules=(), sort=6) == [7, 6, 5, 2, 3, 4]       # עמודת הפרטים השנייה
+    assert _rows(explorer, descending=True) == [7, 6, 4, 2]
+
+
+def test_page_boundaries(explorer):
+    pages = [explorer.query(rules=(), page=p, page_rows=4) for p in (1, 2, 3, 0)]
+    assert [(p.index.tolist(), total, n) for p, total, n in pages] == [
+        ([2, 3, 4, 5], 6, 1), ([6, 7], 6, 2), ([6, 7], 6, 2), ([2, 3, 4, 5], 6, 1)]
+    page, total, n = explorer.query(rules=(9,), page=5)
+    assert page.empty and total == 0 and n == 1
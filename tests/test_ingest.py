@@ -0,0 +1,116 @@
+import io
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+import recon_engine as E
+
+
+def _workbook():
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "DataSheet"
+    ws.append(["מס.התאמה", "אסמכתא 1", "סכום בדף", "תאריך מאזן", "פרטים", ""])
+    ws.append([0, 777, 12.5, datetime(2025, 1, 1), "חיוב", None])
+    ws.append([0, "777", -3, datetime(2025, 1, 2, 13, 30), None, 1.0])
+    ws.append([None, 12345, 1e6, date(2025, 2, 3), "", True])
+    for cell in ws["D"][1:]:
+        cell.number_format = "yyyy-mm-dd"
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+def test_calamine_reads_like_openpyxl(monkeypatch):
+    pytest.importorskip("python_calamine")
+    data = _workbook()
+    fast = E.read_sheet_df(data, "DataSheet")
+    monkeypatch.setattr(E, "python_calamine", None)
+    slow = E.read_sheet_df(data, "DataSheet")
+    pd.testing.assert_frame_equal(fast, slow)
+    assert [type(v) for v in fast["אסמכתא 1"]] == [int, str, int]
+    assert fast["תאריך מאזן"].dtype.kind == "M"
+
+
+def test_calamine_keeps_pay_number_keys():
+    pytest.importorskip("python_calamine")
+    df = E.read_sheet_df(_workbook(), "DataSheet")
+    rf = E.build_recon_frame(df)
+    assert rf.ref1_s[:2].tolist() == ["777", "777"]
+
+
+def test_date_cells_export_as_dates():
+    df = pd.DataFrame({"תאריך": [date(2025, 1, 1)]}, dtype=object)
+    ws = load_workbook(io.BytesIO(E.export_workbook([("DataSheet", df)]))).active
+    assert ws["A2"].value == datetime(2025, 1, 1)
+
+
+def test_unreadable_workbook_falls_back_to_openpyxl(monkeypatch):
+    calamine = pytest.importorskip("python_calamine")
+
+    def broken(data, sheet_name):
+        raise calamine.CalamineError("bad")
+        yield
+
+    monkeypatch.setattr(E, "_iter_rows_calamine", broken)
+    assert len(E.read_sheet_df(_workbook(), "DataSheet")) == 3
+
+
+def test_parse_amounts_accepts_any_numeric_scalar_type():
+    s = pd.Series([np.int32(5), np.float32(2.5), Decimal("1.25"), True, "1,000 ₪", None, "x"], dtype=object)
+    out, failed = E.parse_amounts(s)
+    np.testing.assert_array_equal(out, [5, 2.5, 1.25, np.nan, 1000, np.nan, np.nan])
+    assert failed.tolist() == [False, False, False, True, False, False, True]
+
+
+def test_parse_dates_reads_numpy_serials():
+    s = pd.Series([np.int32(45000), np.float32(45001), "01/02/2025", None], dtype=object)
+    out, failed = E.parse_dates(s)
+    assert [str(d)[:10] for d in out[:3]] == ["2023-03-15", "2023-03-16", "2025-02-01"]
+    assert not failed.any()
+
+
+def test_arrow_snapshot_round_trip_keeps_dtypes_and_nulls():
+    pytest.importorskip("pyarrow")
+    df = pd.DataFrame({
+        "סכום": [1.5, np.nan, -3.0],
+        "מס": pd.array([1, None, 3], dtype="Int64"),
+        "תאריך": pd.to_datetime(["2025-01-01", None, "2025-01-03"]),
+        "אסמכתא": pd.Series([777, "OV1", None], dtype=object),
+        "פרטים": pd.Series(["א", None, ""], dtype=object),
+    })
+    df.columns = ["סכום", "מס", "תאריך", "אסמכתא", "סכום"]         # כותרת כפולה
+    back = E._arrow_to_frame(E._frame_to_arrow(df))
+    pd.testing.assert_frame_equal(back, df)
+    assert [type(v) for v in back.iloc[:, 3]] == [int, str, type(None)]
+
+
+def test_snapshot_is_reused_and_invalidated_by_version(monkeypatch, tmp_path):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(E, "INGEST_CACHE_DIR", str(tmp_path))
+    data, calls = _workbook(), []
+    read = E.read_sheet_df
+    monkeypatch.setattr(E, "read_sheet_df", lambda *a: calls.append(1) or read(*a))
+
+    first = E.read_sheet_snapshot(data, "DataSheet")
+    second = E.read_sheet_snapshot(data, "DataSheet")
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(first, second)
+
+    monkeypatch.setattr(E, "INGEST_SNAPSHOT_VERSION", E.INGEST_SNAPSHOT_VERSION + 1)
+    pd.testing.assert_frame_equal(E.read_sheet_snapshot(data, "DataSheet"), first)
+    assert len(calls) == 2 and len(list(tmp_path.glob("*.arrow"))) == 2
+
+
+def test_corrupt_snapshot_is_reread(monkeypatch, tmp_path):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(E, "INGEST_CACHE_DIR", str(tmp_path))
+    data = _workbook()
+    first = E.read_sheet_snapshot(data, "DataSheet")
+    (snap,) = tmp_path.glob("*.arrow")
+    snap.write_bytes(b"not arrow")
+    pd.testing.assert_frame_equal(E.read_sheet_snapshot(data, "DataSheet"), first)
@@ -0,0 +1,48 @@
+import threading
+
+import recon_engine as E
+
+
+def _wait(job):
+    for _ in range(500):
+        if job.done:
+            return
+        threading.Event().wait(0.01)
+
+
+def test_cancel_during_run_is_not_overwritten_by_done(monkeypatch):
+    started, release = threading.Event(), threading.Event()
+
+    def fake(*a, **k):
+        started.set()
+        release.wait(5)
+        return {1: 0}, b"out", "key"
+
+    monkeypatch.setattr(E, "process_workbook_cached", fake)
+    jobs = E.JobManager(workers=1)
+    jid = jobs.submit(b"main", None)
+    assert started.wait(5)
+    assert jobs.get(jid).status == "running"
+    jobs.cancel(jid)
+    release.set()
+    _wait(jobs.get(jid))
+    assert jobs.get(jid).status == "cancelled"
+
+
+def test_cancel_of_queued_job_never_runs(monkeypatch):
+    release, ran = threading.Event(), []
+
+    def fake(main, *a, **k):
+        ran.append(main)
+        release.wait(5)
+        return {}, b"", "key"
+
+    monkeypatch.setattr(E, "process_workbook_cached", fake)
+    jobs = E.JobManager(workers=1)
+    first, second = jobs.submit(b"a", None), jobs.submit(b"b", None)
+    jobs.cancel(second)
+    assert jobs.get(second).status == "cancelled"
+    release.set()
+    _wait(jobs.get(first))
+    _wait(jobs.get(second))
+    assert ran == [b"a"] and jobs.get(first).status == "done"
@@ -0,0 +1,102 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import recon_engine as E
+
+COLS = ["מס.התאמה", "קוד פעולת בנק", "סכום בדף", "סכום בספרים", "אסמכתא 1", "אסמכתא 2", "תאריך מאזן", "פרטים"]
+
+
+@pytest.fixture(autouse=True)
+def open_items_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(E, "OPEN_ITEMS_DB", str(tmp_path / "open_items.db"))
+    monkeypatch.setattr(E, "CHECKPOINTS", E.RuleCheckpoints())
+    return tmp_path / "open_items.db"
+
+
+def _sheet(*rows):
+    return E.export_workbook([("DataSheet", pd.DataFrame(list(rows), columns=COLS))])
+
+
+def _cheque_books(ref, amount, day, details="שיק"):
+    return [0, np.nan, np.nan, amount, f"CH{ref}", ref, pd.Timestamp(day), details]
+
+
+def _cheque_bank(ref, amount, day, details="שיק"):
+    return [0, E.RULE4_CODE, -amount, np.nan, ref, "", pd.Timestamp(day), details]
+
+
+def _run(data, period, account="A", **kw):
+    df, _, _ = E.process_workbook(data, None, carry_forward=True, account=account, period=period, **kw)
+    return df["מס.התאמה"].tolist()
+
+
+def _rows(db):
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT source, kind, ref, consumed_by FROM open_items ORDER BY id").fetchall()
+
+
+JAN = _sheet(_cheque_books("555", 100.0, "2025-01-20"))
+FEB = _sheet(_cheque_bank("555", 100.0, "2025-02-03"), _cheque_bank("900", 40.0, "2025-02-04"))
+FEB_V2 = _sheet(_cheque_bank("555", 100.0, "2025-02-03"), _cheque_bank("900", 40.0, "2025-02-04", "תוקן"))
+MAR = _sheet(_cheque_bank("555", 100.0, "2025-03-02"))
+
+
+def test_carry_forward_matches_previous_period(open_items_db):
+    assert _run(JAN, "2025-01") == [0]
+    assert _run(FEB, "2025-02") == [4, 0]
+    assert ("2025-01", "cheque_books", "555", "2025-02") in _rows(open_items_db)
+
+
+def test_corrected_period_replaces_previous_version(open_items_db):
+    _run(JAN, "2025-01")
+    _run(FEB, "2025-02")
+    assert _run(FEB_V2, "2025-02") == [4, 0]          # הגרסה הקודמת משחררת את השיק
+    rows = _rows(open_items_db)
+    assert [r for r in rows if r[0] == "2025-02"] == [("2025-02", "cheque_bank", "900", None)]
+    assert E.open_items_count("A") == 1
+
+
+def test_source_name_is_the_default_key():
+    _run(JAN, "", source_name="jan.xlsx")
+    assert _run(FEB, "", source_name="feb.xlsx") == [4, 0]
+    assert _run(FEB_V2, "", source_name="feb.xlsx") == [4, 0]
+
+
+def test_rerun_of_earlier_period_does_not_reopen_consumed_items():
+    _run(JAN, "2025-01")
+    _run(FEB, "2025-02")
+    shifted = _sheet(_cheque_books("777", 5.0, "2025-01-02"), _cheque_books("555", 100.0, "2025-01-20"))
+    assert _run(shifted, "2025-01") == [0, 0]
+    assert _run(MAR, "2025-03") == [0]                # 555 כבר נסגר בפברואר
+
+
+def test_scope_account_and_window():
+    _run(JAN, "2025-01")
+    assert _run(FEB, "2025-02", account="B") == [0, 0]
+    late = _sheet(_cheque_bank("555", 100.0, "2025-06-30"))
+    assert _run(late, "2025-06") == [0]
+
+
+def test_account_and_source_are_required():
+    with pytest.raises(ValueError):
+        _run(JAN, "2025-01", account=" ")
+    with pytest.raises(ValueError):
+        _run(JAN, "", source_name="")
+
+
+def test_legacy_unique_schema_is_rebuilt(open_items_db):
+    with sqlite3.connect(open_items_db) as conn:
+        conn.execute("CREATE TABLE open_items (id INTEGER PRIMARY KEY, source TEXT NOT NULL, "
+                     "source_name TEXT NOT NULL DEFAULT '', row INTEGER NOT NULL, kind TEXT NOT NULL, "
+                     "cents INTEGER NOT NULL, ref TEXT NOT NULL DEFAULT '', amount REAL, date TEXT, "
+                     "details TEXT, rows TEXT, consumed_by TEXT, UNIQUE (source, kind, row))")
+        conn.execute("INSERT INTO open_items (source, row, kind, cents) VALUES ('old', 2, 'other', 1)")
+    assert _run(JAN, "2025-01") == [0]
+    with sqlite3.connect(open_items_db) as conn:
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE name = 'open_items'").fetchone()[0]
+        assert "UNIQUE" not in sql
+        assert conn.execute("SELECT account, source FROM open_items ORDER BY id").fetchall() == [
+            ("", "old"), ("A", "2025-01")]
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import recon_engine as E
+
+
+def _pair(bank_days, books_days, window, bank_keys=None, books_keys=None):
+    """שורות בנק ואחריהן שורות ספרים; מחזיר זוגות (שורת בנק, שורת ספרים) ממוינים."""
+    nb, no = len(bank_days), len(books_days)
+    n = nb + no
+    key = np.r_[bank_keys if bank_keys is not None else [100] * nb,
+                books_keys if books_keys is not None else [100] * no].astype(np.int64)
+    day = np.r_[bank_days, books_days].astype(np.int64)
+    bank, books = np.zeros(n, bool), np.zeros(n, bool)
+    bank[:nb], books[nb:] = True, True
+    i, j = E.pair_nearest(bank, books, key, key, day, window)
+    return sorted(zip(i.tolist(), j.tolist()))
+
+
+@pytest.mark.parametrize("gap, window, paired", [(3, 3, True), (-3, 3, True), (4, 3, False), (0, 0, True)])
+def test_window_edges_are_inclusive(gap, window, paired):
+    assert bool(_pair([10], [10 + gap], window)) == paired
+
+
+def test_rows_are_used_once():
+    assert _pair([10], [9, 10, 11], 2) == [(0, 2)]
+    assert _pair([9, 10, 11], [10], 2) == [(1, 3)]
+
+
+def test_nearest_date_wins():
+    assert _pair([10], [6, 12], 5) == [(0, 2)]
+    assert _pair([10], [12, 6], 5) == [(0, 1)]
+
+
+def test_tie_goes_to_earlier_date():
+    assert _pair([10], [8, 12], 5) == [(0, 1)]
+    assert _pair([8, 12], [10], 5) == [(0, 2)]
+
+
+def test_keys_must_match_and_rows_do_not_pair_with_themselves():
+    assert _pair([10], [10], 3, bank_keys=[100], books_keys=[101]) == []
+    mask = np.ones(2, bool)
+    i, j = E.pair_nearest(mask, mask, np.array([5, 5]), np.array([5, 5]), np.array([0, 1]), 1)
+    assert (i != j).all()
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_pairs_are_valid_and_maximal(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 30))
+    key = rng.integers(0, 4, n)
+    day = rng.integers(0, 15, n)
+    bank = rng.random(n) < 0.5
+    books = ~bank
+    window = int(rng.integers(0, 4))
+    i, j = E.pair_nearest(bank, books, key, key, day, window)
+
+    used = np.r_[i, j]
+    assert len(set(used.tolist())) == len(used)
+    assert bank[i].all() and books[j].all()
+    assert (key[i] == key[j]).all() and (np.abs(day[i] - day[j]) <= window).all()
+    free = np.ones(n, bool)
+    free[used] = False
+    for b in np.flatnonzero(bank & free):
+        o = np.flatnonzero(books & free & (key == key[b]) & (np.abs(day - day[b]) <= window))
+        assert not len(o[o != b]), "זוג פנוי נשאר"
+
+
+def _rule1_frame(days_bank, days_books, amount=50.0):
+    rows = ([[0, 120, -amount, np.nan, "x", "", pd.Timestamp("2025-01-01") + pd.Timedelta(days=d), "a"]
+             for d in days_bank]
+            + [[0, np.nan, np.nan, amount, "OV1", "", pd.Timestamp("2025-01-01") + pd.Timedelta(days=d), "b"]
+               for d in days_books])
+    df = pd.DataFrame(rows, columns=["מס.התאמה", "קוד פעולת בנק", "סכום בדף", "סכום בספרים",
+                                     "אסמכתא 1", "אסמכתא 2", "תאריך מאזן", "פרטים"])
+    return E.build_recon_frame(df)
+
+
+@pytest.mark.parametrize("window", [0, 1])
+def test_rule1_window_keeps_uniqueness_guard(window):
+    rf = _rule1_frame([0, 0], [0, 0])
+    E._rule_1(rf, window)
+    assert rf.match.tolist() == [0, 0, 0, 0]
+
+
+def test_rule1_window_pairs_distinct_days():
+    rf = _rule1_frame([0, 5], [1, 5])
+    E._rule_1(rf, 1)
+    assert rf.match.tolist() == [1, 1, 1, 1]
+    rf = _rule1_frame([0], [2])
+    E._rule_1(rf, 1)
+    assert rf.match.tolist() == [0, 0]
@@ -0,0 +1,70 @@
+import io
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import recon_engine as E
+from recon_bench import generate_ledger
+
+PARAMS = [None, {"RULE1_DATE_WINDOW": 2, "SUBSET_MAX_GROUP": 3, "RULE4_EPS": 1.0}]
+
+
+def _inputs(tmp_path, zero_fill):
+    df, aux = generate_ledger(3_000, seed=7)
+    if zero_fill:
+        # צד ריק ממולא ב-0 (כמו בייצוא מחלק מהמערכות) – לא אמור לרכז הכול במחיצה אחת
+        for c in ("סכום בדף", "סכום בספרים"):
+            df[c] = pd.to_numeric(df[c], errors="coerce").fillna(0)
+    main = E.export_workbook([("DataSheet", df)])
+    path = tmp_path / "main.xlsx"
+    path.write_bytes(main)
+    return main, E.export_workbook([("עזר", aux)]), path
+
+
+@pytest.mark.parametrize("params", PARAMS)
+@pytest.mark.parametrize("zero_fill", [False, True])
+def test_partitioned_matches_process_workbook(tmp_path, params, zero_fill):
+    main, aux, path = _inputs(tmp_path, zero_fill)
+    df, vk_df, out = E.process_workbook(main, aux, params=params)
+    out_path = tmp_path / "out.xlsx"
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        counts = E.process_workbook_partitioned(str(path), aux, str(out_path), params=params,
+                                                memory_budget=2 * 2**20, workers=2)
+
+    assert counts == E._match_counts(df)
+    for sheet in ("DataSheet", "סיכום", E.VK_SHEET):
+        want = pd.read_excel(io.BytesIO(out), sheet_name=sheet)
+        got = pd.read_excel(out_path, sheet_name=sheet)
+        pd.testing.assert_frame_equal(got.astype(str), want.astype(str), check_dtype=False)
+    got_vk = pd.read_excel(out_path, sheet_name=E.VK_SHEET)
+    assert got_vk.columns.tolist() == [str(c) for c in vk_df.columns] and len(got_vk) == len(vk_df)
+    got_main = pd.read_excel(out_path, sheet_name="DataSheet")
+    assert len(got_main) == len(df)
+    np.testing.assert_array_equal(got_main[E.pick_col(df, E.MATCH_COLS)].to_numpy(),
+                                  df[E.pick_col(df, E.MATCH_COLS)].to_numpy())
+
+
+def test_zero_filled_sides_stay_within_budget(tmp_path):
+    _, aux, path = _inputs(tmp_path, zero_fill=True)
+    report = E.RunReport(trace_memory=False)
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        E.process_workbook_partitioned(str(path), aux, str(tmp_path / "out.xlsx"), report,
+                                       memory_budget=2 * 2**20)
+    over = [str(w.message) for w in caught if issubclass(w.category, RuntimeWarning)]
+    assert not [m for m in over if m.startswith(("כללים 1–2", "כללים 5–12"))], over
+
+
+def test_oversized_partition_warns(tmp_path):
+    # כל השורות באותו סכום – קבוצת מפתחות אחת גדולה מהמחיצה
+    n = 2_500
+    df = pd.DataFrame({"מס.התאמה": 0, "קוד פעולת בנק": 175, "סכום בדף": -10.0,
+                       "סכום בספרים": np.nan, "אסמכתא 1": "", "אסמכתא 2": "",
+                       "תאריך מאזן": pd.Timestamp("2025-01-01"), "פרטים": "x"}, index=range(n))
+    path = tmp_path / "main.xlsx"
+    path.write_bytes(E.export_workbook([("DataSheet", df)]))
+    with pytest.warns(RuntimeWarning, match="חורגת"):
+        E.process_workbook_partitioned(str(path), None, str(tmp_path / "out.xlsx"), memory_budget=1)
@@ -0,0 +1,33 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import recon_engine as E
+
+
+def _frame(n):
+    return pd.DataFrame({"פרטים": [f"שורה {i}" for i in range(n)], "סכום": range(n)})
+
+
+def test_frames_tier_is_bounded_by_bytes(tmp_path):
+    small, big = _frame(10), _frame(1000)
+    size = int(big.memory_usage(deep=True).sum())
+    cache = E.ResultCache(str(tmp_path), 2**20, 2**30, frame_bytes=size + 10)
+    cache.put_frame("a", small, disk=False)
+    cache.put_frame("b", big, disk=False)
+    assert cache.frame("a") is None and cache.frame("b") is big
+
+    cache.put_frame("huge", _frame(5000), disk=False)   # גדול מהתקרה – לא נשמר, לא מפנה
+    assert cache.frame("huge") is None and cache.frame("b") is big
+    assert cache._frames_size == size
+
+
+def test_concurrent_puts_of_same_key_leave_one_valid_file(tmp_path):
+    cache = E.ResultCache(str(tmp_path), 0, 2**30)
+    payloads = [bytes([i]) * 100_000 for i in range(8)]
+    with ThreadPoolExecutor(8) as ex:
+        list(ex.map(lambda d: cache.put("k", {1: 1}, d), payloads))
+    assert sorted(os.listdir(tmp_path)) == ["k.json", "k.xlsx"]
+    counts, data = cache.get("k")
+    assert counts == {1: 1} and data in payloads
@@ -0,0 +1,45 @@
+import pytest
+
+import recon_engine as E
+
+
+def _rule(**kw):
+    return dict({"match": 7, "codes": [485]}, **kw)
+
+
+def test_default_rules_are_valid():
+    assert E.validate_simple_rules(E.default_simple_rules()) == E.load_simple_rules("/nonexistent.json")
+
+
+@pytest.mark.parametrize("rule", [
+    "not a dict",
+    _rule(match=True),
+    _rule(match=7.0),
+    _rule(codes=485),
+    _rule(codes=[True]),
+    _rule(min_abs="10"),
+    _rule(max_abs=False),
+    _rule(details=5),
+])
+def test_wrong_types_raise_type_error(rule):
+    with pytest.raises(TypeError):
+        E.validate_simple_rules([rule])
+
+
+@pytest.mark.parametrize("rule", [
+    _rule(match=0),
+    _rule(codes=[]),
+    _rule(min_abs=100, max_abs=10),
+    _rule(sign="up"),
+    _rule(details_match="regex"),
+    _rule(extra=1),
+])
+def test_bad_values_raise_value_error(rule):
+    with pytest.raises(ValueError):
+        E.validate_simple_rules([rule])
+
+
+def test_valid_rule_is_normalized():
+    (r,) = E.validate_simple_rules([_rule(codes=[485, 485.0, 120], min_abs=1, max_abs=1.5, details="עמלה")])
+    assert r == {"match": 7, "codes": [120.0, 485.0], "sign": "nonzero", "min_abs": 1, "max_abs": 1.5,
+                 "details": "עמלה", "details_match": "exact"}
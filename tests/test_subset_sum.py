@@ -0,0 +1,69 @@
+import math
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+import recon_engine as E
+
+
+def _brute(vals, target, max_group):
+    return [c for k in range(2, max_group + 1) for c in combinations(range(len(vals)), k)
+            if sum(vals[i] for i in c) == target]
+
+
+@pytest.mark.parametrize("seed", range(40))
+def test_subset_sum_agrees_with_brute_force(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(2, 11))
+    vals = np.sort(rng.integers(1, 60, size=n))
+    max_group = int(rng.integers(2, 6))
+    if rng.random() < 0.7:                      # יעד שיש לו פתרון (לרוב)
+        k = int(rng.integers(2, min(max_group, n) + 1))
+        target = int(vals[rng.choice(n, size=k, replace=False)].sum())
+    else:
+        target = int(rng.integers(1, 200))
+
+    got = E._subset_sum(vals, target, max_group, math.inf)
+    want = _brute(vals.tolist(), target, max_group)
+    if not want:
+        assert got is None
+    else:
+        assert got is not None
+        assert 2 <= len(got) <= max_group and len(set(got)) == len(got)
+        assert int(vals[list(got)].sum()) == target
+
+
+def test_subset_sum_stops_at_deadline():
+    vals = np.arange(1, 30)
+    assert E._subset_sum(vals, 40, 4, math.inf) is not None
+    assert E._subset_sum(vals, 40, 4, 0.0) is None
+
+
+def _ledger(bank, books, days_b=0, days_books=None):
+    """שורת בנק אחת (אגורות) ואחריה שורות ספרים; מחזיר (match, bank_c, books_c, date)."""
+    n = 1 + len(books)
+    bank_c = np.zeros(n, np.int64)
+    books_c = np.zeros(n, np.int64)
+    bank_c[0] = bank
+    books_c[1:] = books
+    days = np.r_[days_b, days_books if days_books is not None else [days_b] * len(books)]
+    date = (np.datetime64("2025-01-01") + days.astype("timedelta64[D]")).astype("datetime64[ns]")
+    return np.zeros(n, np.int64), bank_c, books_c, date
+
+
+def test_subset_sum_match_marks_group_and_ledger():
+    match, bank_c, books_c, date = _ledger(-10_000, [3_000, 9_999, 7_000, -3_000])
+    ledger = E.PairLedger()
+    found = E.subset_sum_match(match, [0], [1, 2, 3, 4], bank_c, books_c, date, 11, 3, ledger=ledger)
+    assert found == 1
+    assert match.tolist() == [11, 11, 0, 11, 0]
+    assert len(ledger) == 3                    # קבוצה אחת: בנק + שתי שורות ספרים
+
+
+def test_subset_sum_match_respects_window_and_budget():
+    match, bank_c, books_c, date = _ledger(10_000, [3_000, 7_000], days_books=[0, 9])
+    assert E.subset_sum_match(match, [0], [1, 2], bank_c, books_c, date, 3, 2, window=7) == 0
+    assert E.subset_sum_match(match, [0], [1, 2], bank_c, books_c, date, 3, 2, window=None, budget=0) == 0
+    assert not match.any()
+    assert E.subset_sum_match(match, [0], [1, 2], bank_c, books_c, date, 3, 2, window=None) == 1
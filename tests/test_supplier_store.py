@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+import recon_engine as E
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    """מאגר ספקים ב-tmp_path: rules_store.json ישן לצד VK_DB שעוד לא קיים."""
+    legacy = tmp_path / "rules_store.json"
+    legacy.write_text(json.dumps({
+        "name_map": {"חשמל לישראל": "1001", "בזק": "1002"},
+        "amount_map": {"250.00": "2001", "-99.9": "2002"},
+    }, ensure_ascii=False), encoding="utf-8")
+    monkeypatch.setattr(E, "VK_FILE", str(legacy))
+    monkeypatch.setattr(E, "VK_DB", str(tmp_path / "rules_store.db"))
+    monkeypatch.setattr(E, "_MATCHER_CACHE", {})
+    monkeypatch.setattr(E, "_VK_READY", set())
+    return legacy
+
+
+def test_legacy_json_is_migrated_once(store):
+    s = E.vk_load()
+    assert s["name_map"]["חשמל לישראל"] == "1001" and s["name_map"]["בזק"] == "1002"
+    assert s["amount_map"] == {25000: "2001", 9990: "2002"}
+    assert set(E.DEFAULT_NAME_MAP) <= set(s["name_map"])
+
+    store.write_text(json.dumps({"name_map": {"חשמל לישראל": "9999"}}), encoding="utf-8")
+    E._VK_READY.clear()                                   # חיבור "חדש" – לא מהגר שוב
+    assert E.vk_load()["name_map"]["חשמל לישראל"] == "1001"
+
+
+def test_edit_bumps_version_and_rebuilds_matcher(store):
+    s = E.vk_load()
+    m = E.get_supplier_matcher(s["name_map"], s["version"])
+    assert E.get_supplier_matcher(s["name_map"], s["version"]) is m
+    assert m.resolve(["תשלום בזק בינלאומי"]) == ["1002"]
+
+    assert E.vk_upsert_names([("בזק", "1002")]) == 0              # בלי שינוי – אותה גרסה
+    assert E.vk_version() == s["version"]
+
+    assert E.vk_upsert_names([("בזק", "3003"), ("מים", "3004")]) == 2
+    s2 = E.vk_load()
+    assert s2["version"] == s["version"] + 1
+    m2 = E.get_supplier_matcher(s2["name_map"], s2["version"])
+    assert m2 is not m
+    assert m2.resolve(["תשלום בזק בינלאומי", "חשבון מים"]) == ["3003", "3004"]